@@ -0,0 +1,581 @@
+# aggregation.py - Incremental aggregates behind the five dashboard charts
+
+from startup import deferred_import
+
+# numpy and pandas load on first use rather than at import (see startup.py)
+np = deferred_import('numpy')
+pd = deferred_import('pandas')
+
+# Cleaned columns each aggregate reads, besides 'date' (always read, since rows with
+# invalid dates are left out of every aggregate)
+AGGREGATE_COLUMNS = {
+    'sentiment_counts': ['sentiment'],
+    'engagement_trend': ['engagements'],
+    'platform_engagements': ['platform', 'engagements'],
+    'media_type_counts': ['media_type'],
+    'location_engagements': ['location', 'engagements'],
+}
+ALL_AGGREGATES = list(AGGREGATE_COLUMNS)
+
+# Engagement trend buckets, finest first: pandas period alias, shortest length in hours
+# (used to bound the number of buckets over a time span) and label format
+TREND_BUCKETS = {
+    'hour': ('h', 1, '%Y-%m-%d %H:00'),
+    'day': ('D', 24, '%Y-%m-%d'),
+    'week': ('W', 7 * 24, 'week of %Y-%m-%d'),
+    'month': ('M', 28 * 24, '%B %Y'),
+}
+# Most buckets bucket_trend picks for a trend when no budget is given
+DEFAULT_TREND_MAX_POINTS = 1000
+
+
+def _combine(total, partial):
+    """Adds a partial per-key Series into a running total, keeping integer dtypes."""
+    if total is None:
+        return partial
+    return pd.concat([total, partial]).groupby(level=0, observed=True).sum()
+
+
+def _count_by(chunk, col):
+    """Row counts per value of col; unlike value_counts, skips unused categories."""
+    return chunk.groupby(col, observed=True).size()
+
+
+def _sum_by(chunk, col):
+    """Engagement totals per value of col, skipping unused categories."""
+    return chunk.groupby(col, observed=True)['engagements'].sum()
+
+
+def _plain_index(series):
+    """Replaces a CategoricalIndex with plain labels (so charts do not inherit the category order)."""
+    if isinstance(series.index, pd.CategoricalIndex):
+        return series.set_axis(series.index.astype(series.index.categories.dtype))
+    return series
+
+
+def _ranked(series, name):
+    """Sorts a per-key total descending (ties keep key order), with plain labels as the index."""
+    if series is None:
+        series = pd.Series(dtype='int64')
+    return _plain_index(series).sort_values(ascending=False, kind='stable').rename(name)
+
+
+def _chronological(series, name):
+    """Sorts a per-date total by date."""
+    if series is None:
+        series = pd.Series(dtype='int64', index=pd.DatetimeIndex([], name='date'))
+    return series.sort_index().rename(name)
+
+
+# How each aggregate's running total is turned into its final Series
+_FINISHERS = {
+    'sentiment_counts': lambda series: _ranked(series, 'count'),
+    'engagement_trend': lambda series: _chronological(series, 'engagements'),
+    'platform_engagements': lambda series: _ranked(series, 'engagements'),
+    'media_type_counts': lambda series: _ranked(series, 'count'),
+    'location_engagements': lambda series: _ranked(series, 'engagements'),
+}
+
+
+class SpaceSaving:
+    """
+    Weighted Space-Saving summary of per-key totals (e.g. engagements per location) in fixed
+    memory: at most `capacity` keys are tracked, however many distinct keys are fed in.
+    - counts never underestimate: a tracked key's true total lies in [count - error, count].
+    - floor bounds the true total of every untracked key, so any key whose total exceeds
+      the floor is tracked.
+    Chunks are folded in as exact per-key totals (update), and summaries of other chunks,
+    files or saved states can be merged in (merge); memory stays within capacity plus the
+    keys of one chunk.
+    """
+
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self.counts = pd.Series(dtype='int64')
+        self.errors = pd.Series(dtype='int64')
+        self.floor = 0
+
+    def update(self, partial):
+        """Folds exact per-key totals (a Series, e.g. of one chunk) into the summary."""
+        partial = _plain_index(partial).astype('int64')
+        self._fold(partial, pd.Series(0, index=partial.index, dtype='int64'), 0)
+
+    def merge(self, other):
+        """Folds another summary into this one, keeping this summary's capacity."""
+        self._fold(other.counts, other.errors, other.floor)
+
+    def _fold(self, counts, errors, floor):
+        # A key missing from one side may still have up to that side's floor there
+        keys = self.counts.index.union(counts.index)
+        merged_counts = self.counts.reindex(keys, fill_value=self.floor) + counts.reindex(keys, fill_value=floor)
+        merged_errors = self.errors.reindex(keys, fill_value=self.floor) + errors.reindex(keys, fill_value=floor)
+        self.floor += floor
+        if len(keys) > self.capacity:
+            # Keep the largest counts; the largest dropped one bounds every untracked key
+            order = np.argsort(-merged_counts.to_numpy(), kind='stable')
+            self.floor = max(self.floor, int(merged_counts.iloc[order[self.capacity]]))
+            merged_counts = merged_counts.iloc[order[:self.capacity]]
+            merged_errors = merged_errors.iloc[order[:self.capacity]]
+        self.counts, self.errors = merged_counts, merged_errors
+
+    def to_dict(self):
+        """Returns the summary as a JSON-serializable dict (see from_dict)."""
+        return {
+            'capacity': self.capacity, 'floor': self.floor, 'keys': [str(key) for key in self.counts.index],
+            'values': self.counts.tolist(), 'errors': self.errors.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data, name=None):
+        """Restores a summary saved with to_dict (name names the key index)."""
+        summary = cls(data['capacity'])
+        index = pd.Index(data['keys'], name=name)
+        summary.counts = pd.Series(data['values'], index=index, dtype='int64')
+        summary.errors = pd.Series(data['errors'], index=index, dtype='int64')
+        summary.floor = data['floor']
+        return summary
+
+
+def _coarser_freq(freq, other):
+    """Returns the coarser of two trend_freq values (None, the full timestamp, is the finest)."""
+    if freq is None or other is None:
+        return other if freq is None else freq
+    return max(freq, other, key=lambda f: pd.Timedelta(1, unit=f))
+
+
+def _floor_trend(trend, freq):
+    """Re-buckets a trend to a coarser fixed frequency (exact, since its keys are floored timestamps)."""
+    return trend.groupby(trend.index.floor(freq)).sum()
+
+
+class StreamingAggregator:
+    """
+    Builds the five chart aggregates from cleaned chunks of rows.
+    Each chunk is reduced to per-key partial results and folded into running totals,
+    so memory scales with the number of distinct keys rather than the number of rows.
+    Feeding a whole DataFrame as a single chunk gives the same result.
+
+    trend_freq controls how the engagement trend is keyed:
+    - None keeps the full timestamp (one point per distinct 'date' value).
+    - A fixed frequency such as 'h' or 'D' buckets by hour or calendar day; the number of
+      trend keys is then bounded by the time span, whatever the timestamp granularity.
+
+    aggregates lists the names (keys of AGGREGATE_COLUMNS) to compute; the others are
+    skipped entirely and left out of result(). Defaults to all five.
+
+    location_capacity switches the location totals to an approximate top-k in fixed memory:
+    - None keeps exact totals for every distinct location.
+    - An integer tracks at most that many locations with a SpaceSaving summary (for free-text
+      locations with millions of distinct values); result() then also has error bounds.
+    """
+
+    def __init__(self, trend_freq=None, aggregates=None, location_capacity=None):
+        unknown = set(aggregates or []) - set(AGGREGATE_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown aggregates: {', '.join(sorted(unknown))}")
+        self.trend_freq = trend_freq
+        self.aggregates = [name for name in ALL_AGGREGATES if aggregates is None or name in aggregates]
+        self.location_capacity = location_capacity
+        self.rows = 0
+        self._totals = dict.fromkeys(self.aggregates)
+        if location_capacity is not None and 'location_engagements' in self._totals:
+            self._totals['location_engagements'] = SpaceSaving(location_capacity)
+
+    def update(self, chunk):
+        """Folds one cleaned chunk (normalized columns, datetime 'date') into the totals."""
+        self.rows += len(chunk)
+
+        partials = {}
+        if 'sentiment_counts' in self._totals:
+            partials['sentiment_counts'] = _count_by(chunk, 'sentiment')
+        if 'engagement_trend' in self._totals:
+            trend_key = chunk['date'] if self.trend_freq is None else chunk['date'].dt.floor(self.trend_freq)
+            partials['engagement_trend'] = chunk['engagements'].groupby(trend_key).sum()
+        if 'platform_engagements' in self._totals:
+            partials['platform_engagements'] = _sum_by(chunk, 'platform')
+        if 'media_type_counts' in self._totals:
+            partials['media_type_counts'] = _count_by(chunk, 'media_type')
+        if 'location_engagements' in self._totals:
+            partials['location_engagements'] = _sum_by(chunk, 'location')
+        for name, partial in partials.items():
+            self._fold(name, partial)
+
+    def _fold(self, name, partial):
+        # partial is a per-key Series, or a SpaceSaving summary from another aggregator
+        total = self._totals[name]
+        if isinstance(total, SpaceSaving):
+            if isinstance(partial, SpaceSaving):
+                total.merge(partial)
+            else:
+                total.update(partial)
+        else:
+            self._totals[name] = _combine(total, partial)
+
+    def merge(self, other):
+        """
+        Folds the totals of another aggregator (e.g. one fed with a different file, possibly
+        in another process) into this one, as if its chunks had been fed here.
+        Both must compute the same aggregates with the same location_capacity. If their
+        trend_freq differs (e.g. a state saved with daily keys and new rows with hourly
+        keys), the finer trend is re-bucketed to the coarser one.
+        """
+        if (other.aggregates, other.location_capacity) != (self.aggregates, self.location_capacity):
+            raise ValueError("Only aggregators with the same aggregates and location_capacity can be merged")
+        trend_freq = _coarser_freq(self.trend_freq, other.trend_freq)
+        if self.trend_freq != trend_freq and self._totals.get('engagement_trend') is not None:
+            self._totals['engagement_trend'] = _floor_trend(self._totals['engagement_trend'], trend_freq)
+        self.trend_freq = trend_freq
+        self.rows += other.rows
+        for name, partial in other._totals.items():
+            if partial is None:
+                continue
+            if name == 'engagement_trend' and other.trend_freq != trend_freq:
+                partial = _floor_trend(partial, trend_freq)
+            self._fold(name, partial)
+
+    def to_dict(self):
+        """
+        Returns the running totals (and row count) as a JSON-serializable dict, so they can be
+        persisted and later restored with from_dict and merged with the totals of new rows.
+        """
+        totals = {}
+        for name, total in self._totals.items():
+            if isinstance(total, SpaceSaving):
+                totals[name] = total.to_dict()
+            elif total is not None:
+                keys = [timestamp.isoformat() for timestamp in total.index] if name == 'engagement_trend' else [str(key) for key in total.index]
+                totals[name] = {'keys': keys, 'values': total.astype('int64').tolist()}
+        return {
+            'trend_freq': self.trend_freq, 'aggregates': self.aggregates, 'location_capacity': self.location_capacity,
+            'rows': self.rows, 'totals': totals,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Restores an aggregator saved with to_dict."""
+        aggregator = cls(trend_freq=data['trend_freq'], aggregates=data['aggregates'], location_capacity=data.get('location_capacity'))
+        aggregator.rows = data['rows']
+        for name, total in data['totals'].items():
+            if 'capacity' in total:
+                aggregator._totals[name] = SpaceSaving.from_dict(total, name=AGGREGATE_COLUMNS[name][0])
+                continue
+            if name == 'engagement_trend':
+                index = pd.DatetimeIndex(pd.to_datetime(total['keys']), name='date')
+            else:
+                index = pd.Index(total['keys'], name=AGGREGATE_COLUMNS[name][0])
+            aggregator._totals[name] = pd.Series(total['values'], index=index, dtype='int64')
+        return aggregator
+
+    def result(self):
+        """
+        Returns the requested aggregates as a dict of Series:
+        - 'sentiment_counts': row counts per sentiment (descending).
+        - 'engagement_trend': engagement totals per date key (chronological); see bucket_trend
+          for turning it into hour, day, week or month buckets for display.
+        - 'platform_engagements': engagement totals per platform (descending).
+        - 'media_type_counts': row counts per media type (descending).
+        - 'location_engagements': engagement totals per location (descending).
+        With a location_capacity, 'location_engagements' holds the estimated totals of the
+        tracked locations, and 'location_engagements_error' (same index) how much each may
+        overestimate: a location's true total lies in [estimate - error, estimate].
+        """
+        results = {}
+        for name, total in self._totals.items():
+            if isinstance(total, SpaceSaving):
+                results[name] = _FINISHERS[name](total.counts.rename_axis('location'))
+                results[f'{name}_error'] = total.errors.rename_axis('location').reindex(results[name].index).rename('error')
+            else:
+                results[name] = _FINISHERS[name](total)
+        return results
+
+
+class AggregateCube:
+    """
+    The cleaned rows rolled up once into cells keyed by day x platform x sentiment x
+    media_type x location, each holding the engagement sum and the row count.
+    Filters (a date range and value sets per dimension) select cells instead of rows, and
+    the five chart aggregates are re-derived from the selected cells with np.bincount over
+    integer codes, so a filter change never touches the rows again:
+    - Cells are sorted by platform, sentiment and then day, so filters on those three only
+      pick contiguous ranges of cells (nothing is copied); other filters add masks.
+    - A rollup without location (at most days x platforms x sentiments x media types cells)
+      answers every aggregate except the location one.
+    - The unfiltered aggregates are computed once and reused.
+    """
+
+    DIMENSIONS = ['platform', 'sentiment', 'media_type', 'location']
+    # Sort order of the cells; the leading dimensions and the day can be selected by range
+    KEY_ORDER = ['platform', 'sentiment', 'day', 'media_type', 'location']
+
+    def __init__(self, days, categories, columns, ranges=None, masks=None, rollup=None):
+        # days: sorted DatetimeIndex; categories: {dimension: Index of labels}
+        # columns: per-cell arrays sorted by KEY_ORDER: 'day' (codes into days), one per dimension
+        # (codes into its categories, len(categories) marking a missing value), and 'engagements'
+        # and 'counts' as float64 (the weight type np.bincount uses)
+        # ranges: selected (start, stop) cell ranges; masks: {dimension: allowed-codes lookup table}
+        self.days = days
+        self.categories = categories
+        self.columns = columns
+        self.dimensions = [dim for dim in self.DIMENSIONS if dim in columns]
+        self.ranges = [(0, len(columns['counts']))] if ranges is None else ranges
+        self.masks = masks or {}
+        self.rollup = rollup
+        self._aggregates = None
+
+    @classmethod
+    def from_frame(cls, df):
+        """Builds the cube (and its location-free rollup) from a cleaned frame (see analytics.clean_frame)."""
+        day_codes, days = pd.factorize(df['date'].dt.floor('D'), sort=True)
+        days = pd.DatetimeIndex(days, name='date')
+        categories = {}
+        columns = {'day': day_codes.astype('int64')}
+        for dim in cls.DIMENSIONS:
+            column = df[dim] if isinstance(df[dim].dtype, pd.CategoricalDtype) else df[dim].astype('category')
+            categories[dim] = pd.Index(column.cat.categories)
+            codes = column.cat.codes.to_numpy(dtype='int64')
+            columns[dim] = np.where(codes < 0, len(categories[dim]), codes)
+        columns['engagements'] = df['engagements'].to_numpy(dtype='float64')
+        columns['counts'] = np.ones(len(df))
+
+        return cls._from_columns(days, categories, columns)
+
+    @classmethod
+    def _from_columns(cls, days, categories, columns):
+        # Groups per-row (or per-cell) columns into the cells of a cube and its location-free rollup
+        cells = cls._group(days, categories, columns, cls.DIMENSIONS)
+        rollup = cls(days, categories, cls._group(days, categories, cells, [dim for dim in cls.DIMENSIONS if dim != 'location']))
+        return cls(days, categories, cells, rollup=rollup)
+
+    @classmethod
+    def _group(cls, days, categories, columns, dimensions):
+        # Sums engagements and counts per distinct key of the given dimensions (plus the day),
+        # returning cell columns sorted by KEY_ORDER
+        key_order = [name for name in cls.KEY_ORDER if name == 'day' or name in dimensions]
+        radices = {name: len(days) if name == 'day' else len(categories[name]) + 1 for name in key_order}
+        key = np.zeros(len(columns['counts']), dtype='int64')
+        for name in key_order:
+            key = key * radices[name] + columns[name]
+        cell_of_row, cell_keys = pd.factorize(key, sort=True)
+
+        cells = {
+            'engagements': np.bincount(cell_of_row, weights=columns['engagements'], minlength=len(cell_keys)),
+            'counts': np.bincount(cell_of_row, weights=columns['counts'], minlength=len(cell_keys)),
+        }
+        remaining = np.asarray(cell_keys, dtype='int64')
+        for name in reversed(key_order):
+            remaining, cells[name] = np.divmod(remaining, radices[name])
+        return cells
+
+    @classmethod
+    def merge(cls, cubes):
+        """
+        Merges whole cubes (e.g. one per uploaded file, built in parallel) into one cube, as if
+        built from all their rows: days and labels are unioned, and cells with the same key summed.
+        """
+        cubes = list(cubes)
+        days = pd.DatetimeIndex(sorted(set().union(*(cube.days for cube in cubes))), name='date')
+        # Labels keep the order in which the cubes first have them, like categories read from one file
+        categories = {
+            dim: pd.Index(list(dict.fromkeys(label for cube in cubes for label in cube.categories[dim])), dtype=cubes[0].categories[dim].dtype)
+            for dim in cls.DIMENSIONS
+        }
+        parts = []
+        for cube in cubes:
+            # Recode each cube's cells against the merged days and labels (missing stays last)
+            recoded = {'day': days.get_indexer(cube.days)[cube.columns['day']]}
+            for dim in cls.DIMENSIONS:
+                lookup = np.append(categories[dim].get_indexer(cube.categories[dim]), len(categories[dim]))
+                recoded[dim] = lookup[cube.columns[dim]]
+            recoded['engagements'] = cube.columns['engagements']
+            recoded['counts'] = cube.columns['counts']
+            parts.append(recoded)
+        columns = {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+        return cls._from_columns(days, categories, columns)
+
+    def filter(self, start=None, end=None, **values):
+        """
+        Returns the sub-cube of cells within [start, end] (inclusive days; None is open-ended)
+        whose dimensions take one of the given values, e.g. filter(platform=['TikTok']).
+        Dimensions not given (or given as None) are not filtered.
+        """
+        unknown = set(values) - set(self.DIMENSIONS)
+        if unknown:
+            raise ValueError(f"Unknown dimensions: {', '.join(sorted(unknown))}")
+        values = {dim: wanted for dim, wanted in values.items() if wanted is not None}
+        if start is None and end is None and not values:
+            return self
+
+        allowed = {}
+        for dim, wanted in values.items():
+            # Lookup table over the codes (the last slot, for missing values, stays False)
+            table = np.zeros(len(self.categories[dim]) + 1, dtype=bool)
+            indexer = self.categories[dim].get_indexer(list(wanted))
+            table[indexer[indexer >= 0]] = True
+            allowed[dim] = table
+
+        first_day = 0 if start is None else self.days.searchsorted(pd.Timestamp(start).floor('D'))
+        last_day = len(self.days) if end is None else self.days.searchsorted(pd.Timestamp(end).floor('D'), side='right')
+
+        platform, sentiment, day = (self.columns[name] for name in ('platform', 'sentiment', 'day'))
+        ranges = []
+        for range_start, range_stop in self.ranges:
+            # Within a range, cells run through (platform, sentiment) blocks, each sorted by day
+            block = platform[range_start:range_stop] * (len(self.categories['sentiment']) + 1) + sentiment[range_start:range_stop]
+            block_edges = np.flatnonzero(np.diff(block)) + 1
+            for block_start, block_stop in zip(np.r_[0, block_edges] + range_start, np.r_[block_edges, len(block)] + range_start):
+                if 'platform' in allowed and not allowed['platform'][platform[block_start]]:
+                    continue
+                if 'sentiment' in allowed and not allowed['sentiment'][sentiment[block_start]]:
+                    continue
+                block_days = day[block_start:block_stop]
+                selected_start = block_start + np.searchsorted(block_days, first_day, side='left')
+                selected_stop = block_start + np.searchsorted(block_days, last_day, side='left')
+                if selected_start < selected_stop:
+                    ranges.append((int(selected_start), int(selected_stop)))
+
+        masks = {**self.masks, **{dim: table for dim, table in allowed.items() if dim not in ('platform', 'sentiment')}}
+        rollup = None
+        if self.rollup is not None and 'location' not in values:
+            rollup = self.rollup.filter(start=start, end=end, **values)
+        return AggregateCube(self.days, self.categories, self.columns, ranges=ranges, masks=masks, rollup=rollup)
+
+    def _selected(self, *names):
+        # Yields the selected cells of the given columns, one tuple of arrays per range
+        for range_start, range_stop in self.ranges:
+            arrays = [self.columns[name][range_start:range_stop] for name in names]
+            if self.masks:
+                keep = np.logical_and.reduce([table[self.columns[dim][range_start:range_stop]] for dim, table in self.masks.items()])
+                arrays = [array[keep] for array in arrays]
+            yield arrays
+
+    def _counts_by(self, name, size, sum_engagements=False):
+        # Row counts (and engagement sums) per code of a column over the selected cells
+        rows = np.zeros(size)
+        totals = np.zeros(size) if sum_engagements else rows
+        for codes, counts, engagements in self._selected(name, 'counts', 'engagements'):
+            rows += np.bincount(codes, weights=counts, minlength=size)
+            if sum_engagements:
+                totals += np.bincount(codes, weights=engagements, minlength=size)
+        return rows, totals
+
+    @property
+    def rows(self):
+        """Number of source rows in the selected cells."""
+        source = self.rollup or self
+        return int(sum(counts.sum() for (counts,) in source._selected('counts')))
+
+    def values(self, dimension):
+        """Returns the sorted labels of a dimension present in the selected cells."""
+        source = self.rollup if self.rollup is not None and dimension in self.rollup.dimensions else self
+        labels = self.categories[dimension]
+        rows, _ = source._counts_by(dimension, len(labels) + 1)
+        return sorted(labels[rows[:len(labels)] > 0])
+
+    def date_range(self):
+        """Returns the first and last day with rows in the selected cells, or (None, None)."""
+        rows, _ = (self.rollup or self)._counts_by('day', len(self.days))
+        present = np.flatnonzero(rows)
+        if len(present) == 0:
+            return None, None
+        return self.days[present[0]], self.days[present[-1]]
+
+    def _totals(self, name, labels, sum_engagements):
+        # Per-label totals, keeping only labels with at least one row; codes past the last
+        # label (missing values) fall into a trailing slot that is dropped
+        rows, totals = self._counts_by(name, len(labels) + (name != 'day'), sum_engagements)
+        present = rows[:len(labels)] > 0
+        return pd.Series(totals[:len(labels)][present].astype('int64'), index=labels[present])
+
+    def aggregates(self):
+        """Returns the five chart aggregates of the selected cells, like StreamingAggregator(trend_freq='D').result()."""
+        if self._aggregates is None:
+            source = self.rollup or self
+            labels = {dim: self.categories[dim].rename(dim) for dim in self.DIMENSIONS}
+            totals = {
+                'sentiment_counts': source._totals('sentiment', labels['sentiment'], sum_engagements=False),
+                'engagement_trend': source._totals('day', self.days, sum_engagements=True),
+                'platform_engagements': source._totals('platform', labels['platform'], sum_engagements=True),
+                'media_type_counts': source._totals('media_type', labels['media_type'], sum_engagements=False),
+                'location_engagements': self._totals('location', labels['location'], sum_engagements=True),
+            }
+            self._aggregates = {name: _FINISHERS[name](total) for name, total in totals.items()}
+        return self._aggregates
+
+
+def choose_trend_bucket(index, max_points=DEFAULT_TREND_MAX_POINTS, finest='hour'):
+    """
+    Returns the finest bucket name in TREND_BUCKETS, no finer than finest, that splits the
+    time span of a DatetimeIndex into at most max_points buckets ('month' if none does).
+    """
+    names = list(TREND_BUCKETS)
+    candidates = names[names.index(finest):]
+    if len(index) < 2:
+        return candidates[0]
+    span_hours = (index.max() - index.min()) / pd.Timedelta(hours=1)
+    for name in candidates:
+        # +2: the first and last buckets may be partial
+        if span_hours / TREND_BUCKETS[name][1] + 2 <= max_points:
+            return name
+    return candidates[-1]
+
+
+def bucket_trend(trend, bucket='auto', max_points=DEFAULT_TREND_MAX_POINTS, finest='hour'):
+    """
+    Sums an engagement trend (e.g. StreamingAggregator.result()['engagement_trend']) into
+    buckets of one of TREND_BUCKETS, each labeled by its start (weeks start on Monday).
+    bucket='auto' picks one with choose_trend_bucket; finest is the resolution the trend
+    already has (e.g. 'day' for AggregateCube). Returns (bucketed trend, bucket name).
+    """
+    if bucket == 'auto':
+        bucket = choose_trend_bucket(trend.index, max_points, finest)
+    elif bucket not in TREND_BUCKETS:
+        raise ValueError(f"Unknown trend bucket {bucket!r}; expected 'auto' or one of {', '.join(TREND_BUCKETS)}.")
+    starts = trend.index.to_period(TREND_BUCKETS[bucket][0]).start_time.rename(trend.index.name)
+    return trend.groupby(starts).sum(), bucket
+
+
+def format_trend_bucket(timestamp, bucket):
+    """Formats the start of a trend bucket for insights, e.g. '2024-03-01 14:00' or 'March 2024'."""
+    return timestamp.strftime(TREND_BUCKETS[bucket][2])
+
+
+def downsample_lttb(series, target_points):
+    """
+    Reduces a time series to at most target_points with Largest-Triangle-Three-Buckets.
+    The first and last points are kept; every bucket in between keeps the one point that
+    forms the largest triangle with its neighbours, which preserves peaks, dips and the
+    overall shape far better than striding or averaging.
+    Series with a datetime or numeric index are supported; short series are returned as is.
+    """
+    n = len(series)
+    if target_points is None or target_points < 3 or n <= target_points:
+        return series
+
+    if isinstance(series.index, pd.DatetimeIndex):
+        x = (series.index.asi8 - series.index.asi8[0]).astype('float64')
+    else:
+        x = series.index.to_numpy(dtype='float64')
+    y = series.to_numpy(dtype='float64')
+
+    # Interior points are split into target_points - 2 buckets of (nearly) equal size
+    edges = np.floor(np.linspace(1, n - 1, target_points - 1)).astype('int64')
+    selected = np.empty(target_points, dtype='int64')
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for i in range(target_points - 2):
+        start, end = edges[i], edges[i + 1]
+        # Average of the next bucket (or the last point, for the final bucket)
+        next_start, next_end = (end, edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        areas = np.abs(
+            (x[previous] - avg_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (avg_y - y[previous])
+        )
+        previous = start + int(areas.argmax())
+        selected[i + 1] = previous
+    return series.iloc[selected]
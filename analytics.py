@@ -0,0 +1,399 @@
+# analytics.py - One lazy analytics engine behind the Flask, Streamlit and Colab dashboards
+#
+# A frontend declares the aggregates it renders; the engine works out the columns they
+# need, cleans only those (with the same rules everywhere) and computes only those
+# aggregates, in a single pass over the rows:
+#
+#   analysis = Analysis(['sentiment_counts', 'engagement_trend'])
+#   aggregates = analysis.run_file(path)  # reads only analysis.columns; or feed(chunk) per chunk
+#
+# Several files (e.g. one export per platform or per day) are analyzed in parallel, one
+# worker process per file, and their partial aggregates merged:
+#
+#   aggregates = analyze_files(paths).result()
+#
+# In append mode, an Analysis of just the new rows is merged into a dataset's persisted state:
+#
+#   delta = Analysis()
+#   delta.run_file(delta_path)
+#   merged, appended = AnalysisStore().append('campaign', delta, upload_hash)
+
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import fcntl
+except ImportError: # Windows: appends are then serialized within one process only
+    fcntl = None
+
+from aggregation import AGGREGATE_COLUMNS, ALL_AGGREGATES, AggregateCube, StreamingAggregator
+from ingestion import (
+    CATEGORY_COLUMNS, DEFAULT_CHUNKSIZE, REQUIRED_COLUMNS, detect_format, infer_date_format, iter_table_chunks,
+    lowercase_category, narrowest_int, parse_dates, read_table, to_typed_columns,
+)
+from startup import deferred_import
+from timing import StageTimer
+
+pd = deferred_import('pandas')
+
+# Most worker processes used to analyze several files at once
+PARALLEL_MAX_WORKERS = int(os.environ.get('PARALLEL_MAX_WORKERS', os.cpu_count() or 1))
+
+# Directory of persisted dataset states for append mode (see AnalysisStore)
+ANALYSIS_STORE_DIR = os.environ.get('ANALYSIS_STORE_DIR', '.analysis_store')
+
+# Resolution the engagement trend is aggregated at, shared by every frontend; charts sum it
+# into hour, day, week or month buckets to fit their point budget (see aggregation.bucket_trend)
+DEFAULT_TREND_FREQ = 'h'
+
+
+class AnalysisError(Exception):
+    """Raised when an upload can't be analyzed because of its contents; the message is user-facing."""
+
+
+def required_columns(aggregates=ALL_AGGREGATES):
+    """Returns the normalized columns needed to compute the given aggregates, in file order."""
+    needed = {'date'}.union(*(AGGREGATE_COLUMNS[name] for name in aggregates))
+    return [col for col in REQUIRED_COLUMNS if col in needed]
+
+
+def clean_frame(df, columns=REQUIRED_COLUMNS, date_format=None):
+    """
+    Applies the dashboards' cleaning rules to the given columns of a frame with
+    normalized column names (raw, or typed by to_typed_columns):
+    - 'date' is parsed to datetime; rows whose date is missing or invalid are dropped.
+    - 'engagements' is made numeric, missing or invalid values become 0, and it is
+      stored in the narrowest integer dtype.
+    - 'sentiment' is lowercased, so 'Positive' and 'positive' are grouped together.
+    - The other text dimensions are stored as categoricals.
+    Returns (cleaned frame with just those columns, number of dropped rows).
+    """
+    cleaned = pd.DataFrame(index=df.index)
+    for col in columns:
+        if col == 'date':
+            cleaned[col] = parse_dates(df[col], date_format=date_format, errors='coerce')
+        elif col == 'engagements':
+            cleaned[col] = narrowest_int(pd.to_numeric(df[col], errors='coerce').fillna(0))
+        elif col == 'sentiment':
+            cleaned[col] = lowercase_category(df[col])
+        elif col in CATEGORY_COLUMNS:
+            cleaned[col] = df[col] if isinstance(df[col].dtype, pd.CategoricalDtype) else df[col].astype('category')
+        else:
+            cleaned[col] = df[col]
+
+    invalid_dates = cleaned['date'].isna()
+    dropped_rows = int(invalid_dates.sum())
+    if dropped_rows:
+        cleaned = cleaned[~invalid_dates]
+    return cleaned, dropped_rows
+
+
+class Analysis:
+    """
+    A lazily evaluated set of chart aggregates over one dataset.
+    Nothing is computed when the analysis is declared: .columns tells readers which
+    columns to load, and each chunk fed in is cleaned (only those columns, with the date
+    format detected once from the first chunk) and folded into only the requested aggregates.
+    - rows: rows aggregated so far (after cleaning).
+    - dropped_rows: rows left out because of a missing or invalid date.
+    - location_capacity: None for exact location totals, or the number of locations tracked
+      by an approximate top-k in fixed memory (see StreamingAggregator).
+    """
+
+    def __init__(self, aggregates=ALL_AGGREGATES, trend_freq=DEFAULT_TREND_FREQ, location_capacity=None):
+        self.aggregates = list(aggregates)
+        self.trend_freq = trend_freq
+        self.location_capacity = location_capacity
+        self.columns = required_columns(self.aggregates)
+        self.date_format = None
+        self.dropped_rows = 0
+        self._aggregator = StreamingAggregator(trend_freq=trend_freq, aggregates=self.aggregates, location_capacity=location_capacity)
+
+    @property
+    def rows(self):
+        return self._aggregator.rows
+
+    def clean(self, chunk):
+        """
+        Cleans the columns this analysis needs from one chunk and counts the dropped rows.
+        Raises AnalysisError if one of those columns is missing.
+        """
+        error = missing_column_error(chunk.columns, self.columns)
+        if error:
+            raise AnalysisError(error)
+        if self.date_format is None and not pd.api.types.is_datetime64_any_dtype(chunk['date']):
+            self.date_format = infer_date_format(chunk['date'].unique())
+        cleaned, dropped_rows = clean_frame(chunk, self.columns, date_format=self.date_format)
+        self.dropped_rows += dropped_rows
+        return cleaned
+
+    def update(self, cleaned_chunk):
+        """Folds an already cleaned chunk (e.g. from clean_frame) into the aggregates."""
+        self._aggregator.update(cleaned_chunk)
+
+    def feed(self, chunk):
+        """Cleans one chunk and folds it into the aggregates."""
+        self.update(self.clean(chunk))
+
+    def run(self, chunks):
+        """Feeds every chunk of an iterable and returns the result."""
+        for chunk in chunks:
+            self.feed(chunk)
+        return self.result()
+
+    def run_file(self, source, filename=None, chunksize=DEFAULT_CHUNKSIZE):
+        """Reads only this analysis' columns from a CSV, Parquet or Feather file and returns the result."""
+        return self.run(iter_table_chunks(source, filename, chunksize=chunksize, columns=self.columns))
+
+    def merge(self, other):
+        """Folds another Analysis of the same aggregates (e.g. of another file) into this one."""
+        self._aggregator.merge(other._aggregator)
+        self.trend_freq = self._aggregator.trend_freq
+        self.dropped_rows += other.dropped_rows
+
+    def result(self):
+        """Returns the requested aggregates (see StreamingAggregator.result)."""
+        return self._aggregator.result()
+
+    def to_dict(self):
+        """Returns the mergeable state of this analysis as a JSON-serializable dict (see from_dict)."""
+        return {'dropped_rows': self.dropped_rows, 'aggregator': self._aggregator.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Restores an analysis saved with to_dict; more chunks or analyses can then be merged in."""
+        aggregator = StreamingAggregator.from_dict(data['aggregator'])
+        analysis = cls(aggregator.aggregates, trend_freq=aggregator.trend_freq, location_capacity=aggregator.location_capacity)
+        analysis._aggregator = aggregator
+        analysis.dropped_rows = data['dropped_rows']
+        return analysis
+
+
+class AnalysisStore:
+    """
+    Directory of persisted Analysis states, one JSON file per dataset name, for append mode.
+    Each upload of new rows (a delta) is analyzed alone and merged into its dataset's state,
+    so updating a dataset takes time proportional to the delta, not to the whole history.
+    - The content hashes of merged uploads are recorded, and an upload already merged is
+      skipped, so sending the same delta twice does not count it twice.
+    - Files are written under a temporary name and renamed into place; appends to the same
+      dataset are serialized with a lock file (across processes where fcntl is available).
+    """
+
+    NAME_PATTERN = re.compile(r'[A-Za-z0-9][A-Za-z0-9_.-]{0,63}')
+    # Serializes appends between threads (shared by all instances, which stay picklable)
+    _thread_lock = threading.Lock()
+
+    def __init__(self, directory=ANALYSIS_STORE_DIR):
+        self.directory = directory
+
+    @classmethod
+    def check_name(cls, name):
+        """Raises AnalysisError unless name is a valid dataset name (also a safe file name)."""
+        if not cls.NAME_PATTERN.fullmatch(name):
+            raise AnalysisError("Dataset names may only contain letters, digits, '.', '_' and '-' (at most 64 characters).")
+
+    def _path(self, name):
+        self.check_name(name)
+        return os.path.join(self.directory, f"{name}.json")
+
+    def _read(self, name):
+        try:
+            with open(self._path(name)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def load(self, name):
+        """Returns the dataset's merged Analysis, or None if nothing was appended to it yet."""
+        state = self._read(name)
+        return None if state is None else Analysis.from_dict(state['analysis'])
+
+    def names(self):
+        """Returns the names of the stored datasets, sorted."""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(entry.name[:-len('.json')] for entry in os.scandir(self.directory) if entry.name.endswith('.json'))
+
+    @contextlib.contextmanager
+    def _locked(self, name):
+        os.makedirs(self.directory, exist_ok=True)
+        with self._thread_lock, open(f"{self._path(name)}.lock", 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def append(self, name, analysis, upload_hash=None):
+        """
+        Merges an Analysis of new rows into the dataset's state (creating the dataset if needed)
+        and persists it. Returns (merged Analysis, appended), where appended is False if an
+        upload with the same upload_hash had already been merged (the state is then unchanged).
+        """
+        with self._locked(name):
+            state = self._read(name) or {'uploads': [], 'analysis': None}
+            merged = None if state['analysis'] is None else Analysis.from_dict(state['analysis'])
+            if upload_hash is not None and upload_hash in state['uploads']:
+                return merged, False
+            if merged is None:
+                merged = Analysis(analysis.aggregates, trend_freq=analysis.trend_freq, location_capacity=analysis.location_capacity)
+            merged.merge(analysis)
+            if upload_hash is not None:
+                state['uploads'].append(upload_hash)
+            state['analysis'] = merged.to_dict()
+
+            path = self._path(name)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, path)
+        return merged, True
+
+
+def missing_column_error(columns, required=REQUIRED_COLUMNS):
+    """
+    Returns the error message for the first required column missing from the
+    normalized columns of an upload, or None if all are present.
+    """
+    if 'date' in required and 'date' not in columns:
+        return "Column 'Date' not found in CSV. Please ensure correct column names."
+    if 'engagements' in required and 'engagements' not in columns:
+        return "Column 'Engagements' not found in CSV. Please ensure correct column names."
+    for col in ['platform', 'sentiment', 'location', 'media_type']:
+        if col in required and col not in columns:
+            return f"Required column '{col.replace('_', ' ').title()}' not found in CSV. Please ensure correct column names."
+    return None
+
+
+def analyze_upload(source, filename=None, content_hash=None, cache=None, chunksize=DEFAULT_CHUNKSIZE, timer=None,
+                   location_capacity=None):
+    """
+    Runs a full Analysis over an uploaded CSV, Parquet or Feather file (a path or a seekable stream),
+    streaming it in chunks so the whole file is never held in memory at once:
+    - With a cache (ingestion.ColumnarCache) and the upload's content_hash, a CSV seen before is
+      read from its converted Parquet copy, and a new CSV is converted while it is streamed.
+    - Only the required columns are parsed; a missing one raises AnalysisError, as does a file
+      with no rows left after cleaning.
+    - Each stage is timed into timer (a StageTimer), if given.
+    - location_capacity selects approximate location totals (see Analysis).
+    Returns the finished Analysis (see .result(), .rows and .dropped_rows).
+    """
+    timer = StageTimer() if timer is None else timer
+    cached_path = cache.get(content_hash) if cache is not None and content_hash else None
+    if cached_path:
+        chunks = cache.iter_chunks(cached_path, chunksize=chunksize)
+    else:
+        # Only the six required columns are parsed, however wide the export is
+        chunks = iter_table_chunks(source, filename, chunksize=chunksize, columns=REQUIRED_COLUMNS)
+    convert = cache is not None and content_hash and not cached_path and detect_format(filename or str(source)) == 'csv'
+
+    analysis = Analysis(location_capacity=location_capacity)
+    date_format = None
+    with cache.writer(content_hash) if convert else contextlib.nullcontext() as write_to_cache:
+        for chunk_index, chunk in enumerate(timer.iterate('read', chunks)):
+            # Column names are normalized by iter_table_chunks
+            if chunk_index == 0:
+                error = missing_column_error(chunk.columns)
+                if error:
+                    raise AnalysisError(error)
+
+            if write_to_cache:
+                # The cache keeps the six typed columns before cleaning
+                with timer.span('clean'):
+                    if date_format is None:
+                        date_format = infer_date_format(chunk['date'].unique())
+                    chunk = to_typed_columns(chunk, date_format=date_format)
+                with timer.span('cache_write'):
+                    write_to_cache(chunk)
+
+            # Dates parsed, invalid dates dropped, missing engagements to 0, sentiment lowercased
+            with timer.span('clean'):
+                chunk = analysis.clean(chunk)
+            with timer.span('aggregate'):
+                analysis.update(chunk)
+
+    if analysis.rows == 0:
+        raise AnalysisError("The uploaded file is empty or all rows were removed after cleaning due to invalid data.")
+    return analysis
+
+
+def build_cube(source, filename=None, content_hash=None, cache=None):
+    """
+    Reads only the required columns of a whole CSV, Parquet or Feather upload (a path, a
+    seekable stream or bytes), cleans it and rolls it up into an AggregateCube.
+    With a cache (ingestion.ColumnarCache) and the upload's content_hash, a CSV seen before is
+    read from its converted Parquet copy, and a new CSV is converted.
+    Returns (cube, dropped_rows); raises AnalysisError if a required column is missing.
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    cached_path = cache.get(content_hash) if cache is not None and content_hash else None
+    if cached_path:
+        df = cache.read(cached_path)
+    else:
+        df = read_table(source, filename, columns=REQUIRED_COLUMNS)
+    error = missing_column_error(df.columns)
+    if error:
+        raise AnalysisError(error)
+    if not cached_path and cache is not None and content_hash and detect_format(filename or str(source)) == 'csv':
+        df = to_typed_columns(df)
+        cache.store(content_hash, df)
+    df, dropped_rows = clean_frame(df)
+    return AggregateCube.from_frame(df), dropped_rows
+
+
+def _parallel_map(func, arguments, max_workers=None):
+    # Calls func(*args) for every tuple of arguments across a pool of worker processes
+    # (spawned, so this also works from threaded servers and notebooks); results keep the input order
+    max_workers = min(len(arguments), max_workers or PARALLEL_MAX_WORKERS)
+    if max_workers <= 1:
+        return [func(*args) for args in arguments]
+    with ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return list(pool.map(func, *zip(*arguments)))
+
+
+def _analyze_file(source, filename, aggregates, location_capacity):
+    try:
+        analysis = Analysis(aggregates, location_capacity=location_capacity)
+        analysis.run_file(source, filename)
+        return analysis
+    except AnalysisError as e:
+        raise AnalysisError(f"{filename or source}: {e}") from None
+
+
+def _build_file_cube(source, filename, content_hash, cache):
+    try:
+        return build_cube(source, filename, content_hash=content_hash, cache=cache)
+    except AnalysisError as e:
+        raise AnalysisError(f"{filename}: {e}") from None
+
+
+def analyze_files(sources, aggregates=ALL_AGGREGATES, max_workers=None, location_capacity=None):
+    """
+    Analyzes several files (paths, or (path or stream, filename) pairs) in parallel, one worker process
+    per file, and merges their partial aggregates into one Analysis (see Analysis.merge).
+    A file missing a required column raises AnalysisError naming it.
+    """
+    arguments = [
+        (*(source if isinstance(source, tuple) else (source, None)), aggregates, location_capacity) for source in sources
+    ]
+    merged = Analysis(aggregates, location_capacity=location_capacity)
+    for analysis in _parallel_map(_analyze_file, arguments, max_workers):
+        merged.merge(analysis)
+    return merged
+
+
+def build_merged_cube(uploads, cache=None, max_workers=None):
+    """
+    Builds one AggregateCube per upload, given as (bytes or path, filename, content_hash) tuples,
+    in parallel worker processes (see build_cube), and merges them (see AggregateCube.merge).
+    Returns (cube, dropped_rows); a file missing a required column raises AnalysisError naming it.
+    """
+    results = _parallel_map(_build_file_cube, [(*upload, cache) for upload in uploads], max_workers)
+    return AggregateCube.merge(cube for cube, _ in results), sum(dropped_rows for _, dropped_rows in results)
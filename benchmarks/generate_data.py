@@ -0,0 +1,106 @@
+# generate_data.py - Seeded synthetic media exports for the benchmarks
+#
+# Usage:
+#   python benchmarks/generate_data.py 1m                 # writes benchmarks/data/media_1m_seed0.csv
+#   python benchmarks/generate_data.py 10k 100k --seed 7
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# Rows written per to_csv call, so 50M-row files never need to fit in memory
+WRITE_CHUNK_ROWS = 1_000_000
+
+PLATFORMS = ['Instagram', 'TikTok', 'Twitter', 'Facebook', 'YouTube', 'LinkedIn', 'Reddit', 'Threads']
+PLATFORM_WEIGHTS = [0.28, 0.24, 0.16, 0.14, 0.1, 0.04, 0.03, 0.01]
+# Mixed case on purpose: clean_data lowercases sentiment
+SENTIMENTS = ['Positive', 'Negative', 'Neutral', 'positive', 'NEGATIVE', 'neutral']
+SENTIMENT_WEIGHTS = [0.35, 0.2, 0.3, 0.06, 0.04, 0.05]
+MEDIA_TYPES = ['image', 'video', 'text', 'carousel', 'link']
+MEDIA_TYPE_WEIGHTS = [0.35, 0.3, 0.2, 0.1, 0.05]
+# Strings that don't parse as dates, mixed into the Date column
+DIRTY_DATES = ['', 'N/A', '2023-02-31', 'not a date', '13/45/2023']
+
+
+def parse_size(text):
+    """Parses row counts like '10k', '1m' or '50M' (or plain integers)."""
+    text = text.strip().lower()
+    multiplier = {'k': 1_000, 'm': 1_000_000}.get(text[-1], 1)
+    return int(float(text.rstrip('km')) * multiplier)
+
+
+def generate_frame(n_rows, seed=0, n_locations=5000, days=730, dirty_date_rate=0.01, missing_engagement_rate=0.05):
+    """
+    Builds a DataFrame in the raw export schema (Date, Platform, Sentiment, Location,
+    Engagements, Media Type) with realistic shapes:
+    - hourly timestamps over `days` days, with a share of unparseable or empty dates;
+    - a handful of platforms, sentiments and media types with skewed frequencies;
+    - n_locations free-text locations with a Zipf-like long tail;
+    - heavy-tailed engagements with a share of missing values.
+    The same seed always gives the same rows.
+    """
+    rng = np.random.default_rng(seed)
+
+    # Date strings are drawn from a pool of distinct values, as in real exports
+    date_pool = pd.date_range('2023-01-01', periods=days * 24, freq='h').strftime('%Y-%m-%d %H:%M:%S').to_numpy(dtype=object)
+    dates = date_pool[rng.integers(0, len(date_pool), n_rows)]
+    dirty = rng.random(n_rows) < dirty_date_rate
+    dates[dirty] = np.array(DIRTY_DATES, dtype=object)[rng.integers(0, len(DIRTY_DATES), dirty.sum())]
+
+    location_pool = np.array([f"City {i:05d}" for i in range(n_locations)], dtype=object)
+    location_ids = np.minimum(rng.zipf(1.3, n_rows) - 1, n_locations - 1)
+
+    engagements = np.floor(rng.lognormal(mean=4, sigma=1.5, size=n_rows))
+    engagements[rng.random(n_rows) < missing_engagement_rate] = np.nan
+
+    return pd.DataFrame({
+        'Date': dates,
+        'Platform': rng.choice(np.array(PLATFORMS, dtype=object), n_rows, p=PLATFORM_WEIGHTS),
+        'Sentiment': rng.choice(np.array(SENTIMENTS, dtype=object), n_rows, p=SENTIMENT_WEIGHTS),
+        'Location': location_pool[location_ids],
+        'Engagements': engagements,
+        'Media Type': rng.choice(np.array(MEDIA_TYPES, dtype=object), n_rows, p=MEDIA_TYPE_WEIGHTS),
+    })
+
+
+def write_csv(path, n_rows, seed=0, dirty_dates=True):
+    """Writes n_rows of generated data to a CSV, WRITE_CHUNK_ROWS at a time."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    for chunk_index, start in enumerate(range(0, n_rows, WRITE_CHUNK_ROWS)):
+        # Each chunk gets its own derived seed, so files of any size are reproducible
+        frame = generate_frame(min(WRITE_CHUNK_ROWS, n_rows - start), seed=[seed, chunk_index],
+                               dirty_date_rate=0.01 if dirty_dates else 0.0)
+        frame.to_csv(tmp_path, mode='w' if start == 0 else 'a', header=start == 0, index=False, float_format='%.0f')
+    os.replace(tmp_path, path)
+    return path
+
+
+def dataset_path(n_rows, seed=0, dirty_dates=True):
+    """
+    Returns (generating it on first use) the path of the benchmark CSV for n_rows and seed.
+    dirty_dates=False gives a variant without unparseable dates.
+    """
+    suffix = '' if dirty_dates else '_clean'
+    path = os.path.join(DATA_DIR, f"media_{n_rows}_seed{seed}{suffix}.csv")
+    if not os.path.exists(path):
+        write_csv(path, n_rows, seed=seed, dirty_dates=dirty_dates)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate seeded synthetic media exports.")
+    parser.add_argument('sizes', nargs='+', help="Row counts, e.g. 10k 1m 50m.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--clean', action='store_true', help="Leave out unparseable dates.")
+    args = parser.parse_args()
+    for size in args.sizes:
+        print(dataset_path(parse_size(size), seed=args.seed, dirty_dates=not args.clean))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+# run_benchmarks.py - Times every pipeline stage of the Flask and Streamlit dashboards
+#
+# Usage:
+#   python benchmarks/run_benchmarks.py                       # 10k and 100k rows
+#   python benchmarks/run_benchmarks.py --sizes 10k 1m 10m 50m --repeat 3
+#   python benchmarks/run_benchmarks.py --compare benchmarks/results/baseline.json
+#   python benchmarks/run_benchmarks.py --frontends startup     # cold start of fresh processes
+#
+# Results are written as JSON (one record per size, frontend and stage) to
+# benchmarks/results/<timestamp>.json unless --output is given. With --compare, the
+# run exits non-zero if any stage is slower than the baseline by more than --max-slowdown.
+
+import argparse
+import datetime
+import importlib.util
+import io
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import pandas as pd
+import plotly
+import plotly.express as px
+
+from aggregation import ALL_AGGREGATES, AggregateCube, bucket_trend
+from analytics import Analysis
+from generate_data import dataset_path, parse_size
+from ingestion import REQUIRED_COLUMNS, ColumnarCache, read_table
+from insights import rule_based_insights
+from result_cache import ResultCache
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+STARTUP_PROBE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'startup_probe.py')
+
+
+def load_script(name, filename):
+    """Imports one of the dashboard scripts (their file names aren't importable module names)."""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT_DIR, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def time_stage(func, repeat):
+    """Runs func `repeat` times; returns (timings in seconds, result of the last run)."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return timings, result
+
+
+class Recorder:
+    """Collects one record per timed stage."""
+
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.records = []
+
+    def run(self, n_rows, frontend, stage, func):
+        timings, result = time_stage(func, self.repeat)
+        self.add(n_rows, frontend, stage, timings)
+        return result
+
+    def add(self, n_rows, frontend, stage, timings):
+        """Records timings (seconds) measured elsewhere, e.g. in a subprocess."""
+        self.records.append({
+            'rows': n_rows,
+            'frontend': frontend,
+            'stage': stage,
+            'min_seconds': min(timings),
+            'median_seconds': statistics.median(timings),
+            'repeat': self.repeat,
+        })
+        print(f"{n_rows:>11,} {frontend:<9} {stage:<32} {min(timings):9.4f}s")
+
+
+def bench_streamlit(recorder, app, path, n_rows):
+    """Times the Streamlit flow: read, clean_data, each aggregate, the cube and a filter, figures and their JSON."""
+    raw_df = recorder.run(n_rows, 'streamlit', 'ingest.read_csv', lambda: read_table(path, columns=REQUIRED_COLUMNS))
+    cleaned = recorder.run(n_rows, 'streamlit', 'clean_data', lambda: app.clean_data(raw_df.copy()))
+
+    def aggregate_only(name):
+        # An analysis that declares a single aggregate computes only that one
+        analysis = Analysis([name])
+        analysis.update(cleaned)
+        return analysis.result()
+
+    for name in ALL_AGGREGATES:
+        recorder.run(n_rows, 'streamlit', f'aggregate.{name}', lambda: aggregate_only(name))
+    cube = recorder.run(n_rows, 'streamlit', 'cube.build', lambda: AggregateCube.from_frame(cleaned))
+    aggregates = recorder.run(n_rows, 'streamlit', 'cube.aggregates', cube.aggregates)
+    # A typical filter interaction: a 90-day window on two platforms
+    first_day, _ = cube.date_range()
+    recorder.run(n_rows, 'streamlit', 'cube.filter', lambda: cube.filter(
+        start=first_day, end=first_day + pd.Timedelta(days=89), platform=cube.values('platform')[:2],
+    ).aggregates())
+    recorder.run(n_rows, 'streamlit', 'prompts', lambda: app.build_insight_prompts(aggregates))
+    # The insights shown while (or instead of) waiting for Gemini
+    recorder.run(n_rows, 'streamlit', 'insights.rules', lambda: rule_based_insights(aggregates))
+
+    for key, _, create_chart in app.CHART_SECTIONS:
+        fig = recorder.run(n_rows, 'streamlit', f'figure.{key}', lambda: create_chart(aggregates))
+        # st.plotly_chart ships the figure to the browser as JSON
+        recorder.run(n_rows, 'streamlit', f'serialize_json.{key}', fig.to_json)
+
+
+def bench_flask(recorder, flask_app, path, n_rows):
+    """
+    Times the Flask flow: streamed ingest/clean/aggregate, figures, HTML/JSON rendering, and /analyze.
+    """
+    chunksize = flask_app.app.config['CSV_CHUNKSIZE']
+
+    def streamed_aggregates():
+        return Analysis().run_file(path, chunksize=chunksize)
+
+    aggregates = recorder.run(n_rows, 'flask', 'ingest+clean+aggregate', streamed_aggregates)
+
+    figures = {
+        'sentiment': lambda: px.pie(aggregates['sentiment_counts'].reset_index(), values='count', names='sentiment'),
+        'engagement_time': lambda: px.line(
+            bucket_trend(aggregates['engagement_trend'], max_points=flask_app.app.config['TREND_MAX_POINTS'])[0].reset_index(), x='date', y='engagements',
+        ),
+        'platform': lambda: px.bar(aggregates['platform_engagements'].reset_index(), x='platform', y='engagements', color='platform'),
+        'media_type': lambda: px.pie(aggregates['media_type_counts'].reset_index(), values='count', names='media_type'),
+        'location': lambda: px.bar(aggregates['location_engagements'].head(5).reset_index(), x='location', y='engagements', color='location'),
+    }
+    for key, build in figures.items():
+        fig = recorder.run(n_rows, 'flask', f'figure.{key}', build)
+        recorder.run(n_rows, 'flask', f'serialize_html.{key}', lambda: fig.to_html(full_html=False, include_plotlyjs='cdn'))
+        with flask_app.app.test_request_context():
+            recorder.run(n_rows, 'flask', f'serialize_json.{key}', lambda: flask_app.render_chart(fig))
+
+    # The whole request, first with an empty converted-upload cache, then with a warm one,
+    # then answered from the result cache; large uploads are analyzed inside the request too
+    # rather than by a background job
+    flask_app.app.config['JOB_MIN_UPLOAD_BYTES'] = None
+    with open(path, 'rb') as f:
+        upload = f.read()
+    client = flask_app.app.test_client()
+
+    def post_analyze():
+        response = client.post('/analyze', data={'csvFile': (io.BytesIO(upload), os.path.basename(path))}, content_type='multipart/form-data')
+        assert response.status_code == 200 and b'Error!' not in response.data, "analyze() failed"
+
+    with tempfile.TemporaryDirectory() as cache_dir, tempfile.TemporaryDirectory() as result_dir:
+        flask_app.columnar_cache = ColumnarCache(cache_dir)
+        flask_app.result_cache = ResultCache(result_dir)
+        def cold_request():
+            for name in os.listdir(cache_dir):
+                os.remove(os.path.join(cache_dir, name))
+            flask_app.result_cache.clear()
+            post_analyze()
+        def warm_request():
+            flask_app.result_cache.clear()
+            post_analyze()
+        recorder.run(n_rows, 'flask', 'request.analyze_cold', cold_request)
+        recorder.run(n_rows, 'flask', 'request.analyze_warm', warm_request)
+        recorder.run(n_rows, 'flask', 'request.analyze_cached', post_analyze)
+
+
+def bench_startup(recorder, path, n_rows, modes):
+    """
+    Times the cold start of each dashboard in each startup mode (see startup.STARTUP_MODE):
+    every repeat runs startup_probe.py in a fresh process, which reports the import, the
+    first page and the first upload of path.
+    """
+    for frontend in ('flask', 'streamlit'):
+        for mode in modes:
+            timings = {}
+            for _ in range(recorder.repeat):
+                probe = subprocess.run(
+                    [sys.executable, STARTUP_PROBE, frontend, path], env={**os.environ, 'STARTUP_MODE': mode},
+                    capture_output=True, text=True, check=True,
+                )
+                for stage, seconds in json.loads(probe.stdout.splitlines()[-1]).items():
+                    timings.setdefault(stage, []).append(seconds)
+            for stage, stage_timings in timings.items():
+                recorder.add(n_rows, 'startup', f'{frontend}.{mode}.{stage}', stage_timings)
+
+
+def compare(records, baseline_path, max_slowdown):
+    """Prints stages slower than the baseline by more than max_slowdown; returns True if none are."""
+    with open(baseline_path) as f:
+        baseline = {(r['rows'], r['frontend'], r['stage']): r for r in json.load(f)['results']}
+    regressions = []
+    for record in records:
+        previous = baseline.get((record['rows'], record['frontend'], record['stage']))
+        if previous and previous['min_seconds'] > 0:
+            ratio = record['min_seconds'] / previous['min_seconds']
+            if ratio > max_slowdown:
+                regressions.append((record, ratio))
+    for record, ratio in regressions:
+        print(f"REGRESSION {record['rows']:,} {record['frontend']} {record['stage']}: {ratio:.2f}x slower than baseline")
+    return not regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every stage of the dashboard pipelines.")
+    parser.add_argument('--sizes', nargs='+', default=['10k', '100k'], help="Row counts, e.g. 10k 1m 50m.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per stage; the minimum is used for comparisons.")
+    parser.add_argument('--frontends', nargs='+', default=['streamlit', 'flask'], choices=['streamlit', 'flask', 'startup'])
+    parser.add_argument('--startup-modes', nargs='+', default=['background', 'eager'], choices=['background', 'eager', 'lazy'],
+                        help="Startup modes timed by the 'startup' frontend.")
+    parser.add_argument('--output', help="Results file (default: benchmarks/results/<timestamp>.json).")
+    parser.add_argument('--compare', help="Baseline results file to check for regressions.")
+    parser.add_argument('--max-slowdown', type=float, default=1.25, help="Allowed slowdown ratio versus the baseline.")
+    args = parser.parse_args()
+
+    # The Streamlit script runs in bare mode here; its "no runtime" warnings are noise
+    logging.getLogger('streamlit').setLevel(logging.ERROR)
+    streamlit_app = load_script('streamlitappsp', 'streamlitappsp.py') if 'streamlit' in args.frontends else None
+    flask_app = load_script('flask_app', 'streamliit-app.py') if 'flask' in args.frontends else None
+
+    recorder = Recorder(args.repeat)
+    for size in args.sizes:
+        n_rows = parse_size(size)
+        if streamlit_app:
+            bench_streamlit(recorder, streamlit_app, dataset_path(n_rows, seed=args.seed), n_rows)
+        if flask_app:
+            bench_flask(recorder, flask_app, dataset_path(n_rows, seed=args.seed), n_rows)
+        if 'startup' in args.frontends:
+            bench_startup(recorder, dataset_path(n_rows, seed=args.seed), n_rows, args.startup_modes)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({
+            'meta': {
+                'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                'seed': args.seed,
+                'python': platform.python_version(),
+                'pandas': pd.__version__,
+                'plotly': plotly.__version__,
+                'machine': platform.platform(),
+                'cpu_count': os.cpu_count(),
+            },
+            'results': recorder.records,
+        }, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare and not compare(recorder.records, args.compare, args.max_slowdown):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
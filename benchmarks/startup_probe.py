@@ -0,0 +1,77 @@
+# startup_probe.py - Measures the cold start of one dashboard in a fresh process
+#
+# Usage (normally run by run_benchmarks.py, once per measurement):
+#   STARTUP_MODE=background python benchmarks/startup_probe.py flask benchmarks/data/rows_10000_seed_0.csv
+#
+# Prints JSON with the seconds spent importing the dashboard, serving its first page and
+# analyzing its first upload (sent right after the first page, so a background warm-up may
+# still be running). Every cache lives in a temporary directory, so nothing is reused.
+
+import importlib.util
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def probe_flask(path):
+    """Imports the Flask app, then times GET / and the first POST /analyze of path."""
+    started = time.perf_counter()
+    spec = importlib.util.spec_from_file_location('flask_app', os.path.join(ROOT_DIR, 'streamliit-app.py'))
+    flask_app = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(flask_app)
+    imported = time.perf_counter()
+
+    flask_app.app.config['JOB_MIN_UPLOAD_BYTES'] = None
+    client = flask_app.app.test_client()
+    assert client.get('/').status_code == 200, "GET / failed"
+    first_page = time.perf_counter()
+
+    with open(path, 'rb') as f:
+        upload = f.read()
+    response = client.post('/analyze', data={'csvFile': (io.BytesIO(upload), os.path.basename(path))}, content_type='multipart/form-data')
+    assert response.status_code == 200 and b'Error!' not in response.data, "analyze() failed"
+    first_upload = time.perf_counter()
+    return {'import': imported - started, 'first_page': first_page - imported, 'first_upload': first_upload - first_page}
+
+
+def probe_streamlit(path):
+    """Runs the Streamlit script's first (empty) run, then its first run with path uploaded."""
+    started = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+    imported = time.perf_counter()
+
+    app_test = AppTest.from_file(os.path.join(ROOT_DIR, 'streamlitappsp.py'), default_timeout=3600)
+    app_test.run()
+    first_page = time.perf_counter()
+
+    with open(path, 'rb') as f:
+        app_test.file_uploader[0].set_value([(os.path.basename(path), f.read(), 'text/csv')])
+    app_test.run()
+    assert not app_test.exception, f"Streamlit run failed: {app_test.exception}"
+    first_upload = time.perf_counter()
+    return {'import': imported - started, 'first_page': first_page - imported, 'first_upload': first_upload - first_page}
+
+
+PROBES = {'flask': probe_flask, 'streamlit': probe_streamlit}
+
+
+def main():
+    frontend, path = sys.argv[1], os.path.abspath(sys.argv[2])
+    with tempfile.TemporaryDirectory() as cache_dir:
+        os.environ['COLUMNAR_CACHE_DIR'] = os.path.join(cache_dir, 'columnar')
+        os.environ['RESULT_CACHE_DIR'] = os.path.join(cache_dir, 'results')
+        os.environ['INSIGHT_CACHE_PATH'] = os.path.join(cache_dir, 'insights.sqlite3')
+        # Insight requests fail at once instead of reaching the real API
+        os.environ.setdefault('GEMINI_API_BASE_URL', 'http://127.0.0.1:9/v1beta')
+        os.chdir(cache_dir)
+        sys.path.insert(0, ROOT_DIR)
+        print(json.dumps(PROBES[frontend](path)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# gemini_stub_server.py - Local stand-in for the Gemini generateContent endpoint
+#
+# Lets the dashboards' insight generation run without network access or an API key:
+#   python gemini_stub_server.py --port 8765 --delay 1.0
+#   GEMINI_API_BASE_URL=http://127.0.0.1:8765/v1beta streamlit run streamlitappsp.py
+#
+# Requests with a JSON response schema (batched insights) get a JSON object with stub insights
+# under every key of the schema; --omit-keys leaves some out, to exercise the per-chart fallback:
+#   python gemini_stub_server.py --omit-keys location media_type
+
+import argparse
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def stub_text(prompt, generation_config, omit_keys=()):
+    """
+    Returns the stub reply to a prompt: three numbered insights, or, when generation_config
+    asks for JSON with a schema, an object holding three insights per schema key (minus omit_keys).
+    """
+    schema = generation_config.get('responseSchema')
+    if generation_config.get('responseMimeType') == 'application/json' and schema:
+        return json.dumps({
+            key: [f"Stub {key} insight {i}." for i in range(1, 4)]
+            for key in schema.get('properties', {}) if key not in omit_keys
+        })
+    return f"1. Stub insight for: {prompt[:80]}\n2. Second stub insight.\n3. Third stub insight."
+
+
+def make_handler(delay, omit_keys=()):
+    """Builds a request handler that answers every generateContent call after `delay` seconds."""
+
+    class GeminiStubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # Keep-alive, like the real API
+
+        def do_POST(self):
+            if not self.path.split('?')[0].endswith(':generateContent'):
+                self.send_error(404)
+                return
+
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            prompt = body['contents'][0]['parts'][0]['text']
+            time.sleep(delay)
+
+            text = stub_text(prompt, body.get('generationConfig', {}), omit_keys)
+            payload = json.dumps({
+                "candidates": [
+                    {"content": {"role": "model", "parts": [{"text": text}]}}
+                ]
+            }).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    return GeminiStubHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the Gemini generateContent API.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--delay', type=float, default=0.0, help="Seconds to wait before each response.")
+    parser.add_argument('--omit-keys', nargs='*', default=[], help="Keys left out of JSON (batched) replies.")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args.delay, set(args.omit_keys)))
+    print(f"Gemini stub listening on http://{args.host}:{args.port}/v1beta")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
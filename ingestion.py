@@ -0,0 +1,361 @@
+# ingestion.py - Reading uploaded media exports into pandas
+
+import hashlib
+import os
+import uuid
+import warnings
+from contextlib import contextmanager
+
+from startup import deferred_import
+
+# pandas loads when the first upload is read, not at import (see startup.py)
+pd = deferred_import('pandas')
+
+# Columns every dashboard expects, after name normalization
+REQUIRED_COLUMNS = ['date', 'platform', 'sentiment', 'location', 'engagements', 'media_type']
+
+# Low-cardinality text dimensions stored as pandas categoricals once cleaned
+CATEGORY_COLUMNS = ['platform', 'location', 'media_type']
+
+# Rows parsed per chunk in streaming mode
+DEFAULT_CHUNKSIZE = 100_000
+
+# Number of distinct date strings inspected when detecting the date format
+DATE_FORMAT_SAMPLE_SIZE = 50
+
+# Upload formats recognized by file extension; anything else is read as CSV
+FILE_FORMATS = {'.csv': 'csv', '.parquet': 'parquet', '.pq': 'parquet', '.feather': 'feather', '.arrow': 'feather'}
+
+# Text columns of the required six
+TEXT_COLUMNS = ['platform', 'sentiment', 'location', 'media_type']
+
+# dtypes the required columns are parsed with when reading a CSV (by normalized name).
+# Text is parsed straight into categoricals; 'engagements' is left to the parser's
+# numeric inference, since exports may contain non-numeric values that cleaning turns into 0.
+CSV_DTYPES = {'date': 'str', **{col: 'category' for col in TEXT_COLUMNS}}
+
+# Directory and size (number of files, least recently used evicted) of the converted-upload cache
+COLUMNAR_CACHE_DIR = os.environ.get('COLUMNAR_CACHE_DIR', '.columnar_cache')
+COLUMNAR_CACHE_MAX_ENTRIES = int(os.environ.get('COLUMNAR_CACHE_MAX_ENTRIES', 16))
+
+
+def normalize_column_name(col):
+    """Normalizes a raw CSV header, e.g. 'Media Type' -> 'media_type'."""
+    return col.strip().lower().replace(' ', '_')
+
+
+def detect_format(filename):
+    """Returns 'csv', 'parquet' or 'feather' based on a file name's extension."""
+    return FILE_FORMATS.get(os.path.splitext(filename or '')[1].lower(), 'csv')
+
+
+def _import_pyarrow():
+    """Imports pyarrow, which Parquet/Feather support needs but plain CSV uploads don't."""
+    try:
+        import pyarrow
+        import pyarrow.feather
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet and Feather files need the 'pyarrow' package. Install it with: pip install pyarrow")
+    return pyarrow
+
+
+def project_columns(raw_columns, columns):
+    """
+    Maps the wanted normalized column names back to the raw headers they come from.
+    Returns {raw header: normalized name} for the wanted columns present, in file order;
+    when several headers normalize to the same name, the first one is used.
+    """
+    wanted = set(columns)
+    projection = {}
+    for raw in raw_columns:
+        name = normalize_column_name(str(raw))
+        if name in wanted and name not in projection.values():
+            projection[raw] = name
+    return projection
+
+
+def read_csv_header(source):
+    """Returns the raw column names of a CSV path or seekable file-like object, without consuming it."""
+    if isinstance(source, (str, os.PathLike)):
+        return list(pd.read_csv(source, encoding='utf-8', nrows=0).columns)
+    position = source.tell()
+    try:
+        return list(pd.read_csv(source, encoding='utf-8', nrows=0).columns)
+    finally:
+        source.seek(position)
+
+
+def iter_csv_chunks(source, chunksize=DEFAULT_CHUNKSIZE, columns=None):
+    """
+    Reads a CSV from a path or a binary/text file-like object and yields DataFrames
+    with normalized column names.
+    - With a chunksize, the file is parsed incrementally so only one chunk of rows
+      is held in memory at a time (the raw upload is never decoded into one string).
+    - With chunksize=None, the whole file is parsed and yielded as a single chunk.
+    - With columns (normalized names), the header is read first and only the matching raw
+      columns are parsed, with the CSV_DTYPES hints; the others are skipped by the parser,
+      so wide exports cost about as much as six-column ones.
+    """
+    read_options = {'encoding': 'utf-8'}
+    if columns is not None:
+        projection = project_columns(read_csv_header(source), columns)
+        read_options['usecols'] = list(projection)
+        read_options['dtype'] = {raw: CSV_DTYPES[name] for raw, name in projection.items() if name in CSV_DTYPES}
+
+    if chunksize is None:
+        df = pd.read_csv(source, **read_options)
+        df.columns = [normalize_column_name(col) for col in df.columns]
+        yield df
+        return
+
+    with pd.read_csv(source, chunksize=chunksize, **read_options) as reader:
+        for chunk in reader:
+            chunk.columns = [normalize_column_name(col) for col in chunk.columns]
+            yield chunk
+
+
+def lowercase_category(series):
+    """
+    Lowercases a text column into a categorical, matching astype(str).str.lower()
+    (missing values become 'nan') while only converting each distinct value once.
+    """
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    labels = pd.Index([str(value).lower() for value in uniques])
+    categories = labels.unique()
+    lowered = pd.Categorical.from_codes(categories.get_indexer(labels)[codes], categories)
+    return pd.Series(lowered, index=series.index, name=series.name)
+
+
+def narrowest_int(series):
+    """Casts whole-number values to the smallest signed integer dtype that holds them."""
+    return pd.to_numeric(series.astype('int64'), downcast='integer')
+
+
+def infer_date_format(values, sample_size=DATE_FORMAT_SAMPLE_SIZE):
+    """
+    Detects the strftime format of a column of date strings from a sample of its values.
+    Each format guessed from the sample is tried on the whole sample and the one that
+    parses the most values wins, so ambiguous values like '05/01/2024' don't outvote
+    unambiguous ones like '13/01/2024'.
+    Returns None when no format can be guessed (e.g. free-form or non-string values).
+    """
+    sample = pd.Series(values).dropna().head(sample_size)
+    sample = sample[sample.map(lambda value: isinstance(value, str))]
+    with warnings.catch_warnings():
+        # guess_datetime_format warns about day-first guesses; those are what we want here
+        warnings.simplefilter('ignore', UserWarning)
+        candidates = {pd.tseries.api.guess_datetime_format(value) for value in sample} - {None}
+    if not candidates:
+        return None
+    return max(sorted(candidates), key=lambda fmt: pd.to_datetime(sample, format=fmt, errors='coerce').notna().sum())
+
+
+def parse_dates(series, date_format=None, errors='coerce'):
+    """
+    Converts a column of date strings to datetimes.
+    - Each distinct string is parsed only once and the result is broadcast back to the rows.
+    - The distinct values are parsed with an explicit format (date_format, or one detected
+      from a sample), which avoids pandas' slow per-element format inference.
+    - Values that don't match the format fall back to pd.to_datetime with the given errors
+      mode, so with errors='coerce' unparseable dates still become NaT.
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+
+    codes, uniques = pd.factorize(series)
+    uniques = pd.Series(uniques)
+    date_format = date_format or infer_date_format(uniques)
+
+    if date_format is None:
+        parsed = pd.to_datetime(uniques, errors=errors)
+    else:
+        parsed = pd.to_datetime(uniques, format=date_format, errors='coerce')
+        unmatched = parsed.isna()
+        if unmatched.any():
+            parsed[unmatched] = pd.to_datetime(uniques[unmatched], format='mixed', errors=errors)
+
+    # Missing values have code -1 and become NaT
+    dates = pd.DatetimeIndex(parsed).take(codes, allow_fill=True, fill_value=pd.NaT)
+    return pd.Series(dates, index=series.index, name=series.name)
+
+
+def iter_table_chunks(source, filename=None, chunksize=DEFAULT_CHUNKSIZE, read_dictionary=None, columns=None):
+    """
+    Reads a CSV, Parquet or Feather file (chosen by filename, or by source when it is a path)
+    and yields DataFrames with normalized column names, like iter_csv_chunks.
+    Parquet files are streamed row group by row group; Feather files are sliced into
+    zero-copy record batches. read_dictionary (Parquet only) lists columns to load as categoricals.
+    columns (normalized names) limits reading to those columns, in every format; wanted
+    columns missing from the file are simply absent from the chunks. Text columns are then
+    also loaded as categoricals, as with the CSV_DTYPES hints.
+    """
+    file_format = detect_format(filename or (source if isinstance(source, str) else None))
+    if file_format == 'csv':
+        yield from iter_csv_chunks(source, chunksize=chunksize, columns=columns)
+        return
+
+    pa = _import_pyarrow()
+    if file_format == 'parquet':
+        parquet_file = pa.parquet.ParquetFile(source, read_dictionary=read_dictionary)
+        raw_columns = None
+        if columns is not None:
+            projection = project_columns(parquet_file.schema_arrow.names, columns)
+            raw_columns = list(projection)
+            if read_dictionary is None:
+                # Reopen (only the footer is read) with the text columns dictionary-encoded
+                if not isinstance(source, (str, os.PathLike)):
+                    source.seek(0)
+                text_columns = [raw for raw, name in projection.items() if name in TEXT_COLUMNS]
+                parquet_file = pa.parquet.ParquetFile(source, read_dictionary=text_columns)
+        if chunksize is None:
+            batches = [parquet_file.read(columns=raw_columns)]
+        else:
+            batches = parquet_file.iter_batches(batch_size=chunksize, columns=raw_columns)
+    else:
+        projection = None
+        if columns is not None:
+            # Feather (Arrow IPC) files store columns separately, so unread ones are never loaded
+            projection = project_columns(pa.ipc.open_file(source).schema.names, columns)
+            if not isinstance(source, (str, os.PathLike)):
+                source.seek(0)
+        table = pa.feather.read_table(source, columns=None if projection is None else list(projection))
+        if projection is not None:
+            for i, raw in enumerate(table.column_names):
+                column_type = table.column(i).type
+                if projection[raw] in TEXT_COLUMNS and (pa.types.is_string(column_type) or pa.types.is_large_string(column_type)):
+                    table = table.set_column(i, raw, table.column(i).dictionary_encode())
+        batches = [table] if chunksize is None else table.to_batches(max_chunksize=chunksize)
+
+    for batch in batches:
+        chunk = batch.to_pandas()
+        chunk.columns = [normalize_column_name(col) for col in chunk.columns]
+        yield chunk
+
+
+def read_table(source, filename=None, columns=None):
+    """
+    Reads a whole CSV, Parquet or Feather file into one DataFrame with normalized column names
+    (only the given normalized columns, when columns is set).
+    """
+    return next(iter_table_chunks(source, filename, chunksize=None, columns=columns))
+
+
+def _string_category(series):
+    """Converts a text column to a categorical with string categories, converting each distinct value once."""
+    codes, uniques = pd.factorize(series)
+    labels = pd.Index([str(value) for value in uniques])
+    if not labels.is_unique:
+        # Distinct raw values with the same text (e.g. 1 and '1')
+        return series.astype(str).astype('category')
+    return pd.Series(pd.Categorical.from_codes(codes, labels), index=series.index, name=series.name)
+
+
+def to_typed_columns(df, date_format=None, date_errors='coerce'):
+    """
+    Projects a normalized frame onto the six required columns with analysis dtypes:
+    parsed 'date', numeric 'engagements' (missing or invalid values stay NaN) and
+    categorical text columns. Frontend-specific cleaning still applies afterwards.
+    """
+    typed = pd.DataFrame(index=df.index)
+    typed['date'] = parse_dates(df['date'], date_format=date_format, errors=date_errors)
+    for col in TEXT_COLUMNS:
+        typed[col] = _string_category(df[col])
+    typed['engagements'] = pd.to_numeric(df['engagements'], errors='coerce').astype('float64')
+    return typed[REQUIRED_COLUMNS]
+
+
+def hash_stream(stream, block_size=1 << 20):
+    """Returns the SHA-256 digest of a seekable binary stream, then rewinds it."""
+    digest = hashlib.sha256()
+    stream.seek(0)
+    for block in iter(lambda: stream.read(block_size), b''):
+        digest.update(block)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+class ColumnarCache:
+    """
+    Directory of uploads converted to Parquet, keyed by the SHA-256 of the original upload.
+    Each file holds only the six required columns in the dtypes of to_typed_columns, so a
+    repeat analysis of the same CSV skips text parsing and loads text columns as categoricals.
+    Files are written under a temporary name and renamed into place, so readers never see
+    a partial file; beyond max_entries the least recently used files are deleted.
+    """
+
+    def __init__(self, directory=COLUMNAR_CACHE_DIR, max_entries=COLUMNAR_CACHE_MAX_ENTRIES):
+        self.directory = directory
+        self.max_entries = max_entries
+
+    def _path(self, content_hash):
+        return os.path.join(self.directory, f"{content_hash}.parquet")
+
+    def get(self, content_hash):
+        """Returns the path of the converted file for content_hash, or None if not cached."""
+        path = self._path(content_hash)
+        try:
+            os.utime(path) # Mark as recently used
+        except FileNotFoundError:
+            return None
+        return path
+
+    def iter_chunks(self, path, chunksize=DEFAULT_CHUNKSIZE):
+        """Yields the cached rows in chunks, with text columns loaded as categoricals."""
+        return iter_table_chunks(path, chunksize=chunksize, read_dictionary=TEXT_COLUMNS)
+
+    def read(self, path):
+        """Reads a whole cached file, with text columns loaded as categoricals."""
+        return next(self.iter_chunks(path, chunksize=None))
+
+    @contextmanager
+    def writer(self, content_hash):
+        """
+        Context manager yielding a write(typed_chunk) function that appends chunks to the
+        cache entry for content_hash. The entry only appears if the block exits cleanly
+        after at least one chunk was written.
+        """
+        pa = _import_pyarrow()
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{self._path(content_hash)}.{uuid.uuid4().hex}.tmp"
+        schema = pa.schema([
+            ('date', pa.timestamp('us')),
+            ('platform', pa.string()),
+            ('sentiment', pa.string()),
+            ('location', pa.string()),
+            ('engagements', pa.float64()),
+            ('media_type', pa.string()),
+        ])
+        parquet_writer = pa.parquet.ParquetWriter(tmp_path, schema)
+        chunks_written = 0
+
+        def write(typed_chunk):
+            nonlocal chunks_written
+            parquet_writer.write_table(pa.Table.from_pandas(typed_chunk, schema=schema, preserve_index=False, safe=False))
+            chunks_written += 1
+
+        succeeded = False
+        try:
+            yield write
+            succeeded = True
+        finally:
+            parquet_writer.close()
+            if succeeded and chunks_written:
+                os.replace(tmp_path, self._path(content_hash))
+            else:
+                os.remove(tmp_path)
+        self._evict()
+
+    def store(self, content_hash, typed_df):
+        """Writes a whole typed frame as the cache entry for content_hash."""
+        with self.writer(content_hash) as write:
+            write(typed_df)
+
+    def _evict(self):
+        entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith('.parquet')]
+        entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+        for entry in entries[self.max_entries:]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass # Already evicted by another process
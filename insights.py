@@ -0,0 +1,466 @@
+# insights.py - Gemini insight generation shared by the dashboards
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, as_completed
+from contextlib import contextmanager
+
+from aggregation import format_trend_bucket
+from startup import deferred_import
+
+# requests loads with the first insight request
+requests = deferred_import('requests')
+
+# Model used for every insight request
+GEMINI_MODEL = "gemini-2.0-flash"
+
+# Base URL of the Gemini REST API; point it at a local stand-in server
+# (e.g. gemini_stub_server.py) to run the dashboards without the real API
+GEMINI_API_BASE_URL = os.environ.get("GEMINI_API_BASE_URL", "https://generativelanguage.googleapis.com/v1beta")
+
+# Upper bound on insight requests in flight at once (one per chart by default)
+MAX_CONCURRENT_REQUESTS = 5
+
+# How the chart insights are requested:
+# - 'batched': one request for every chart, answered as a JSON object keyed by chart; charts
+#   missing from (or invalid in) the reply fall back to their own request
+# - 'per_chart': one request per chart, sent concurrently
+INSIGHT_REQUEST_MODE = os.environ.get("INSIGHT_REQUEST_MODE", "batched")
+INSIGHT_REQUEST_MODES = ('batched', 'per_chart')
+
+# Seconds an insight request may take to connect or to receive data before it fails
+INSIGHT_REQUEST_TIMEOUT_SECONDS = float(os.environ.get("INSIGHT_REQUEST_TIMEOUT_SECONDS", 30))
+# Seconds a dashboard waits for insights before showing the rule-based ones instead; answers
+# arriving later are kept in the insight cache and shown from there
+INSIGHT_LATENCY_BUDGET_SECONDS = float(os.environ.get("INSIGHT_LATENCY_BUDGET_SECONDS", 3))
+
+# Persistent insight cache: SQLite file, entry lifetime and size cap (least recently used evicted)
+INSIGHT_CACHE_PATH = os.environ.get("INSIGHT_CACHE_PATH", ".insight_cache.sqlite3")
+INSIGHT_CACHE_TTL_SECONDS = int(os.environ.get("INSIGHT_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+INSIGHT_CACHE_MAX_ENTRIES = int(os.environ.get("INSIGHT_CACHE_MAX_ENTRIES", 10_000))
+
+
+class InsightError(Exception):
+    """Raised when the Gemini API cannot produce insights; the message is user-facing."""
+
+
+_session = None
+_init_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Returns the process-wide HTTP session used for Gemini requests.
+    Its connection pool is sized for MAX_CONCURRENT_REQUESTS, so concurrent insight
+    requests reuse open keep-alive connections instead of reconnecting each time.
+    """
+    global _session
+    with _init_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONCURRENT_REQUESTS)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+def generate_content(prompt, api_key="", model=GEMINI_MODEL, base_url=None, session=None, generation_config=None):
+    """
+    Sends one prompt to the Gemini generateContent endpoint and returns the response text.
+    generation_config is passed through as the request's generationConfig (e.g. a JSON
+    response schema).
+    Raises InsightError with a user-facing message on network, HTTP or format errors.
+    """
+    url = f"{base_url or GEMINI_API_BASE_URL}/models/{model}:generateContent?key={api_key}"
+    headers = {'Content-Type': 'application/json'}
+    payload = {
+        "contents": [
+            {"role": "user", "parts": [{"text": prompt}]}
+        ]
+    }
+    if generation_config:
+        payload["generationConfig"] = generation_config
+
+    try:
+        response = (session or get_session()).post(url, headers=headers, data=json.dumps(payload), timeout=INSIGHT_REQUEST_TIMEOUT_SECONDS)
+        response.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx)
+        result = response.json()
+    except requests.exceptions.JSONDecodeError:
+        raise InsightError("Failed to decode JSON response from API. Invalid response format.")
+    except requests.exceptions.RequestException as e:
+        # Catch network errors, HTTP errors, etc.
+        raise InsightError(f"Failed to generate insights: {e}. Please check your network connection or API key.")
+
+    # Parse the response
+    if result.get('candidates') and result['candidates'][0].get('content') and result['candidates'][0]['content'].get('parts'):
+        return result['candidates'][0]['content']['parts'][0]['text']
+    raise InsightError(f"Unexpected API response structure or empty content: {result}")
+
+
+class InsightCache:
+    """
+    Disk-backed cache of generated insights, stored in a SQLite file so it survives
+    restarts and is shared by every process (and frontend) that points at the same file.
+    - Entries are keyed by model name and normalized prompt (whitespace collapsed).
+    - Entries older than ttl_seconds are treated as missing and purged on write.
+    - Beyond max_entries, the least recently read or written entries are evicted.
+    """
+
+    def __init__(self, path=INSIGHT_CACHE_PATH, ttl_seconds=INSIGHT_CACHE_TTL_SECONDS, max_entries=INSIGHT_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL") # Readers don't block the writer
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS insights ("
+                " key TEXT PRIMARY KEY, model TEXT NOT NULL, response TEXT NOT NULL,"
+                " created_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS insights_last_used ON insights (last_used)")
+
+    @contextmanager
+    def _connect(self):
+        # One short-lived connection per operation keeps the cache safe to use from any thread
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn: # Commits on success, rolls back on error
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def make_key(prompt, model):
+        """Hashes the model name and the whitespace-normalized prompt into a cache key."""
+        normalized = re.sub(r'\s+', ' ', prompt).strip()
+        return hashlib.sha256(f"{model}\n{normalized}".encode('utf-8')).hexdigest()
+
+    def get(self, prompt, model=GEMINI_MODEL):
+        """Returns the cached insight text, or None if missing or expired."""
+        key = self.make_key(prompt, model)
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT response FROM insights WHERE key = ? AND created_at >= ?",
+                (key, now - self.ttl_seconds),
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE insights SET last_used = ? WHERE key = ?", (now, key))
+        return row[0] if row else None
+
+    def set(self, prompt, response, model=GEMINI_MODEL):
+        """Stores an insight, then drops expired entries and evicts down to max_entries."""
+        key = self.make_key(prompt, model)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO insights (key, model, response, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, model, response, now, now),
+            )
+            conn.execute("DELETE FROM insights WHERE created_at < ?", (now - self.ttl_seconds,))
+            conn.execute(
+                "DELETE FROM insights WHERE key IN "
+                "(SELECT key FROM insights ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+
+_insight_cache = None
+
+
+def get_insight_cache():
+    """Returns the process-wide InsightCache configured by the INSIGHT_CACHE_* settings."""
+    global _insight_cache
+    with _init_lock:
+        if _insight_cache is None:
+            _insight_cache = InsightCache()
+        return _insight_cache
+
+
+def generate_content_cached(prompt, api_key="", model=GEMINI_MODEL, cache=None):
+    """
+    Like generate_content, but answers from the persistent insight cache when possible
+    and stores fresh responses in it. Failures are never cached.
+    """
+    cache = cache or get_insight_cache()
+    cached = cache.get(prompt, model)
+    if cached is not None:
+        return cached
+    response = generate_content(prompt, api_key=api_key, model=model)
+    cache.set(prompt, response, model)
+    return response
+
+
+def generate_concurrently(prompts, generate=generate_content, max_workers=MAX_CONCURRENT_REQUESTS):
+    """
+    Runs generate(prompt) for every prompt in the dict concurrently.
+    Yields (key, text, error) tuples in completion order, so callers can show each
+    result as soon as it arrives; error is the raised exception, or None on success.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(generate, prompt): key for key, prompt in prompts.items()}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, e
+
+
+def build_batched_prompt(prompts):
+    """
+    Combines the per-chart prompts (a dict keyed by chart) into one prompt asking for a JSON
+    object with the insights of every chart under its key.
+    """
+    sections = "\n".join(f"- {key}: {prompt}" for key, prompt in prompts.items())
+    return ("You are analyzing the charts of a media intelligence dashboard. For each chart below, "
+            "answer its request with 3 concise insights.\n"
+            f"{sections}\n"
+            f"Reply with a JSON object with the keys {', '.join(prompts)}, each holding a list of insight strings.")
+
+
+def batched_generation_config(keys):
+    """Returns the generationConfig constraining the reply to a JSON object with a list of strings per key."""
+    return {
+        "responseMimeType": "application/json",
+        "responseSchema": {
+            "type": "OBJECT",
+            "properties": {key: {"type": "ARRAY", "items": {"type": "STRING"}} for key in keys},
+            "required": list(keys),
+        },
+    }
+
+
+def parse_batched_insights(text, keys):
+    """
+    Parses a batched reply into {key: insight text} for every key holding a usable value
+    (a non-empty list of strings, numbered one per line like a per-chart reply, or a string).
+    Keys that are missing or invalid are left out; an unparseable reply gives an empty dict.
+    """
+    try:
+        reply = json.loads(text)
+    except ValueError:
+        return {}
+    if not isinstance(reply, dict):
+        return {}
+
+    insights = {}
+    for key in keys:
+        value = reply.get(key)
+        if isinstance(value, str) and value.strip():
+            insights[key] = value.strip()
+        elif isinstance(value, list):
+            items = [item.strip() for item in value if isinstance(item, str) and item.strip()]
+            if items:
+                insights[key] = "\n".join(f"{i}. {item}" for i, item in enumerate(items, 1))
+    return insights
+
+
+def generate_batched(prompts, api_key="", model=GEMINI_MODEL, cache=None, max_workers=MAX_CONCURRENT_REQUESTS):
+    """
+    Generates the insights for every prompt in the dict with one batched request, and yields
+    (key, text, error) tuples like generate_concurrently:
+    - Charts already in the persistent insight cache are answered from it, and only the
+      others are requested (alone, when just one is left).
+    - Each chart in the reply is stored in the cache under its own prompt, so per-chart and
+      batched requests share entries.
+    - Charts missing from the reply, or the whole batch when the reply is not valid JSON,
+      fall back to one request each.
+    - If the batched request itself fails, every requested chart yields its InsightError.
+    """
+    cache = cache or get_insight_cache()
+    missing = {}
+    for key, prompt in prompts.items():
+        cached = cache.get(prompt, model)
+        if cached is not None:
+            yield key, cached, None
+        else:
+            missing[key] = prompt
+
+    if len(missing) > 1:
+        try:
+            text = generate_content(build_batched_prompt(missing), api_key=api_key, model=model,
+                                    generation_config=batched_generation_config(missing))
+        except InsightError as e:
+            for key in missing:
+                yield key, None, e
+            return
+        for key, insight in parse_batched_insights(text, missing).items():
+            cache.set(missing.pop(key), insight, model)
+            yield key, insight, None
+
+    def generate_one(prompt):
+        return generate_content_cached(prompt, api_key=api_key, model=model, cache=cache)
+
+    if missing:
+        yield from generate_concurrently(missing, generate_one, max_workers=max_workers)
+
+
+# Insight requests started by request_insights, which keep running after the dashboard stops waiting
+_background_executor = None
+# Cache key of every prompt being requested in the background -> its Future
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+def get_background_executor():
+    """Returns the process-wide thread pool running background insight requests."""
+    global _background_executor
+    with _init_lock:
+        if _background_executor is None:
+            _background_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS, thread_name_prefix='insights')
+        return _background_executor
+
+
+def _run_requests(prompts, futures, api_key, model, mode, cache):
+    """Generates the insights of prompts (see request_insights) and resolves their futures."""
+    try:
+        if mode == 'batched':
+            results = generate_batched(prompts, api_key=api_key, model=model, cache=cache)
+        else:
+            results = generate_concurrently(prompts, lambda prompt: generate_content_cached(prompt, api_key=api_key, model=model, cache=cache))
+        for key, text, error in results:
+            if error is None:
+                futures[key].set_result(text)
+            else:
+                futures[key].set_exception(error)
+    except Exception as e:
+        for future in futures.values():
+            if not future.done():
+                future.set_exception(e)
+    finally:
+        with _in_flight_lock:
+            for prompt in prompts.values():
+                _in_flight.pop(InsightCache.make_key(prompt, model), None)
+
+
+def get_cached_insights(prompts, model=GEMINI_MODEL, cache=None):
+    """Returns {key: insight text} for the prompts in the dict whose insights are cached, without any request."""
+    cache = cache or get_insight_cache()
+    cached = {key: cache.get(prompt, model) for key, prompt in prompts.items()}
+    return {key: text for key, text in cached.items() if text is not None}
+
+
+def request_insights(prompts, api_key="", model=GEMINI_MODEL, mode=INSIGHT_REQUEST_MODE, cache=None):
+    """
+    Starts generating the insights of every prompt in the dict and returns {key: Future}
+    resolving to the insight text (or raising InsightError).
+    - Cached insights come back as already resolved futures.
+    - The others are requested on a background pool (batched or per chart, see
+      INSIGHT_REQUEST_MODE), so the requests finish and fill the insight cache even if the
+      caller stops waiting (see collect_within_budget).
+    - A prompt already being requested, e.g. by an earlier run, shares that request's future.
+    """
+    if mode not in INSIGHT_REQUEST_MODES:
+        raise ValueError(f"Unknown insight request mode {mode!r}; expected one of {', '.join(INSIGHT_REQUEST_MODES)}.")
+    cache = cache or get_insight_cache()
+    futures = {}
+    new_prompts = {}
+    for key, prompt in prompts.items():
+        cached = cache.get(prompt, model)
+        if cached is not None:
+            futures[key] = Future()
+            futures[key].set_result(cached)
+            continue
+        with _in_flight_lock:
+            cache_key = InsightCache.make_key(prompt, model)
+            if cache_key not in _in_flight:
+                _in_flight[cache_key] = Future()
+                new_prompts[key] = prompt
+            futures[key] = _in_flight[cache_key]
+
+    if new_prompts:
+        get_background_executor().submit(
+            _run_requests, new_prompts, {key: futures[key] for key in new_prompts}, api_key, model, mode, cache,
+        )
+    return futures
+
+
+def collect_within_budget(futures, budget_seconds=INSIGHT_LATENCY_BUDGET_SECONDS):
+    """
+    Yields (key, text, error) tuples, like generate_concurrently, for the futures of
+    request_insights that resolve within budget_seconds (None waits for all of them), in
+    completion order. Keys not yielded are still pending when the budget runs out.
+    """
+    keys_by_future = {}
+    for key, future in futures.items():
+        keys_by_future.setdefault(future, []).append(key)
+    try:
+        for future in as_completed(keys_by_future, timeout=budget_seconds):
+            error = future.exception()
+            for key in keys_by_future[future]:
+                yield key, None if error else future.result(), error
+    except FuturesTimeoutError: # Not the builtin TimeoutError before Python 3.11
+        return
+
+
+def rule_based_insights(aggregates, engagement_trend=None, trend_bucket='day', location_capacity=None):
+    """
+    Derives three deterministic insights per chart from the aggregates (see
+    StreamingAggregator.result), without any API call: majority/minority sentiment and the
+    positive:negative ratio, peak and lowest trend bucket, top and bottom platform, most and
+    least used media type, and the top locations.
+    - engagement_trend is the trend as charted (e.g. from bucket_trend, with trend_bucket
+      naming its buckets); defaults to aggregates['engagement_trend'].
+    - location_capacity is the approximate top-k capacity, mentioned when location totals
+      are estimates.
+    Returns {chart key: [insight, ...]} with the keys of the insight prompts: 'sentiment',
+    'engagement_trend', 'platform', 'media_type', 'location'.
+    """
+    insights = {}
+
+    sentiment_counts = aggregates['sentiment_counts']
+    max_sentiment = sentiment_counts.idxmax()
+    min_sentiment = sentiment_counts.idxmin()
+    insights['sentiment'] = [
+        f"Majority sentiment towards the brand/campaign is **{max_sentiment}** ({int(sentiment_counts[max_sentiment])} instances), indicating overall public perception.",
+        f"**{min_sentiment}** sentiment is the smallest portion ({int(sentiment_counts[min_sentiment])} instances), which might warrant further investigation to understand its reasons.",
+        f"The ratio of positive to negative sentiment is {int(sentiment_counts.get('positive', 0))}:{int(sentiment_counts.get('negative', 0))}, providing insight into the effectiveness of current communication campaigns."
+    ]
+
+    if engagement_trend is None:
+        engagement_trend = aggregates['engagement_trend']
+    peak_date = engagement_trend.idxmax()
+    lowest_date = engagement_trend.idxmin()
+    insights['engagement_trend'] = [
+        f"There was a significant engagement spike on **{format_trend_bucket(peak_date, trend_bucket)}** with {int(engagement_trend[peak_date])} engagements, likely related to a specific event or campaign.",
+        f"The period around **{format_trend_bucket(lowest_date, trend_bucket)}** shows stable low engagement, indicating a need for new content strategies or a review of inactive periods.",
+        "Recurring daily/weekly engagement patterns might be visible, which can be leveraged for optimal posting schedules."
+    ]
+
+    # Platform totals are sorted in descending order
+    platform_engagements = aggregates['platform_engagements']
+    insights['platform'] = [
+        f"**{platform_engagements.index[0]}** is the most dominant platform in generating engagements ({int(platform_engagements.iloc[0])}), indicating a suitable marketing focus.",
+        f"**{platform_engagements.index[-1]}** has low engagement ({int(platform_engagements.iloc[-1])}); the content strategy or resource allocation there might need re-evaluation.",
+        "Some platforms show untapped engagement growth potential."
+    ]
+
+    media_type_counts = aggregates['media_type_counts']
+    most_popular_media_type = media_type_counts.idxmax()
+    insights['media_type'] = [
+        f"**{most_popular_media_type}** content is the most frequently used format ({int(media_type_counts[most_popular_media_type])} instances), likely reflecting audience preference or current content strategy.",
+        f"There's an opportunity to experiment with **{media_type_counts.idxmin()}** media types, which are currently underutilized.",
+        "The balance across various media types can be improved to reach a wider and more diverse audience."
+    ]
+
+    top_locations = aggregates['location_engagements'].head(5)
+    if top_locations.empty:
+        insights['location'] = ["No location data available for insights."]
+    else:
+        top_location = top_locations.index[0]
+        insights['location'] = [f"**{top_location}** is the geographic area with the highest engagement ({int(top_locations.iloc[0])}), indicating a strong audience concentration or content relevance there."]
+        if len(top_locations) > 1:
+            insights['location'].append(f"Targeted geographic marketing can be further focused on areas like **{top_location}** and **{top_locations.index[1]}** for local campaigns or community events.")
+        else:
+            insights['location'].append(f"Targeted geographic marketing can be further focused on **{top_location}** for local campaigns or community events.")
+        insights['location'].append("Understanding the audience characteristics in these locations can help tailor future messages and content.")
+        if 'location_engagements_error' in aggregates:
+            max_error = int(aggregates['location_engagements_error'].head(5).max())
+            insights['location'].append(f"Location totals are estimated from the {location_capacity} most engaged locations tracked; each shown total may overstate the true one by at most {max_error} engagements.")
+
+    return insights
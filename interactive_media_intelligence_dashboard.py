@@ -9,31 +9,37 @@ Original file is located at
 # 📊 Interactive Media Intelligence Dashboard
 
 ## 📥 Step 1: Upload Your CSV File
+
+The reading, cleaning and aggregation code comes from `ingestion.py`, `analytics.py` and
+`aggregation.py` in the dashboard repository (upload them together with the data, or clone
+the repository), so this notebook matches the Flask and Streamlit apps.
 """
 
 from google.colab import files
-import pandas as pd
+from aggregation import bucket_trend, format_trend_bucket
+from analytics import analyze_files
 
 uploaded = files.upload()
 
-# Load the CSV
-for file_name in uploaded.keys():
-    df = pd.read_csv(file_name)
-    print(f"Loaded {file_name} with shape {df.shape}")
-
-"""## 🧹 Step 2: Clean the Data"""
-
-# Normalize column names
-df.columns = [col.strip().lower().replace(' ', '_') for col in df.columns]
+"""## 🧹 Step 2: Clean the Data
 
-# Convert date to datetime
-df['date'] = pd.to_datetime(df['date'], errors='coerce')
-
-# Fill missing engagements with 0
-df['engagements'] = pd.to_numeric(df['engagements'], errors='coerce').fillna(0)
+Every uploaded file (e.g. one export per platform or per day; CSV, or Parquet/Feather,
+which load much faster) is read, cleaned and aggregated in its own worker process, and
+the per-file aggregates are merged, so all files are analyzed together.
+"""
 
-# Display cleaned data
-df.head()
+# Only the six required columns are parsed and column names come back normalized; dates are
+# converted to datetime (dropping invalid dates), missing engagements filled with 0 and
+# sentiment lowercased. Every chart aggregate is computed in the same pass (engagement trend
+# bucketed by hour)
+# For free-text locations with millions of distinct values, set LOCATION_CAPACITY (e.g. 1000)
+# to track only that many locations with an approximate top-k in fixed memory
+LOCATION_CAPACITY = None
+file_names = list(uploaded.keys())
+analysis = analyze_files(file_names, location_capacity=LOCATION_CAPACITY)
+aggregates = analysis.result()
+print(f"Loaded {len(file_names)} file(s): {', '.join(file_names)}")
+print(f"Analyzed {analysis.rows} rows; removed {analysis.dropped_rows} rows due to invalid 'Date' values.")
 
 """## 📊 Step 3: Visualize the Data with Plotly"""
 
@@ -43,11 +49,11 @@ from IPython.display import display, Markdown
 
 """### 🥧 Sentiment Breakdown"""
 
-fig_sentiment = px.pie(df, names='sentiment', title='Sentiment Breakdown')
+sentiment_counts = aggregates['sentiment_counts']
+fig_sentiment = px.pie(sentiment_counts.reset_index(), values='count', names='sentiment', title='Sentiment Breakdown')
 fig_sentiment.show()
 
 # Insights
-sentiment_counts = df['sentiment'].value_counts()
 top_sentiments = sentiment_counts.head(3)
 display(Markdown("**Top 3 Sentiment Insights:**"))
 for i, (sentiment, count) in enumerate(top_sentiments.items(), 1):
@@ -55,43 +61,50 @@ for i, (sentiment, count) in enumerate(top_sentiments.items(), 1):
 
 """### 📈 Engagement Trend Over Time"""
 
-engagement_trend = df.groupby('date')['engagements'].sum().reset_index()
-fig_line = px.line(engagement_trend, x='date', y='engagements', title='Engagement Trend Over Time')
+# The hourly trend is summed into hour, day, week or month buckets chosen from the time span;
+# set TREND_BUCKET to 'hour', 'day', 'week' or 'month' to fix the bucket instead
+TREND_BUCKET = 'auto'
+engagement_trend, trend_bucket = bucket_trend(aggregates['engagement_trend'], TREND_BUCKET)
+engagement_trend = engagement_trend.reset_index()
+fig_line = px.line(engagement_trend, x='date', y='engagements', title=f'Engagement Trend Over Time (per {trend_bucket})')
 fig_line.show()
 
 top_days = engagement_trend.sort_values('engagements', ascending=False).head(3)
-display(Markdown("**Top 3 Engagement Dates:**"))
-for i, row in top_days.iterrows():
-    display(Markdown(f"{i+1}. **{row['date'].date()}** with {int(row['engagements'])} engagements"))
+display(Markdown("**Top 3 Engagement Periods:**"))
+for i, row in enumerate(top_days.itertuples(), 1):
+    display(Markdown(f"{i}. **{format_trend_bucket(row.date, trend_bucket)}** with {int(row.engagements)} engagements"))
 
 """### 📊 Platform Engagements"""
 
-platform_engagements = df.groupby('platform')['engagements'].sum().reset_index()
+platform_engagements = aggregates['platform_engagements'].reset_index()
 fig_platform = px.bar(platform_engagements, x='platform', y='engagements', title='Platform Engagements')
 fig_platform.show()
 
-top_platforms = platform_engagements.sort_values('engagements', ascending=False).head(3)
+top_platforms = platform_engagements.head(3)
 display(Markdown("**Top 3 Platforms:**"))
 for i, row in top_platforms.iterrows():
     display(Markdown(f"{i+1}. **{row['platform']}** with {int(row['engagements'])} engagements"))
 
 """### 🧾 Media Type Mix"""
 
-fig_media = px.pie(df, names='media_type', title='Media Type Mix')
+fig_media = px.pie(aggregates['media_type_counts'].reset_index(), values='count', names='media_type', title='Media Type Mix')
 fig_media.show()
 
-media_counts = df['media_type'].value_counts().head(3)
+media_counts = aggregates['media_type_counts'].head(3)
 display(Markdown("**Top 3 Media Types:**"))
 for i, (media, count) in enumerate(media_counts.items(), 1):
     display(Markdown(f"{i}. **{media}** appears {count} times."))
 
 """### 🌍 Top 5 Locations by Engagement"""
 
-location_engagements = df.groupby('location')['engagements'].sum().reset_index()
-top_locations = location_engagements.sort_values('engagements', ascending=False).head(5)
+top_locations = aggregates['location_engagements'].head(5).reset_index()
 fig_location = px.bar(top_locations, x='location', y='engagements', title='Top 5 Locations by Engagement')
 fig_location.show()
 
 display(Markdown("**Top 3 Locations:**"))
 for i, row in top_locations.head(3).iterrows():
-    display(Markdown(f"{i+1}. **{row['location']}** with {int(row['engagements'])} engagements"))
\ No newline at end of file
+    display(Markdown(f"{i+1}. **{row['location']}** with {int(row['engagements'])} engagements"))
+if 'location_engagements_error' in aggregates:
+    # Approximate totals are upper bounds: the true total is at most `error` lower
+    max_error = int(aggregates['location_engagements_error'].head(5).max())
+    display(Markdown(f"_Location totals are estimates that may overstate the true totals by at most {max_error} engagements._"))
\ No newline at end of file
@@ -0,0 +1,207 @@
+# jobs.py - Local background job queue for analyses too large to run inside a web request
+#
+# Jobs run in a pool of worker processes owned by the web process; there is no external
+# broker, so queued and finished jobs live in that process's memory only:
+#
+#   queue = JobQueue(max_workers=2, max_jobs=8)
+#   job = queue.submit(analyze_saved_upload, path, filename, content_hash, columnar_cache)
+#   queue.get(job.id).status()  # {'id': ..., 'state': 'queued' | 'running' | 'done' | 'failed', ...}
+
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import InvalidStateError, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from analytics import AnalysisError, analyze_upload
+from ingestion import DEFAULT_CHUNKSIZE
+from timing import StageTimer
+
+# Jobs running at once (one worker process each), and jobs queued or running before submit() refuses more
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', max(1, min(2, (os.cpu_count() or 1) // 2))))
+JOB_MAX_PENDING = int(os.environ.get('JOB_MAX_PENDING', 8))
+# Finished jobs whose results are kept for status and result requests (oldest dropped first)
+JOB_MAX_FINISHED = int(os.environ.get('JOB_MAX_FINISHED', 32))
+
+
+class QueueFull(Exception):
+    """Raised by JobQueue.submit when max_jobs jobs are already queued or running."""
+
+
+class Job:
+    """One submitted function call, tracked by a random id."""
+
+    def __init__(self, future, executor=None):
+        self.id = uuid.uuid4().hex
+        self.future = future
+        self.executor = executor # The pool running it
+        self.submitted_at = time.time()
+        self.finished_at = None
+
+    @property
+    def state(self):
+        if not self.future.done():
+            return 'running' if self.future.running() else 'queued'
+        return 'failed' if self.future.exception() is not None else 'done'
+
+    def status(self):
+        """Returns the job's state as a JSON-serializable dict (with a user-facing error if it failed)."""
+        state = self.state
+        finished_at = self.finished_at or time.time()
+        status = {'id': self.id, 'state': state, 'elapsed_seconds': round(finished_at - self.submitted_at, 3)}
+        if state == 'failed':
+            status['error'] = job_error_message(self.future.exception())
+        return status
+
+    def result(self):
+        """Returns the function's return value; raises its exception if it failed (call only once done)."""
+        return self.future.result()
+
+
+def job_error_message(error):
+    """Returns the message shown to users for an exception raised by a job."""
+    if isinstance(error, BrokenProcessPool):
+        return "The analysis worker stopped unexpectedly (for example, it ran out of memory). Please try again or upload a smaller file."
+    return str(error) if isinstance(error, AnalysisError) else f"An error occurred: {error}"
+
+
+class JobQueue:
+    """
+    Runs functions in a pool of worker processes and tracks them by job id.
+    - max_workers: jobs running at once; more are queued in this process.
+    - max_jobs: jobs queued or running at once; submit() raises QueueFull beyond it.
+    - max_finished: finished jobs kept for get(); older ones are forgotten.
+    Worker processes are started on first use, with the 'spawn' method, so they never
+    inherit locks held by other threads of a multithreaded web server. If a worker dies
+    (e.g. out of memory), its pool is broken: the jobs it held fail and the next submit
+    starts a fresh pool.
+    """
+
+    def __init__(self, max_workers=JOB_WORKERS, max_jobs=JOB_MAX_PENDING, max_finished=JOB_MAX_FINISHED):
+        self.max_workers = max_workers
+        self.max_jobs = max_jobs
+        self.max_finished = max_finished
+        self._executor = None
+        self._jobs = OrderedDict() # job id -> Job, in submission order
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, on_done=None, paths=()):
+        """
+        Queues func(*args) (both picklable) and returns its Job.
+        on_done(job) is called in this process once the job finishes.
+        paths are files the job deletes itself (e.g. a saved upload); they are deleted here
+        instead if its worker dies before it can.
+        """
+        with self._lock:
+            pending = sum(1 for job in self._jobs.values() if not job.future.done())
+            if pending >= self.max_jobs:
+                raise QueueFull(f"{pending} jobs are already queued or running.")
+            broken = None
+            try:
+                executor = self._get_executor()
+                future = executor.submit(func, *args)
+            except BrokenProcessPool:
+                # A worker died after the last submit, before its jobs' callbacks dropped the pool
+                broken, self._executor = executor, None
+                executor = self._get_executor()
+                future = executor.submit(func, *args)
+            job = Job(future, executor)
+            self._jobs[job.id] = job
+            self._forget_finished()
+        if broken is not None:
+            self._retire(broken)
+
+        def finished(future):
+            job.finished_at = time.time()
+            if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+                self._discard_executor(job.executor)
+                for path in paths:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+            if on_done is not None:
+                on_done(job)
+        job.future.add_done_callback(finished)
+        return job
+
+    def get(self, job_id):
+        """Returns the Job with the given id, or None if it is unknown or was forgotten."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _get_executor(self):
+        # Called with self._lock held
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def _discard_executor(self, executor):
+        """Drops a broken pool (once), so the next submit starts a fresh one, and retires it."""
+        with self._lock:
+            if executor is None or self._executor is not executor:
+                return
+            self._executor = None
+        self._retire(executor)
+
+    def _retire(self, executor):
+        # Job callbacks run on the pool's own management thread, which can't wait for itself
+        threading.Thread(target=self._fail_stranded, args=(executor,), name='job-pool-retire', daemon=True).start()
+
+    def _fail_stranded(self, executor):
+        # The broken pool fails the jobs it holds while shutting down; any it missed would stay pending forever
+        executor.shutdown(wait=True)
+        with self._lock:
+            stranded = [job for job in self._jobs.values() if job.executor is executor and not job.future.done()]
+        for job in stranded:
+            try:
+                job.future.set_exception(BrokenProcessPool("A child process terminated abruptly."))
+            except InvalidStateError:
+                pass
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.future.done()]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+    def shutdown(self, wait=True):
+        """Stops the worker processes (after the running jobs if wait is True)."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=not wait)
+
+
+def analyze_saved_upload(path, filename, content_hash=None, cache=None, chunksize=DEFAULT_CHUNKSIZE, dataset=None, store=None,
+                         location_capacity=None):
+    """
+    Job function: runs analytics.analyze_upload on an upload saved to path (with the given
+    ingestion.ColumnarCache, if any), then deletes the file. With a dataset name, the upload
+    is appended to that dataset in store (an analytics.AnalysisStore) and the merged state is
+    returned instead. location_capacity selects approximate location totals (see analytics.Analysis).
+    Returns a picklable dict with the 'aggregates', 'rows', 'dropped_rows', the stage
+    'durations' (seconds) measured in the worker, the upload's own 'delta_rows', the 'dataset',
+    whether the upload was 'appended' (None without a dataset) and its 'content_hash'.
+    """
+    timer = StageTimer()
+    try:
+        analysis = analyze_upload(
+            path, filename, content_hash=content_hash, cache=cache, chunksize=chunksize, timer=timer,
+            location_capacity=location_capacity,
+        )
+        delta_rows = analysis.rows
+        appended = None
+        if dataset is not None:
+            with timer.span('append'):
+                analysis, appended = store.append(dataset, analysis, content_hash)
+        with timer.span('aggregate'):
+            aggregates = analysis.result()
+    finally:
+        os.remove(path)
+    return {
+        'aggregates': aggregates, 'rows': analysis.rows, 'dropped_rows': analysis.dropped_rows, 'durations': timer.durations,
+        'delta_rows': delta_rows, 'dataset': dataset, 'appended': appended, 'content_hash': content_hash,
+    }
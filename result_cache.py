@@ -0,0 +1,115 @@
+# result_cache.py - Size-bounded LRU cache of rendered dashboard results, in memory and on disk
+
+import gzip
+import json
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR', '.result_cache')
+RESULT_CACHE_MAX_MEMORY_BYTES = int(os.environ.get('RESULT_CACHE_MAX_MEMORY_BYTES', 64 * 1024 * 1024))
+RESULT_CACHE_MAX_DISK_BYTES = int(os.environ.get('RESULT_CACHE_MAX_DISK_BYTES', 512 * 1024 * 1024))
+
+# Keys are hex digests; anything else (e.g. from a URL) is treated as a miss
+_KEY_PATTERN = re.compile(r'[0-9a-f]{16,128}')
+
+
+class ResultCache:
+    """
+    Two-level LRU cache of JSON-serializable results (e.g. rendered chart fragments and
+    insight lists), keyed by hex digests such as a hash of the upload:
+    - Memory: entries kept as serialized JSON; beyond max_memory_bytes the least recently
+      used are evicted.
+    - Disk: one gzipped JSON file per entry, written under a temporary name and renamed into
+      place; beyond max_disk_bytes the least recently used files are deleted. Entries survive
+      restarts and are shared by every process using the directory.
+    A disk hit is promoted back into memory.
+    """
+
+    def __init__(self, directory=RESULT_CACHE_DIR, max_memory_bytes=RESULT_CACHE_MAX_MEMORY_BYTES,
+                 max_disk_bytes=RESULT_CACHE_MAX_DISK_BYTES):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict() # key -> JSON bytes, least recently used first
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json.gz")
+
+    def get(self, key):
+        """Returns the cached result for key, or None if it is not cached (or key is malformed)."""
+        if not _KEY_PATTERN.fullmatch(key):
+            return None
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+        if data is None:
+            path = self._path(key)
+            try:
+                with open(path, 'rb') as f:
+                    data = gzip.decompress(f.read())
+                os.utime(path) # Mark as recently used
+            except (FileNotFoundError, OSError, EOFError):
+                return None
+            self._remember(key, data)
+        return json.loads(data)
+
+    def put(self, key, result):
+        """Stores a JSON-serializable result under key, in memory and on disk."""
+        if not _KEY_PATTERN.fullmatch(key):
+            raise ValueError(f"Invalid result cache key: {key!r}")
+        data = json.dumps(result).encode('utf-8')
+        self._remember(key, data)
+
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{self._path(key)}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(gzip.compress(data, compresslevel=5))
+        os.replace(tmp_path, self._path(key))
+        self._evict_disk()
+
+    def clear(self):
+        """Removes every entry, in memory and on disk."""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+        if os.path.isdir(self.directory):
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.json.gz'):
+                    os.remove(entry.path)
+
+    def _remember(self, key, data):
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_bytes -= len(previous)
+            if len(data) > self.max_memory_bytes:
+                return
+            self._memory[key] = data
+            self._memory_bytes += len(data)
+            while self._memory_bytes > self.max_memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+    def _evict_disk(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json.gz'):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.stat().st_size, entry.path))
+                except FileNotFoundError:
+                    pass
+        entries.sort(reverse=True)
+        total = 0
+        for _, size, path in entries:
+            total += size
+            if total > self.max_disk_bytes:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
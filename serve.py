@@ -0,0 +1,97 @@
+# serve.py - Production entry point: the Flask dashboard under gunicorn's pre-fork server
+#
+# Usage (Linux/macOS; needs `pip install gunicorn`):
+#   python serve.py                                   # 0.0.0.0:8000, one worker per core
+#   python serve.py --bind 127.0.0.1:8080 --workers 4 --max-requests 500
+#   WEB_WORKERS=4 WEB_MAX_REQUESTS=500 python serve.py
+#
+# The app is imported once in the parent process with STARTUP_MODE=eager, so pandas, plotly,
+# the gzipped plotly.js bundle and the compiled HTML_TEMPLATE are loaded before the workers
+# are forked and shared by them copy-on-write. GET /ready answers 200 once a worker can serve.
+
+import argparse
+import gc
+import importlib.util
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Address to listen on, worker processes (each serves one request at a time), and requests a
+# worker serves before it is replaced by a fresh fork (plus a random jitter, so workers don't
+# all restart at once; 0 disables the limit)
+WEB_BIND = os.environ.get('WEB_BIND', f"0.0.0.0:{os.environ.get('PORT', 8000)}")
+WEB_WORKERS = int(os.environ.get('WEB_WORKERS', os.cpu_count() or 1))
+WEB_MAX_REQUESTS = int(os.environ.get('WEB_MAX_REQUESTS', 1000))
+WEB_MAX_REQUESTS_JITTER = int(os.environ.get('WEB_MAX_REQUESTS_JITTER', 100))
+# Seconds a request may run before its worker is killed and replaced; large uploads are
+# analyzed inside the request, so this is well above gunicorn's default of 30
+WEB_TIMEOUT = int(os.environ.get('WEB_TIMEOUT', 600))
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:
+    sys.exit("The production server needs the 'gunicorn' package (Linux/macOS). Install it with: pip install gunicorn")
+
+
+def load_dashboard():
+    """
+    Imports streamliit-app.py (not an importable module name) with everything preloaded, and
+    returns the module. Objects allocated so far are moved out of the garbage collector's
+    reach, so collections in the workers don't write to (and thereby copy) the shared pages.
+    """
+    # The warm-up must finish before forking: a background thread would not survive the fork
+    os.environ['STARTUP_MODE'] = 'eager'
+    sys.path.insert(0, ROOT_DIR)
+    spec = importlib.util.spec_from_file_location('streamliit_app', os.path.join(ROOT_DIR, 'streamliit-app.py'))
+    dashboard = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = dashboard
+    spec.loader.exec_module(dashboard)
+    gc.freeze()
+    return dashboard
+
+
+class DashboardServer(BaseApplication):
+    """gunicorn application serving the dashboard, loaded once in the parent process (preload_app)."""
+
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        dashboard = load_dashboard()
+        if self.cfg.workers > 1:
+            # Background jobs are tracked in the memory of the worker that queued them, and
+            # their status requests may reach any worker; /jobs is turned off and large uploads
+            # are analyzed inline (each worker is its own process, so one long analysis blocks
+            # no other request)
+            dashboard.app.config['JOB_QUEUE_ENABLED'] = False
+        return dashboard.app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Flask dashboard under a pre-fork server.")
+    parser.add_argument('--bind', default=WEB_BIND, help="Address to listen on (host:port).")
+    parser.add_argument('--workers', type=int, default=WEB_WORKERS, help="Worker processes.")
+    parser.add_argument('--max-requests', type=int, default=WEB_MAX_REQUESTS, help="Requests per worker before it is replaced (0: no limit).")
+    parser.add_argument('--max-requests-jitter', type=int, default=WEB_MAX_REQUESTS_JITTER)
+    parser.add_argument('--timeout', type=int, default=WEB_TIMEOUT, help="Seconds before a busy worker is killed.")
+    args = parser.parse_args()
+
+    DashboardServer({
+        'bind': args.bind,
+        'workers': args.workers,
+        'max_requests': args.max_requests,
+        'max_requests_jitter': args.max_requests_jitter,
+        'timeout': args.timeout,
+        'preload_app': True,
+        'accesslog': '-',
+    }).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# startup.py - Deferred imports of the heavy libraries and a warm-up hook for fast cold starts
+#
+# Modules bind pandas, numpy and plotly through deferred_import, so importing a dashboard
+# only costs Flask/Streamlit themselves; the libraries load on first use, or earlier from
+# the warm-up hook:
+#
+#   pd = deferred_import('pandas')
+#   start_warm_up()          # STARTUP_MODE 'background': preload in a daemon thread
+#   warm_up_done.is_set()    # True once everything is imported and primed
+
+import importlib
+import os
+import threading
+import time
+
+# How the heavy libraries are loaded when a dashboard starts:
+# - 'background': serve immediately and import/prime them in a background thread; the first
+#   upload only waits for whatever is not loaded yet
+# - 'eager': import and prime them before serving (e.g. in a pre-fork server's parent process)
+# - 'lazy': import each one on first use, with no warm-up
+STARTUP_MODE = os.environ.get('STARTUP_MODE', 'background')
+STARTUP_MODES = ('background', 'eager', 'lazy')
+
+# Set once warm_up has finished (in any mode), e.g. for readiness checks
+warm_up_done = threading.Event()
+# Seconds the last warm-up took
+warm_up_seconds = None
+
+
+class DeferredModule:
+    """
+    Stands in for a module that is imported on first attribute access.
+    Attributes are copied onto the stand-in as they are looked up, so later accesses cost
+    the same as on the module itself. Concurrent first accesses are serialized by the
+    import system's module locks.
+    """
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+
+    def __getattr__(self, attribute):
+        value = getattr(importlib.import_module(self._name), attribute)
+        self.__dict__[attribute] = value
+        return value
+
+    def __repr__(self):
+        return f"<deferred module {self._name!r}>"
+
+
+def deferred_import(name):
+    """Returns a stand-in for the named module that imports it on first use (see DeferredModule)."""
+    return DeferredModule(name)
+
+
+def prime_figures():
+    """
+    Builds and serializes one small figure of each kind the dashboards draw, which loads
+    plotly's trace validators and its default layout template.
+    """
+    import pandas as pd
+    import plotly.express as px
+
+    frame = pd.DataFrame({'label': ['a', 'b'], 'date': pd.to_datetime(['2024-01-01', '2024-01-02']), 'value': [1, 2]})
+    for fig in (
+        px.line(frame, x='date', y='value'),
+        px.bar(frame, x='label', y='value', color='value'),
+        px.pie(frame, values='value', names='label'),
+    ):
+        fig.to_json()
+
+
+def warm_up(*hooks):
+    """
+    Imports pandas, plotly and the shared analysis modules, primes the figure templates
+    (see prime_figures), then calls each hook (e.g. a frontend's own caches).
+    Sets warm_up_done when finished.
+    """
+    global warm_up_seconds
+    started = time.perf_counter()
+    for name in ('numpy', 'pandas', 'plotly.express', 'plotly.io', 'ingestion', 'aggregation', 'analytics', 'insights'):
+        importlib.import_module(name)
+    prime_figures()
+    for hook in hooks:
+        hook()
+    warm_up_seconds = time.perf_counter() - started
+    warm_up_done.set()
+
+
+def start_warm_up(*hooks, mode=STARTUP_MODE):
+    """
+    Starts warm_up(*hooks) according to mode (see STARTUP_MODE): 'eager' runs it now,
+    'background' in a daemon thread (which is returned), 'lazy' not at all.
+    """
+    if mode not in STARTUP_MODES:
+        raise ValueError(f"Unknown startup mode {mode!r}; expected one of {', '.join(STARTUP_MODES)}.")
+    if mode == 'eager':
+        warm_up(*hooks)
+    elif mode == 'background':
+        thread = threading.Thread(target=warm_up, args=hooks, name='warm-up', daemon=True)
+        thread.start()
+        return thread
+    return None
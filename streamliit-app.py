@@ -1,12 +1,94 @@
 # app.py - Interactive Media Intelligence Dashboard
 
-import pandas as pd
-import plotly.express as px
-from flask import Flask, request, render_template_string
-import io
+import functools
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flask import Flask, Response, abort, g, jsonify, redirect, request, render_template, url_for
+from ingestion import ColumnarCache, DEFAULT_CHUNKSIZE, hash_stream
+from aggregation import TREND_BUCKETS, bucket_trend, downsample_lttb
+from analytics import AnalysisError, AnalysisStore, analyze_upload
+from insights import rule_based_insights
+from jobs import JOB_MAX_PENDING, JOB_WORKERS, JobQueue, QueueFull, analyze_saved_upload
+from result_cache import ResultCache
+from startup import STARTUP_MODE, deferred_import, start_warm_up, warm_up_done
+from timing import StageHistograms, StageTimer
+
+# pandas and plotly load with the first upload, or earlier from the warm-up (see STARTUP_MODE below)
+pd = deferred_import('pandas')
+px = deferred_import('plotly.express')
+pio = deferred_import('plotly.io')
+plotly_offline = deferred_import('plotly.offline')
 
 app = Flask(__name__)
 
+# Rows parsed per chunk when reading uploads; set to None to parse the whole file at once
+app.config['CSV_CHUNKSIZE'] = DEFAULT_CHUNKSIZE
+
+# CSV uploads are converted once into Parquet (six typed columns) and re-read from there
+columnar_cache = ColumnarCache()
+
+# Persisted aggregate states of named datasets, which uploads in append mode are merged into
+analysis_store = AnalysisStore()
+
+# Rendered charts and insights of analyzed uploads, keyed by upload hash and render settings
+# (see result_key), so repeat uploads and their /results/<key> URL cost a lookup
+result_cache = ResultCache()
+
+# How charts are shipped to the browser:
+# - 'json': compact figure specs drawn by plotly.js served once from this app (no CDN needed)
+# - 'cdn': self-contained HTML fragments that each load plotly.js from the CDN
+app.config['CHART_RENDER_MODE'] = 'json'
+
+# Engagement trend buckets: 'auto' picks hour, day, week or month from the data's time span so
+# the trend fits TREND_MAX_POINTS; one of those names fixes the bucket (users can also pick it
+# per upload with the form's 'trend_bucket' field)
+app.config['TREND_BUCKET'] = 'auto'
+# Most points drawn for the engagement trend; longer series (e.g. a fixed hourly bucket over
+# years) are downsampled with LTTB
+app.config['TREND_MAX_POINTS'] = 2000
+# Number of recent full-resolution trends kept in memory for zoom-in detail requests
+app.config['TREND_DETAIL_MAX_DATASETS'] = 32
+# Disk space for the trends of results outside result_cache (e.g. saved datasets), written to
+# trend_cache so zoom-in requests reaching another worker of a pre-fork server can reload them
+app.config['TREND_DETAIL_MAX_DISK_BYTES'] = 64 * 1024 * 1024
+
+# Locations tracked by an approximate top-k (Space-Saving) instead of exact per-location totals,
+# for free-text locations with millions of distinct values; None keeps exact totals
+app.config['LOCATION_TOP_K_CAPACITY'] = None
+
+# Background jobs live in this process's memory, so they only work when every request reaches
+# the same process; a multi-worker server (see serve.py) turns them off, and then /jobs answers
+# 503 and every /analyze upload is analyzed inline
+app.config['JOB_QUEUE_ENABLED'] = True
+# Uploads to /analyze of at least this many bytes are analyzed by a background job instead of
+# inside the request (None analyzes every upload inline); POST /jobs always queues
+app.config['JOB_MIN_UPLOAD_BYTES'] = 50 * 1024 * 1024
+# Worker processes running jobs at once, and jobs queued or running before new ones are refused
+app.config['JOB_WORKERS'] = JOB_WORKERS
+app.config['JOB_MAX_PENDING'] = JOB_MAX_PENDING
+# Where queued uploads wait for a worker (each is deleted once analyzed)
+app.config['JOB_UPLOAD_DIR'] = os.path.join(tempfile.gettempdir(), 'media-dashboard-uploads')
+
+# Background job queue, created on first use (see get_job_queue)
+job_queue = None
+_job_queue_lock = threading.Lock()
+
+# How pandas/plotly are loaded at startup (see startup.STARTUP_MODE): 'background' serves at
+# once and preloads them, plotly.js and the chart template in a background thread, 'eager'
+# preloads them before serving, 'lazy' loads them with the first upload
+app.config['STARTUP_MODE'] = STARTUP_MODE
+
+# Per-stage durations of every analysis, exposed on /metrics
+stage_histograms = StageHistograms()
+
 # HTML Template for the web application
 # This template includes the upload form and placeholders for charts and insights.
 HTML_TEMPLATE = """
@@ -16,11 +98,14 @@ HTML_TEMPLATE = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Media Intelligence Dashboard</title>
-    <script src="https://cdn.tailwindcss.com"></script>
-    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap" rel="stylesheet">
+    <link href="{{ url_for('static', filename='tailwind-subset.css') }}" rel="stylesheet">
+    {% if plotly_js_url %}
+    <script src="{{ plotly_js_url }}"></script>
+    {% endif %}
     <style>
         body {
-            font-family: 'Inter', sans-serif;
+            /* Inter when installed, else the system UI font (no web font download) */
+            font-family: 'Inter', system-ui, -apple-system, 'Segoe UI', Roboto, sans-serif;
             background-color: #f3f4f6; /* Light gray background */
         }
         .container {
@@ -58,16 +143,25 @@ HTML_TEMPLATE = """
 
         <div class="card">
             <h2 class="text-2xl font-semibold text-gray-700 mb-4">1. Upload Your CSV File</h2>
-            <p class="text-gray-600 mb-4">Please upload a CSV file with the following columns: <code class="font-mono bg-gray-200 px-2 py-1 rounded-md">Date</code>, <code class="font-mono bg-gray-200 px-2 py-1 rounded-md">Platform</code>, <code class="font-mono bg-gray-200 px-2 py-1 rounded-md">Sentiment</code>, <code class="font-mono bg-gray-200 px-2 py-1 rounded-md">Location</code>, <code class="font-mono bg-gray-200 px-2 py-1 rounded-md">Engagements</code>, <code class="font-mono bg-gray-200 px-2 py-1 rounded-md">Media Type</code>.</p>
+            <p class="text-gray-600 mb-4">Please upload a CSV (or Parquet/Feather) file with the following columns: <code class="font-mono bg-gray-200 px-2 py-1 rounded-md">Date</code>, <code class="font-mono bg-gray-200 px-2 py-1 rounded-md">Platform</code>, <code class="font-mono bg-gray-200 px-2 py-1 rounded-md">Sentiment</code>, <code class="font-mono bg-gray-200 px-2 py-1 rounded-md">Location</code>, <code class="font-mono bg-gray-200 px-2 py-1 rounded-md">Engagements</code>, <code class="font-mono bg-gray-200 px-2 py-1 rounded-md">Media Type</code>.</p>
             <form action="/analyze" method="post" enctype="multipart/form-data" class="flex flex-col items-center">
                 <label for="csvFile" class="sr-only">Upload CSV</label>
-                <input type="file" name="csvFile" id="csvFile" accept=".csv" required
+                <input type="file" name="csvFile" id="csvFile" accept=".csv,.parquet,.pq,.feather,.arrow" required
                        class="block w-full text-sm text-gray-500
                               file:mr-4 file:py-2 file:px-4
                               file:rounded-full file:border-0
                               file:text-sm file:font-semibold
                               file:bg-blue-50 file:text-blue-700
                               hover:file:bg-blue-100 cursor-pointer mb-6">
+                <label for="dataset" class="text-gray-600 mb-2">Append to dataset (optional): only new rows need to be uploaded, and the dashboard shows every upload merged so far.</label>
+                <input type="text" name="dataset" id="dataset" placeholder="e.g. spring-campaign" pattern="[A-Za-z0-9][A-Za-z0-9_.\-]{0,63}"
+                       class="block w-full max-w-md border border-gray-300 rounded-full px-4 py-2 text-sm mb-6">
+                <label for="trend_bucket" class="text-gray-600 mb-2">Engagement trend buckets:</label>
+                <select name="trend_bucket" id="trend_bucket" class="block border border-gray-300 rounded-full px-4 py-2 text-sm mb-6">
+                    {% for option in trend_bucket_options %}
+                    <option value="{{ option }}"{% if option == trend_bucket %} selected{% endif %}>{{ 'Automatic (fits the time span)' if option == 'auto' else option | capitalize }}</option>
+                    {% endfor %}
+                </select>
                 <button type="submit"
                         class="px-6 py-3 bg-blue-600 text-white font-semibold rounded-full
                                hover:bg-blue-700 focus:outline-none focus:ring-2
@@ -81,6 +175,15 @@ HTML_TEMPLATE = """
         <div class="card">
             <h2 class="text-2xl font-semibold text-gray-700 mb-4">2. Data Cleaning & Visualization</h2>
             <p class="text-gray-600 mb-6">Your data has been cleaned (Date to datetime, missing Engagements to 0, and column names normalized) and visualized below.</p>
+            {% if notice %}
+            <p class="text-green-700 mb-6">{{ notice }}</p>
+            {% endif %}
+            {% if result_url %}
+            <p class="text-gray-600 mb-6">Link to these results: <a href="{{ result_url }}" class="text-blue-600 underline">{{ result_url }}</a></p>
+            {% endif %}
+            {% if dropped_rows %}
+            <p class="text-yellow-700 mb-6">Removed {{ dropped_rows }} rows due to invalid 'Date' values.</p>
+            {% endif %}
 
             <h3 class="text-xl font-semibold text-gray-700 mb-4">Sentiment Breakdown</h3>
             <div class="plotly-chart">
@@ -147,6 +250,12 @@ HTML_TEMPLATE = """
                 </ul>
             </div>
         </div>
+        {% elif job %}
+        <div class="card" id="job" data-status-url="{{ job.status_url }}">
+            <h2 class="text-2xl font-semibold text-gray-700 mb-4">2. Analyzing Your File</h2>
+            <p class="text-gray-600 mb-4">Your file is being analyzed in the background (job <code class="font-mono bg-gray-200 px-2 py-1 rounded-md">{{ job.id }}</code>). This page shows the dashboard as soon as it is ready; you can also bookmark it and come back later.</p>
+            <p class="text-gray-600">Status: <span id="job-state" class="font-semibold">{{ job.state }}</span></p>
+        </div>
         {% elif error %}
         <div class="card bg-red-100 border border-red-400 text-red-700 px-4 py-3 rounded relative" role="alert">
             <strong class="font-bold">Error!</strong>
@@ -154,181 +263,630 @@ HTML_TEMPLATE = """
         </div>
         {% endif %}
     </div>
+    {% if chart_htmls and plotly_template_json %}
+    <script type="application/json" id="plotly-template">{{ plotly_template_json | safe }}</script>
+    <script>
+        // Draw every figure spec; the shared layout template is shipped once for all charts
+        const plotlyTemplate = JSON.parse(document.getElementById('plotly-template').textContent);
+        document.querySelectorAll('script.plotly-spec').forEach(function (specElement) {
+            const spec = JSON.parse(specElement.textContent);
+            const chart = document.createElement('div');
+            specElement.after(chart);
+            spec.layout.template = plotlyTemplate;
+            Plotly.newPlot(chart, spec.data, spec.layout, {responsive: true});
+
+            // Downsampled charts fetch a finer sample of the visible range after each zoom
+            const detailUrl = specElement.dataset.detailUrl;
+            if (detailUrl) {
+                chart.on('plotly_relayout', function (event) {
+                    const range = event['xaxis.range'] || (event['xaxis.range[0]'] && [event['xaxis.range[0]'], event['xaxis.range[1]']]);
+                    if (!range && !event['xaxis.autorange']) {
+                        return;
+                    }
+                    const query = range ? '?' + new URLSearchParams({start: range[0], end: range[1]}) : '';
+                    fetch(detailUrl + query)
+                        .then(function (response) { return response.ok ? response.json() : null; })
+                        .then(function (detail) {
+                            if (detail) {
+                                Plotly.restyle(chart, {x: [detail.x], y: [detail.y]}, [0]);
+                            }
+                        });
+                });
+            }
+        });
+    </script>
+    {% endif %}
+    {% if job %}
+    <script>
+        // Poll the job status and reload into the finished dashboard (or its error)
+        const jobCard = document.getElementById('job');
+        const jobPoll = setInterval(function () {
+            fetch(jobCard.dataset.statusUrl)
+                .then(function (response) { return response.ok ? response.json() : null; })
+                .then(function (status) {
+                    if (!status) {
+                        return;
+                    }
+                    document.getElementById('job-state').textContent = status.state;
+                    if (status.state === 'done' || status.state === 'failed') {
+                        clearInterval(jobPoll);
+                        window.location.reload();
+                    }
+                });
+        }, 2000);
+    </script>
+    {% endif %}
 </body>
 </html>
 """
 
+@functools.lru_cache(maxsize=None)
+def bundled_plotly_js():
+    """
+    Returns the plotly.js bundled with the plotly package as (raw bytes, gzipped bytes, ETag).
+    Built once per process, so every request serves the same precompressed payload.
+    """
+    script = plotly_offline.get_plotlyjs().encode('utf-8')
+    return script, gzip.compress(script), hashlib.sha256(script).hexdigest()[:16]
+
+@functools.lru_cache(maxsize=None)
+def plotly_template_json():
+    """Returns the default Plotly layout template as JSON, shared by every figure spec on a page."""
+    return pio.to_json(pio.templates[pio.templates.default].to_plotly_json(), validate=False, remove_uids=False).replace('</', '<\\/')
+
+def render_chart(fig, detail_url=None):
+    """
+    Renders a figure for HTML_TEMPLATE according to app.config['CHART_RENDER_MODE'].
+    In 'json' mode this is a compact spec without the layout template (which the page ships once),
+    inside a JSON script tag; in 'cdn' mode it is Plotly's own HTML fragment.
+    detail_url (json mode only) is queried with the visible x range whenever the user zooms.
+    """
+    if app.config['CHART_RENDER_MODE'] == 'cdn':
+        return fig.to_html(full_html=False, include_plotlyjs='cdn')
+    spec = fig.to_plotly_json()
+    spec['layout'].pop('template', None)
+    # Escape '</' so titles containing HTML can't terminate the script tag
+    spec_json = pio.to_json(spec, validate=False).replace('</', '<\\/')
+    detail_attr = f' data-detail-url="{detail_url}"' if detail_url else ''
+    return f'<script type="application/json" class="plotly-spec"{detail_attr}>{spec_json}</script>'
+
+# Full-resolution engagement trends of recent analyses and their trend bucket setting, keyed
+# by trend id (oldest evicted first)
+_trend_details = OrderedDict()
+_trend_details_lock = threading.Lock()
+# Trends outside result_cache on disk, shared by every worker (kept in memory by _trend_details only)
+trend_cache = ResultCache(
+    os.path.join(result_cache.directory, 'trends'), max_memory_bytes=0, max_disk_bytes=app.config['TREND_DETAIL_MAX_DISK_BYTES'],
+)
+
+def trend_to_json(engagement_trend, trend_bucket):
+    """Returns a full-resolution trend and its trend bucket setting as a JSON-serializable dict (see load_cached_trend)."""
+    return {'x': engagement_trend.index.strftime('%Y-%m-%d %H:%M:%S').tolist(), 'y': engagement_trend.tolist(), 'bucket': trend_bucket}
+
+def trend_digest(engagement_trend, trend_bucket):
+    """Returns an id derived from a trend's dates, values and bucket setting, so the same trend always gets the same id."""
+    digest = hashlib.sha256(pd.util.hash_pandas_object(engagement_trend).to_numpy().tobytes())
+    digest.update(trend_bucket.encode('utf-8'))
+    return digest.hexdigest()[:32]
+
+def store_trend_detail(engagement_trend, trend_bucket, trend_id=None):
+    """
+    Keeps a full-resolution trend for later zoom-in requests and returns its id. Without a
+    trend_id (a result cache key, whose entry holds the trend), the id is derived from the
+    trend itself (see trend_digest), so repeated views of e.g. an unchanged dataset share it,
+    and the trend is also written to trend_cache unless this process already holds it.
+    """
+    if trend_id is None:
+        trend_id = trend_digest(engagement_trend, trend_bucket)
+        with _trend_details_lock:
+            known = trend_id in _trend_details
+        if not known:
+            trend_cache.put(trend_id, {'trend': trend_to_json(engagement_trend, trend_bucket)})
+    with _trend_details_lock:
+        _trend_details[trend_id] = (engagement_trend, trend_bucket)
+        while len(_trend_details) > app.config['TREND_DETAIL_MAX_DATASETS']:
+            _trend_details.popitem(last=False)
+    return trend_id
+
+@functools.lru_cache(maxsize=None)
+def dashboard_template():
+    """Returns HTML_TEMPLATE compiled once per process (render_template_string would compile it on every call)."""
+    return app.jinja_env.from_string(HTML_TEMPLATE)
+
+def render_dashboard(**context):
+    """Renders HTML_TEMPLATE with the script/template settings of the current chart render mode."""
+    if app.config['CHART_RENDER_MODE'] == 'json':
+        context.setdefault('plotly_js_url', url_for('plotly_js', v=plotly_offline.get_plotlyjs_version()))
+        context.setdefault('plotly_template_json', plotly_template_json())
+    context.setdefault('trend_bucket', requested_trend_bucket())
+    return render_template(dashboard_template(), trend_bucket_options=['auto', *TREND_BUCKETS], **context)
+
+def requested_trend_bucket():
+    """Returns the trend bucket picked in the request ('trend_bucket' form or query field), or app.config['TREND_BUCKET']."""
+    bucket = request.values.get('trend_bucket', '')
+    return bucket if bucket == 'auto' or bucket in TREND_BUCKETS else app.config['TREND_BUCKET']
+
+@app.route('/plotly.min.js')
+def plotly_js():
+    """
+    Serves the locally bundled plotly.js, gzipped when the browser accepts it.
+    The URL carries the plotly.js version, so the script is cached for a year; the ETag
+    also lets browsers revalidate with a 304 instead of downloading it again.
+    """
+    script, script_gzip, etag = bundled_plotly_js()
+    use_gzip = 'gzip' in request.accept_encodings
+    response = Response(script_gzip if use_gzip else script, mimetype='application/javascript')
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+@app.route('/trend/<trend_id>')
+def trend_detail(trend_id):
+    """
+    Returns the engagement trend between the optional 'start' and 'end' query parameters as
+    JSON {x: [...], y: [...]}, in buckets re-chosen for the visible span when the trend bucket
+    is 'auto' (so zooming in goes from months down to hours) and at most
+    app.config['TREND_MAX_POINTS'] points.
+    Trends this process doesn't hold, e.g. stored by another worker of a pre-fork server, are
+    reloaded from result_cache (for cached results, whose id is their result key) or trend_cache.
+    """
+    with _trend_details_lock:
+        detail = _trend_details.get(trend_id)
+        if detail is not None:
+            _trend_details.move_to_end(trend_id)
+    if detail is None:
+        result = result_cache.get(trend_id) or trend_cache.get(trend_id)
+        if result is None or result['trend'] is None:
+            abort(404)
+        detail = load_cached_trend(trend_id, result)
+    engagement_trend, trend_bucket = detail
+
+    try:
+        start = pd.Timestamp(request.args['start']) if 'start' in request.args else None
+        end = pd.Timestamp(request.args['end']) if 'end' in request.args else None
+    except ValueError:
+        abort(400)
+    visible, _ = bucket_trend(engagement_trend.loc[start:end], trend_bucket, app.config['TREND_MAX_POINTS'])
+    visible = downsample_lttb(visible, app.config['TREND_MAX_POINTS'])
+    return jsonify(x=visible.index.strftime('%Y-%m-%d %H:%M:%S').tolist(), y=visible.tolist())
+
+@app.after_request
+def add_server_timing(response):
+    """
+    Sends the stages timed during the request as a Server-Timing header (shown in the
+    browser's network panel) and adds them to the /metrics histograms.
+    """
+    timer = g.get('timer')
+    if timer is not None and timer.durations:
+        response.headers['Server-Timing'] = timer.server_timing()
+        stage_histograms.observe_timer(timer)
+    return response
+
+@app.route('/ready')
+def ready():
+    """
+    Readiness check for load balancers and orchestrators: 200 once the warm-up (see
+    app.config['STARTUP_MODE']) has preloaded everything, 503 before. In 'lazy' mode there is no
+    warm-up, so the app is always reported ready.
+    """
+    if warm_up_done.is_set() or app.config['STARTUP_MODE'] == 'lazy':
+        return jsonify(status='ready')
+    return jsonify(status='warming up'), 503, {'Retry-After': '1'}
+
+@app.route('/metrics')
+def metrics():
+    """Returns the per-stage duration histograms in the Prometheus text format."""
+    return Response(stage_histograms.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def index():
     """
     Renders the main page with the CSV upload form.
     """
-    return render_template_string(HTML_TEMPLATE, chart_htmls=None, error=None)
+    return render_dashboard(chart_htmls=None, error=None)
+
+def result_key(content_hash, trend_bucket):
+    """
+    Returns the result cache key of an upload: a hash of its content hash and the settings
+    that shape the rendered charts and insights, so changing them doesn't serve stale results.
+    """
+    settings = [
+        content_hash, app.config['CHART_RENDER_MODE'], trend_bucket, app.config['TREND_MAX_POINTS'],
+        app.config['LOCATION_TOP_K_CAPACITY'],
+    ]
+    return hashlib.sha256(json.dumps(settings).encode('utf-8')).hexdigest()
+
+def load_cached_trend(key, result):
+    """
+    Registers the full-resolution trend of a result_cache or trend_cache entry for zoom-in
+    requests and returns it with its trend bucket setting.
+    """
+    trend = result['trend']
+    engagement_trend = pd.Series(trend['y'], index=pd.DatetimeIndex(trend['x'], name='date'), name='engagements')
+    store_trend_detail(engagement_trend, trend['bucket'], trend_id=key)
+    return engagement_trend, trend['bucket']
+
+def render_cached_result(key, result):
+    """
+    Renders a dashboard from a result cache entry (see render_analysis), re-registering its
+    full-resolution trend for zoom-in requests if this process no longer holds it.
+    """
+    if result['trend'] is not None and key not in _trend_details:
+        load_cached_trend(key, result)
+    return render_dashboard(
+        chart_htmls=result['chart_htmls'], insights=result['insights'], dropped_rows=result['dropped_rows'],
+        result_url=url_for('cached_result', key=key, _external=True), error=None,
+    )
+
+def render_analysis(aggregates, dropped_rows, timer, notice=None, key=None, trend_bucket='auto'):
+    """
+    Builds the five charts and their rule-based insights from finished aggregates (see
+    StreamingAggregator.result) and renders the dashboard, timing the stages into timer.
+    Used for uploads analyzed inside the request, finished background jobs and saved datasets;
+    notice is an optional status line shown above the charts.
+    With a result cache key (see result_key), the charts and insights are also stored in
+    result_cache and the page links to their /results/<key> URL.
+    trend_bucket is 'auto' or a fixed bucket for the engagement trend (see aggregation.TREND_BUCKETS).
+    """
+    # Figures, rule-based insights and their serialization (also timed alone as charts.serialize)
+    charts_started = time.perf_counter()
+
+    chart_htmls = {}
+
+    # 3. Build 5 interactive charts using Plotly
+    # 3.1. Pie chart: Sentiment Breakdown
+    sentiment_counts = aggregates['sentiment_counts'].reset_index()
+    sentiment_counts.columns = ['Sentiment', 'Count']
+    fig_sentiment = px.pie(
+        sentiment_counts,
+        values='Count',
+        names='Sentiment',
+        title='<span style="font-size: 1.5em; font-weight: bold;">Sentiment Breakdown</span>',
+        color_discrete_sequence=px.colors.sequential.RdBu
+    )
+    with timer.span('charts.serialize'):
+        chart_htmls['sentiment'] = render_chart(fig_sentiment)
+
+    # 3.2. Line chart: Engagement Trend over time
+    # The hourly trend is summed into hour/day/week/month buckets that fit the point budget
+    # (LTTB-downsampled if a fixed bucket still has too many); insights use every bucket
+    engagement_over_time, bucket = bucket_trend(aggregates['engagement_trend'], trend_bucket, app.config['TREND_MAX_POINTS'])
+    trend_points = downsample_lttb(engagement_over_time, app.config['TREND_MAX_POINTS']).reset_index()
+    fig_engagement_time = px.line(
+        trend_points,
+        x='date',
+        y='engagements',
+        title='<span style="font-size: 1.5em; font-weight: bold;">Engagement Trend over Time</span>',
+        labels={'date': bucket.capitalize(), 'engagements': 'Total Engagements'}
+    )
+    fig_engagement_time.update_xaxes(rangeslider_visible=True)
+    trend_detail_url = None
+    if len(trend_points) < len(aggregates['engagement_trend']):
+        # Zooming in can show finer buckets or more points; cached results keep their trend
+        # under the result key, so their detail URL stays valid
+        trend_id = store_trend_detail(aggregates['engagement_trend'], trend_bucket, trend_id=key)
+        trend_detail_url = url_for('trend_detail', trend_id=trend_id)
+    with timer.span('charts.serialize'):
+        chart_htmls['engagement_time'] = render_chart(fig_engagement_time, detail_url=trend_detail_url)
+
+    # 3.3. Bar chart: Platform Engagements
+    platform_engagements = aggregates['platform_engagements'].reset_index()
+    fig_platform = px.bar(
+        platform_engagements,
+        x='platform',
+        y='engagements',
+        title='<span style="font-size: 1.5em; font-weight: bold;">Platform Engagements</span>',
+        labels={'platform': 'Platform', 'engagements': 'Total Engagements'},
+        color='platform',
+        color_discrete_sequence=px.colors.qualitative.Pastel
+    )
+    with timer.span('charts.serialize'):
+        chart_htmls['platform'] = render_chart(fig_platform)
+
+    # 3.4. Pie chart: Media Type Mix
+    media_type_counts = aggregates['media_type_counts'].reset_index()
+    media_type_counts.columns = ['Media Type', 'Count']
+    fig_media_type = px.pie(
+        media_type_counts,
+        values='Count',
+        names='Media Type',
+        title='<span style="font-size: 1.5em; font-weight: bold;">Media Type Mix</span>',
+        color_discrete_sequence=px.colors.sequential.Agsunset
+    )
+    with timer.span('charts.serialize'):
+        chart_htmls['media_type'] = render_chart(fig_media_type)
+
+    # 3.5. Bar chart: Top 5 Locations
+    location_engagements = aggregates['location_engagements'].head(5).reset_index()
+    # Approximate totals (see LOCATION_TOP_K_CAPACITY) are upper bounds; error bars span the possible true totals
+    approximate_locations = 'location_engagements_error' in aggregates
+    if approximate_locations:
+        location_engagements['error'] = aggregates['location_engagements_error'].head(5).to_numpy()
+        location_engagements['no_error'] = 0
+    fig_location = px.bar(
+        location_engagements,
+        x='location',
+        y='engagements',
+        title='<span style="font-size: 1.5em; font-weight: bold;">Top 5 Locations with Highest Engagement</span>',
+        labels={'location': 'Location', 'engagements': 'Total Engagements'},
+        color='location',
+        color_discrete_sequence=px.colors.qualitative.Vivid,
+        error_y='no_error' if approximate_locations else None,
+        error_y_minus='error' if approximate_locations else None,
+    )
+    with timer.span('charts.serialize'):
+        chart_htmls['location'] = render_chart(fig_location)
+
+    # 4. Rule-based insights for every chart (shared with the Streamlit dashboard's fallback)
+    insights = rule_based_insights(aggregates, engagement_over_time, bucket, app.config['LOCATION_TOP_K_CAPACITY'])
+    insights['engagement_time'] = insights.pop('engagement_trend')
+
+    timer.add('charts', time.perf_counter() - charts_started)
+
+    result_url = None
+    if key is not None:
+        trend = None
+        if trend_detail_url is not None:
+            trend = trend_to_json(aggregates['engagement_trend'], trend_bucket)
+        with timer.span('result_cache'):
+            result_cache.put(key, {'chart_htmls': chart_htmls, 'insights': insights, 'dropped_rows': int(dropped_rows), 'trend': trend})
+        result_url = url_for('cached_result', key=key, _external=True)
+
+    with timer.span('render'):
+        return render_dashboard(
+            chart_htmls=chart_htmls, insights=insights, dropped_rows=dropped_rows, notice=notice, result_url=result_url, error=None,
+        )
+
+def append_notice(dataset, delta_rows, rows, appended):
+    """Returns the status line shown after an upload in append mode."""
+    if not appended:
+        return f"This file was already added to dataset '{dataset}', so it was not counted again ({rows} rows in total)."
+    return f"Added {delta_rows} rows to dataset '{dataset}' ({rows} rows in total)."
+
+def get_job_queue():
+    """Returns the background job queue, created on first use with the app.config limits."""
+    global job_queue
+    with _job_queue_lock:
+        if job_queue is None:
+            job_queue = JobQueue(max_workers=app.config['JOB_WORKERS'], max_jobs=app.config['JOB_MAX_PENDING'])
+        return job_queue
+
+def observe_job(job):
+    """Adds the stages timed inside a finished job's worker to the /metrics histograms."""
+    if job.state == 'done':
+        for stage, seconds in job.result()['durations'].items():
+            stage_histograms.observe(stage, seconds)
+
+def submit_upload_job(file, content_hash, dataset=None):
+    """
+    Saves an upload to app.config['JOB_UPLOAD_DIR'] and queues its analysis in a worker
+    process (appending it to the named dataset, if any), which deletes the saved file when
+    done (or the queue does, if the worker dies). Returns the Job; raises QueueFull (after
+    removing the saved file) if too many jobs are already queued or running.
+    """
+    os.makedirs(app.config['JOB_UPLOAD_DIR'], exist_ok=True)
+    # The original extension is kept for format detection
+    path = os.path.join(app.config['JOB_UPLOAD_DIR'], uuid.uuid4().hex + os.path.splitext(file.filename)[1].lower())
+    with g.timer.span('save'):
+        file.save(path)
+    try:
+        return get_job_queue().submit(
+            analyze_saved_upload, path, file.filename, content_hash, columnar_cache, app.config['CSV_CHUNKSIZE'],
+            dataset, analysis_store, app.config['LOCATION_TOP_K_CAPACITY'], on_done=observe_job, paths=[path],
+        )
+    except QueueFull:
+        os.remove(path)
+        raise
+
+def upload_size(file):
+    """Returns the size in bytes of an uploaded file's (seekable) stream."""
+    file.stream.seek(0, os.SEEK_END)
+    size = file.stream.tell()
+    file.stream.seek(0)
+    return size
+
+# Answer of every /jobs route while app.config['JOB_QUEUE_ENABLED'] is off
+JOBS_UNAVAILABLE_MESSAGE = ("Background jobs are not available on this multi-worker server; "
+                            "upload the file to /analyze instead, which analyzes it within the request.")
+
+def job_status(job):
+    """Returns the job's status dict (see jobs.Job.status) with its status and result URLs."""
+    return {
+        **job.status(),
+        'status_url': url_for('job_status_view', job_id=job.id),
+        'result_url': url_for('job_result', job_id=job.id),
+    }
 
 @app.route('/analyze', methods=['POST'])
 def analyze():
     """
-    Handles CSV file upload, data cleaning, chart generation, and displays results.
+    Handles CSV/Parquet/Feather file upload, data cleaning, chart generation, and displays results.
+    Uploads of at least app.config['JOB_MIN_UPLOAD_BYTES'] are handed to the background job
+    queue instead, and the browser is redirected to the job's page.
+    An upload whose result is already in result_cache is rendered from there without analysis.
+    With a 'dataset' name (append mode), only the upload itself is analyzed and then merged
+    into that dataset's saved state, and the dashboard shows the merged result (not cached,
+    since it depends on the earlier uploads).
+    Each stage is timed into g.timer (see add_server_timing).
     """
-    if 'csvFile' not in request.files:
-        return render_template_string(HTML_TEMPLATE, error="No file part in the request.")
-    file = request.files['csvFile']
+    timer = g.timer = StageTimer()
+    # Accessing request.files parses the multipart body (spooling the upload)
+    with timer.span('upload'):
+        files = request.files
+    if 'csvFile' not in files:
+        return render_dashboard(error="No file part in the request.")
+    file = files['csvFile']
     if file.filename == '':
-        return render_template_string(HTML_TEMPLATE, error="No selected file.")
+        return render_dashboard(error="No selected file.")
+    dataset = request.form.get('dataset', '').strip() or None
+    trend_bucket = requested_trend_bucket()
     if file:
         try:
-            # Read CSV into DataFrame
-            df = pd.read_csv(io.StringIO(file.read().decode('utf-8')))
-
-            # 2. Clean the data
-            # Normalize column names
-            df.columns = df.columns.str.lower().str.replace(' ', '_')
-
-            # Convert 'date' to datetime
-            if 'date' in df.columns:
-                df['date'] = pd.to_datetime(df['date'])
-            else:
-                return render_template_string(HTML_TEMPLATE, error="Column 'Date' not found in CSV. Please ensure correct column names.")
-
-            # Fill missing 'engagements' with 0
-            if 'engagements' in df.columns:
-                df['engagements'] = df['engagements'].fillna(0)
-            else:
-                return render_template_string(HTML_TEMPLATE, error="Column 'Engagements' not found in CSV. Please ensure correct column names.")
-
-            # Check for other required columns
-            required_columns = ['platform', 'sentiment', 'location', 'media_type']
-            for col in required_columns:
-                if col not in df.columns:
-                    return render_template_string(HTML_TEMPLATE, error=f"Required column '{col.replace('_', ' ').title()}' not found in CSV. Please ensure correct column names.")
-
-            chart_htmls = {}
-            insights = {}
-
-            # 3. Build 5 interactive charts using Plotly
-            # 3.1. Pie chart: Sentiment Breakdown
-            sentiment_counts = df['sentiment'].value_counts().reset_index()
-            sentiment_counts.columns = ['Sentiment', 'Count']
-            fig_sentiment = px.pie(
-                sentiment_counts,
-                values='Count',
-                names='Sentiment',
-                title='<span style="font-size: 1.5em; font-weight: bold;">Sentiment Breakdown</span>',
-                color_discrete_sequence=px.colors.sequential.RdBu
-            )
-            chart_htmls['sentiment'] = fig_sentiment.to_html(full_html=False, include_plotlyjs='cdn')
-            # 4. Insights for Sentiment Breakdown
-            total_sentiment = sentiment_counts['Count'].sum()
-            positive_sentiment = sentiment_counts[sentiment_counts['Sentiment'] == 'Positive']['Count'].sum() if 'Positive' in sentiment_counts['Sentiment'].values else 0
-            negative_sentiment = sentiment_counts[sentiment_counts['Sentiment'] == 'Negative']['Count'].sum() if 'Negative' in sentiment_counts['Sentiment'].values else 0
-            neutral_sentiment = sentiment_counts[sentiment_counts['Sentiment'] == 'Neutral']['Count'].sum() if 'Neutral' in sentiment_counts['Sentiment'].values else 0
-
-            max_sentiment = sentiment_counts.loc[sentiment_counts['Count'].idxmax()]
-            min_sentiment = sentiment_counts.loc[sentiment_counts['Count'].idxmin()]
-
-            insights['sentiment'] = [
-                f"Majority sentiment towards the brand/campaign is **{max_sentiment['Sentiment']}** ({max_sentiment['Count']} instances), indicating overall public perception.",
-                f"**{min_sentiment['Sentiment']}** sentiment is the smallest portion ({min_sentiment['Count']} instances), which might warrant further investigation to understand its reasons.",
-                f"The ratio of positive to negative sentiment is {positive_sentiment}:{negative_sentiment}, providing insight into the effectiveness of current communication campaigns."
-            ]
-
-            # 3.2. Line chart: Engagement Trend over time
-            engagement_over_time = df.groupby('date')['engagements'].sum().reset_index()
-            fig_engagement_time = px.line(
-                engagement_over_time,
-                x='date',
-                y='engagements',
-                title='<span style="font-size: 1.5em; font-weight: bold;">Engagement Trend over Time</span>',
-                labels={'date': 'Date', 'engagements': 'Total Engagements'}
-            )
-            fig_engagement_time.update_xaxes(rangeslider_visible=True)
-            chart_htmls['engagement_time'] = fig_engagement_time.to_html(full_html=False, include_plotlyjs='cdn')
-            # 4. Insights for Engagement Trend over time
-            peak_engagement_date = engagement_over_time.loc[engagement_over_time['engagements'].idxmax()]
-            lowest_engagement_date = engagement_over_time.loc[engagement_over_time['engagements'].idxmin()]
-
-            insights['engagement_time'] = [
-                f"There was a significant engagement spike on **{peak_engagement_date['date'].strftime('%Y-%m-%d')}** with {int(peak_engagement_date['engagements'])} engagements, likely related to a specific event or campaign.",
-                f"The period around **{lowest_engagement_date['date'].strftime('%Y-%m-%d')}** shows stable low engagement, indicating a need for new content strategies or a review of inactive periods.",
-                "Recurring daily/weekly engagement patterns might be visible, which can be leveraged for optimal posting schedules."
-            ]
-
-
-            # 3.3. Bar chart: Platform Engagements
-            platform_engagements = df.groupby('platform')['engagements'].sum().reset_index()
-            platform_engagements = platform_engagements.sort_values(by='engagements', ascending=False)
-            fig_platform = px.bar(
-                platform_engagements,
-                x='platform',
-                y='engagements',
-                title='<span style="font-size: 1.5em; font-weight: bold;">Platform Engagements</span>',
-                labels={'platform': 'Platform', 'engagements': 'Total Engagements'},
-                color='platform',
-                color_discrete_sequence=px.colors.qualitative.Pastel
-            )
-            chart_htmls['platform'] = fig_platform.to_html(full_html=False, include_plotlyjs='cdn')
-            # 4. Insights for Platform Engagements
-            most_effective_platform = platform_engagements.iloc[0]
-            least_effective_platform = platform_engagements.iloc[-1]
-            insights['platform'] = [
-                f"**{most_effective_platform['platform']}** is the most dominant platform in generating engagements ({int(most_effective_platform['engagements'])}), indicating a suitable marketing focus.",
-                f"**{least_effective_platform['platform']}** has low engagement ({int(least_effective_platform['engagements'])}); the content strategy or resource allocation there might need re-evaluation.",
-                "Some platforms show untapped engagement growth potential."
-            ]
-
-            # 3.4. Pie chart: Media Type Mix
-            media_type_counts = df['media_type'].value_counts().reset_index()
-            media_type_counts.columns = ['Media Type', 'Count']
-            fig_media_type = px.pie(
-                media_type_counts,
-                values='Count',
-                names='Media Type',
-                title='<span style="font-size: 1.5em; font-weight: bold;">Media Type Mix</span>',
-                color_discrete_sequence=px.colors.sequential.Agsunset
-            )
-            chart_htmls['media_type'] = fig_media_type.to_html(full_html=False, include_plotlyjs='cdn')
-            # 4. Insights for Media Type Mix
-            most_popular_media_type = media_type_counts.loc[media_type_counts['Count'].idxmax()]
-            least_popular_media_type = media_type_counts.loc[media_type_counts['Count'].idxmin()]
-            insights['media_type'] = [
-                f"**{most_popular_media_type['Media Type']}** content is the most frequently used format ({most_popular_media_type['Count']} instances), likely reflecting audience preference or current content strategy.",
-                f"There's an opportunity to experiment with **{least_popular_media_type['Media Type']}** media types, which are currently underutilized.",
-                "The balance across various media types can be improved to reach a wider and more diverse audience."
-            ]
-
-            # 3.5. Bar chart: Top 5 Locations
-            location_engagements = df.groupby('location')['engagements'].sum().nlargest(5).reset_index()
-            location_engagements = location_engagements.sort_values(by='engagements', ascending=False)
-            fig_location = px.bar(
-                location_engagements,
-                x='location',
-                y='engagements',
-                title='<span style="font-size: 1.5em; font-weight: bold;">Top 5 Locations with Highest Engagement</span>',
-                labels={'location': 'Location', 'engagements': 'Total Engagements'},
-                color='location',
-                color_discrete_sequence=px.colors.qualitative.Vivid
+            if dataset:
+                AnalysisStore.check_name(dataset)
+            # The hash keys the converted-upload cache: a CSV seen before is read from its
+            # Parquet copy, and a new CSV is converted while it is streamed
+            with timer.span('hash'):
+                content_hash = hash_stream(file.stream)
+
+            key = None
+            if not dataset:
+                key = result_key(content_hash, trend_bucket)
+                with timer.span('result_cache'):
+                    result = result_cache.get(key)
+                if result is not None:
+                    with timer.span('render'):
+                        return render_cached_result(key, result)
+
+            min_job_bytes = app.config['JOB_MIN_UPLOAD_BYTES']
+            if app.config['JOB_QUEUE_ENABLED'] and min_job_bytes is not None and upload_size(file) >= min_job_bytes:
+                job = submit_upload_job(file, content_hash, dataset)
+                return redirect(url_for('job_result', job_id=job.id, trend_bucket=trend_bucket), code=303)
+
+            # Stream the upload in chunks; each chunk is cleaned (dates parsed, invalid dates
+            # dropped, missing engagements to 0, sentiment lowercased - shared with the other
+            # frontends) and folded into the chart aggregates
+            analysis = analyze_upload(
+                file.stream, file.filename, content_hash=content_hash, cache=columnar_cache,
+                chunksize=app.config['CSV_CHUNKSIZE'], timer=timer, location_capacity=app.config['LOCATION_TOP_K_CAPACITY'],
             )
-            chart_htmls['location'] = fig_location.to_html(full_html=False, include_plotlyjs='cdn')
-            # 4. Insights for Top 5 Locations
-            top_location = location_engagements.iloc[0] if not location_engagements.empty else None
-            second_location = location_engagements.iloc[1] if len(location_engagements) > 1 else None
-            insights['location'] = []
-            if top_location is not None:
-                insights['location'].append(f"**{top_location['location']}** is the geographic area with the highest engagement ({int(top_location['engagements'])}), indicating a strong audience concentration or content relevance there.")
-                if second_location is not None:
-                    insights['location'].append(f"Targeted geographic marketing can be further focused on areas like **{top_location['location']}** and **{second_location['location']}** for local campaigns or community events.")
-                else:
-                    insights['location'].append(f"Targeted geographic marketing can be further focused on **{top_location['location']}** for local campaigns or community events.")
-                insights['location'].append("Understanding the audience characteristics in these locations can help tailor future messages and content.")
-            else:
-                insights['location'] = ["No location data available for insights."]
-
-            return render_template_string(HTML_TEMPLATE, chart_htmls=chart_htmls, insights=insights, error=None)
+            notice = None
+            if dataset:
+                # Only the delta was analyzed; the dashboard shows it merged into the saved state
+                delta_rows = analysis.rows
+                with timer.span('append'):
+                    analysis, appended = analysis_store.append(dataset, analysis, content_hash)
+                notice = append_notice(dataset, delta_rows, analysis.rows, appended)
+            with timer.span('aggregate'):
+                aggregates = analysis.result()
+            return render_analysis(aggregates, analysis.dropped_rows, timer, notice=notice, key=key, trend_bucket=trend_bucket)
 
+        except AnalysisError as e:
+            return render_dashboard(error=str(e))
+        except QueueFull:
+            return render_dashboard(error="The server is busy analyzing other large files. Please try again in a few minutes."), 503
         except Exception as e:
-            return render_template_string(HTML_TEMPLATE, error=f"An error occurred: {e}")
+            return render_dashboard(error=f"An error occurred: {e}")
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """
+    Queues an uploaded file ('csvFile', optionally appended to the 'dataset' named in the form)
+    for analysis in a background worker process and
+    returns 202 with the job's status (see job_status) without waiting for it; 503 with
+    Retry-After if the queue is full, and 503 if background jobs are turned off
+    (app.config['JOB_QUEUE_ENABLED']).
+    """
+    if not app.config['JOB_QUEUE_ENABLED']:
+        return jsonify(error=JOBS_UNAVAILABLE_MESSAGE), 503
+    timer = g.timer = StageTimer()
+    with timer.span('upload'):
+        files = request.files
+    file = files.get('csvFile')
+    if file is None or file.filename == '':
+        return jsonify(error="No file part in the request."), 400
+    dataset = request.form.get('dataset', '').strip() or None
+    if dataset:
+        try:
+            AnalysisStore.check_name(dataset)
+        except AnalysisError as e:
+            return jsonify(error=str(e)), 400
+    with timer.span('hash'):
+        content_hash = hash_stream(file.stream)
+    try:
+        job = submit_upload_job(file, content_hash, dataset)
+    except QueueFull:
+        return jsonify(error="Too many analyses are queued. Please try again later."), 503, {'Retry-After': '30'}
+    status = job_status(job)
+    return jsonify(status), 202, {'Location': status['status_url']}
+
+@app.route('/jobs/<job_id>/status')
+def job_status_view(job_id):
+    """Returns a background job's status as JSON ('state' is queued, running, done or failed)."""
+    if not app.config['JOB_QUEUE_ENABLED']:
+        return jsonify(error=JOBS_UNAVAILABLE_MESSAGE), 503
+    job = get_job_queue().get(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job_status(job))
+
+@app.route('/jobs/<job_id>')
+def job_result(job_id):
+    """
+    Serves the dashboard of a finished background job, its error if it failed, or
+    while it is queued or running, a page that polls the status and reloads when it is done.
+    A finished job's dashboard is rendered once into result_cache; later views redirect to
+    its /results/<key> URL.
+    """
+    if not app.config['JOB_QUEUE_ENABLED']:
+        return render_dashboard(error=JOBS_UNAVAILABLE_MESSAGE), 503
+    job = get_job_queue().get(job_id)
+    if job is None:
+        abort(404)
+    state = job.state
+    if state == 'failed':
+        return render_dashboard(error=job_status(job)['error'])
+    if state != 'done':
+        return render_dashboard(job=job_status(job))
+
+    result = job.result()
+    timer = g.timer = StageTimer()
+    notice = None
+    key = None
+    trend_bucket = requested_trend_bucket()
+    if result['dataset'] is not None:
+        notice = append_notice(result['dataset'], result['delta_rows'], result['rows'], result['appended'])
+    elif result['content_hash'] is not None:
+        key = result_key(result['content_hash'], trend_bucket)
+        # Rendered by an earlier view (or upload) of the same content: serve it from its stable URL
+        with timer.span('result_cache'):
+            cached = result_cache.get(key) is not None
+        if cached:
+            return redirect(url_for('cached_result', key=key), code=303)
+    return render_analysis(result['aggregates'], result['dropped_rows'], timer, notice=notice, key=key, trend_bucket=trend_bucket)
+
+@app.route('/results/<key>')
+def cached_result(key):
+    """
+    Serves a dashboard from result_cache by its key (the stable URL of an upload's results);
+    404 once it has been evicted.
+    """
+    timer = g.timer = StageTimer()
+    with timer.span('result_cache'):
+        result = result_cache.get(key)
+    if result is None:
+        abort(404)
+    with timer.span('render'):
+        return render_cached_result(key, result)
+
+@app.route('/datasets/<name>')
+def dataset_dashboard(name):
+    """
+    Renders the dashboard of a saved dataset (every upload appended to it so far), with the
+    engagement trend in the buckets of an optional 'trend_bucket' query parameter.
+    """
+    timer = g.timer = StageTimer()
+    try:
+        with timer.span('load'):
+            analysis = analysis_store.load(name)
+    except AnalysisError:
+        abort(404)
+    if analysis is None:
+        abort(404)
+    with timer.span('aggregate'):
+        aggregates = analysis.result()
+    notice = f"Dataset '{name}': {analysis.rows} rows from every upload appended so far."
+    return render_analysis(aggregates, analysis.dropped_rows, timer, notice=notice, trend_bucket=requested_trend_bucket())
+
+# Preloads pandas, plotly and the analysis modules, builds the gzipped plotly.js bundle and
+# the shared chart template, compiles HTML_TEMPLATE, and primes plotly's figure templates
+start_warm_up(bundled_plotly_js, plotly_template_json, dashboard_template, mode=app.config['STARTUP_MODE'])
 
 if __name__ == '__main__':
     # You can run this Flask app using `python app.py` in your terminal.
     # It will typically run on http://127.0.0.1:5000/
+    # For production, run it under the pre-fork server instead: python serve.py
     app.run(debug=True)
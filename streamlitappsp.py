@@ -1,9 +1,20 @@
 import streamlit as st
-import pandas as pd
-import plotly.express as px
-import io
-import requests
+import hashlib
+import os
+import time
 import json
+from aggregation import TREND_BUCKETS, AggregateCube, bucket_trend, downsample_lttb
+from analytics import AnalysisError, build_merged_cube, clean_frame
+from insights import (
+    INSIGHT_LATENCY_BUDGET_SECONDS, InsightError, collect_within_budget, get_cached_insights, request_insights, rule_based_insights,
+)
+from ingestion import REQUIRED_COLUMNS, ColumnarCache, detect_format, read_table, to_typed_columns
+from startup import deferred_import, start_warm_up
+from timing import StageTimer
+
+# pandas and plotly load with the first upload, or earlier from the warm-up started below
+pd = deferred_import('pandas')
+px = deferred_import('plotly.express')
 
 # --- Streamlit Page Configuration ---
 st.set_page_config(
@@ -14,192 +25,65 @@ st.set_page_config(
 )
 
 # --- Custom CSS for a Modern, Futuristic Look ---
-# This CSS attempts to mimic the dark theme and rounded styles from the React/HTML app
-st.markdown("""
-<style>
-    /* Main container background */
-    .stApp {
-        background-color: #0F172A; /* bg-gray-900 */
-        color: #D1D5DB; /* text-gray-300 */
-        font-family: 'Inter', sans-serif;
-    }
-
-    /* Overall block container padding */
-    .st-emotion-cache-1pxazr7 { /* Target the main block container */
-        padding-top: 2rem;
-        padding-right: 2rem;
-        padding-left: 2rem;
-        padding-bottom: 2rem;
-    }
-
-    /* Headers */
-    h1, h2, h3, h4, h5, h6 {
-        color: #A78BFA; /* purple-400 */
-        font-family: 'Inter', sans-serif;
-        margin-bottom: 1rem;
-    }
-    h1 {
-        font-size: 3.5rem; /* text-5xl */
-        font-weight: 700; /* font-bold */
-        text-align: center;
-        margin-bottom: 3rem; /* mb-12 */
-        color: #C084FC; /* Brighter purple for main title */
-    }
-    h2 {
-        font-size: 2.25rem; /* text-3xl */
-        font-weight: 600; /* font-semibold */
-        margin-bottom: 1.5rem; /* mb-6 */
-        color: #2DD4BF; /* teal-400 */
-    }
-    h3 {
-        font-size: 1.25rem; /* text-xl */
-        font-weight: 600; /* font-semibold */
-        margin-top: 1.5rem; /* mt-6 */
-        margin-bottom: 0.75rem; /* mb-3 */
-        color: #BF80FF; /* purple-300 - adjusted for better contrast */
-    }
-
-    /* Paragraphs and list items */
-    p, li, code {
-        color: #D1D5DB; /* gray-300 */
-        font-family: 'Inter', sans-serif;
-        line-height: 1.6;
-    }
-    code {
-        background-color: #374151; /* gray-700 */
-        border-radius: 0.25rem;
-        padding: 0.2rem 0.4rem;
-        color: #E879F9; /* purple-300 - adjusted for better contrast */
-    }
-
-    /* File Uploader styling */
-    .stFileUploader {
-        background-color: #1F2937; /* Darker gray */
-        border-radius: 0.75rem;
-        padding: 1.5rem;
-        box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
-        border: 2px dashed #4B5563; /* border-gray-600 */
-        text-align: center;
-        margin-bottom: 3rem; /* mb-12 */
-        transition: all 0.3s ease-in-out;
-    }
-    .stFileUploader:hover {
-        box-shadow: 0 0 15px rgba(129, 140, 248, 0.6); /* Tailwind indigo-300 with blur */
-        transform: translateY(-2px);
-    }
-    /* Specific styling for the 'Choose File' button within the uploader */
-    .st-emotion-cache-1wmy99l, .st-emotion-cache-1wmy99l:hover { /* This targets the actual button */
-        background-color: #8B5CF6; /* purple-600 */
-        color: white;
-        font-weight: bold;
-        padding: 0.75rem 1.5rem;
-        border-radius: 0.5rem;
-        transition: all 0.3s ease-in-out;
-        border: none;
-    }
-    .st-emotion-cache-1wmy99l:hover {
-        background-color: #7C3AED; /* purple-700 */
-        box-shadow: 0 0 10px rgba(129, 140, 248, 0.4);
-    }
-
-    /* Chart container styling (similar to chart-container in HTML) */
-    .chart-container {
-        background-color: #1F2937; /* Darker gray */
-        padding: 1.5rem;
-        border-radius: 0.75rem;
-        box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
-        transition: all 0.3s ease-in-out;
-        margin-bottom: 2.5rem; /* mb-10 */
-        border: none; /* Remove default Streamlit border */
-    }
-    .chart-container:hover {
-        box-shadow: 0 0 15px rgba(129, 140, 248, 0.6);
-        transform: translateY(-2px);
-    }
-
-    /* Plotly chart specific styling */
-    .stPlotlyChart {
-        border-radius: 0.5rem; /* Apply some rounding to charts too */
-        background-color: #1F2937; /* Ensure plotly background matches container */
-    }
-
-    /* Spinner color */
-    .stSpinner > div > span {
-        color: #A78BFA;
-    }
-
-    /* Success/Error/Info messages */
-    .stAlert {
-        border-radius: 0.5rem;
-        background-color: #1F2937;
-        color: #D1D5DB;
-    }
-    .stAlert.success {
-        border-left: 5px solid #2ECC71;
-    }
-    .stAlert.error {
-        border-left: 5px solid #E74C3C;
-    }
-    .stAlert.warning {
-        border-left: 5px solid #F1C40F;
-    }
-
-    /* List styling for data cleaning section */
-    ul {
-        list-style-type: disc;
-        padding-left: 1.5rem;
-        color: #9CA3AF; /* gray-400 */
-        margin-top: 0.5rem;
-    }
-    li {
-        margin-bottom: 0.25rem;
-    }
-</style>
-""", unsafe_allow_html=True)
+# The dark theme lives in static/dashboard.css. With static file serving enabled (see
+# .streamlit/config.toml), every run only sends a link to it and the browser caches the
+# stylesheet; otherwise the CSS is read once per process and inlined into each run.
+DASHBOARD_CSS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'dashboard.css')
+
+@st.cache_resource(show_spinner=False)
+def dashboard_css_html():
+    """Returns the HTML that applies static/dashboard.css: a stylesheet link, or the CSS inlined."""
+    if st.get_option('server.enableStaticServing'):
+        return f'<link rel="stylesheet" href="app/static/dashboard.css?v={int(os.path.getmtime(DASHBOARD_CSS_PATH))}">'
+    with open(DASHBOARD_CSS_PATH) as f:
+        return f"<style>\n{f.read()}</style>"
+
+st.markdown(dashboard_css_html(), unsafe_allow_html=True)
+
+# --- Warm-up ---
+@st.cache_resource(show_spinner=False)
+def start_warm_up_once():
+    """
+    Starts preloading pandas, plotly and the analysis modules once per server process, on
+    the first run of any session (in the background unless STARTUP_MODE says otherwise).
+    """
+    return start_warm_up()
+
+start_warm_up_once()
 
 # --- API Key for Gemini (Placeholder for Canvas Environment) ---
 # In a real Streamlit deployment, you'd securely manage this using st.secrets.
 # For this Canvas environment, the API key will be automatically provided by the backend for the fetch call.
 GEMINI_API_KEY = "" # Leave as empty string for Canvas auto-injection
 
-# --- Helper Function for Gemini API Call ---
-@st.cache_data(show_spinner=False) # Cache API responses to avoid re-calling on rerun
-def call_gemini_api(prompt):
-    """
-    Makes a request to the Gemini API to generate insights.
-    Uses the 'gemini-2.0-flash' model.
-    """
-    try:
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={GEMINI_API_KEY}"
-        headers = {'Content-Type': 'application/json'}
-        payload = {
-            "contents": [
-                {"role": "user", "parts": [{"text": prompt}]}
-            ]
-        }
+# --- Insight Latency Budget ---
+# Rule-based insights are shown at once. Gemini is asked on full runs and when the user clicks
+# "Generate AI insights" (never on filter changes alone, so dragging a filter starts no paid
+# requests); its insights replace the rule-based ones if they arrive within
+# INSIGHT_LATENCY_BUDGET_SECONDS (env, see insights.py). Later answers still land in the insight
+# cache, and the dashboard checks for them every INSIGHT_POLL_SECONDS and reruns to show them.
+INSIGHT_POLL_SECONDS = 2
 
-        # Make the request
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
-        response.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx)
-        result = response.json()
+def format_insights(insights):
+    """Formats a list of rule-based insights as a markdown list."""
+    return "\n".join(f"- {insight}" for insight in insights)
 
-        # Parse the response
-        if result.get('candidates') and result['candidates'][0].get('content') and result['candidates'][0]['content'].get('parts'):
-            return result['candidates'][0]['content']['parts'][0]['text']
-        else:
-            # Log the full unexpected response for debugging
-            st.error(f"Unexpected API response structure or empty content: {result}")
-            return "Could not generate insights due to an unexpected API response. Please check console for details."
-    except requests.exceptions.RequestException as e:
-        # Catch network errors, HTTP errors, etc.
-        st.error(f"Failed to generate insights: {e}. Please check your network connection or API key.")
-        return "Failed to generate insights due to a network or API error."
-    except json.JSONDecodeError:
-        st.error("Failed to decode JSON response from API. Invalid response format.")
-        return "Failed to generate insights due to invalid API response format."
-    except Exception as e:
-        st.error(f"An unexpected error occurred during API call: {e}")
-        return "An unknown error occurred while generating insights."
+@st.fragment(run_every=INSIGHT_POLL_SECONDS)
+def rerun_when_insights_arrive(futures, request_id):
+    """
+    Waits (polling, without blocking the page) for insight requests that outlived the
+    latency budget, then reruns the app so their answers are shown from the insight cache.
+    If they all failed, it says so instead: a rerun would only request them again.
+    Requests superseded by a later run (request_id is no longer the session's
+    'insight_request') are dropped: their answers are still cached, but force no rerun.
+    """
+    if st.session_state.get('insight_request') != request_id:
+        return
+    if not all(future.done() for future in futures):
+        return
+    if any(future.exception() is None for future in futures):
+        st.rerun()
+    st.caption("Some AI insights could not be generated; the rule-based insights above are shown instead.")
 
 
 # --- 1. Data Cleaning Function ---
@@ -210,6 +94,9 @@ def clean_data(df):
     - Fills missing 'Engagements' with 0.
     - Normalizes column names (lowercase, replace spaces with underscores).
     - Filters out rows with invalid dates after conversion.
+    - Lowercases 'sentiment', stores text dimensions as categoricals and engagements in the
+      narrowest integer dtype, and keeps only the six required columns.
+    The cleaning rules themselves are analytics.clean_frame, shared with the other frontends.
     """
     # Normalize column names first to ensure consistency for subsequent operations
     df.columns = [col.lower().replace(' ', '_').strip() for col in df.columns]
@@ -225,32 +112,137 @@ def clean_data(df):
                  f"Missing: {', '.join(missing_cols)}")
         return None
 
-    # Convert 'date' to datetime objects, coercing errors to NaT (Not a Time)
-    df['date'] = pd.to_datetime(df['date'], errors='coerce')
-    # Filter out rows where 'date' could not be converted (is NaT)
-    initial_rows = len(df)
-    df.dropna(subset=['date'], inplace=True)
-    if len(df) < initial_rows:
-        st.warning(f"Removed {initial_rows - len(df)} rows due to invalid 'Date' values.")
-
-
-    # Fill missing 'engagements' with 0 and convert to integer type
-    # Using to_numeric first handles non-numeric strings by converting them to NaN
-    df['engagements'] = pd.to_numeric(df['engagements'], errors='coerce').fillna(0).astype(int)
-
-    # Normalize 'sentiment' to lowercase to ensure consistent grouping
-    df['sentiment'] = df['sentiment'].astype(str).str.lower()
+    # Convert 'date' to datetime objects and drop rows where it could not be converted,
+    # fill missing 'engagements' with 0, lowercase 'sentiment' and type the text columns
+    df, dropped_rows = clean_frame(df)
+    if dropped_rows:
+        st.warning(f"Removed {dropped_rows} rows due to invalid 'Date' values.")
 
     # Sort data by date for chronological trend analysis
     df = df.sort_values('date').reset_index(drop=True)
 
     return df
 
-# --- 2. Chart Generation Functions ---
+# --- Upload Cache ---
+# Number of distinct uploads whose aggregate cubes are kept in memory (least recently used are evicted)
+UPLOAD_CACHE_MAX_ENTRIES = 4
+
+# CSV uploads are also converted once into Parquet (six typed columns) on disk, so they
+# load quickly after a restart or once evicted from memory
+columnar_cache = ColumnarCache()
+
+def get_upload_hash(uploaded_file):
+    """
+    Returns a SHA-256 digest of the uploaded file's bytes.
+    The digest is remembered in the session state per upload, so reruns triggered by
+    widget interactions do not re-hash an unchanged file.
+    """
+    upload_hashes = st.session_state.setdefault('upload_hashes', {})
+    if uploaded_file.file_id not in upload_hashes:
+        upload_hashes[uploaded_file.file_id] = hashlib.sha256(uploaded_file.getbuffer()).hexdigest()
+    return upload_hashes[uploaded_file.file_id]
+
+def load_cleaned_data(upload_hash, uploaded_file, timer=None):
+    """
+    Parses and cleans an uploaded CSV, Parquet or Feather file (see load_cube, which caches
+    the result rolled up, not the rows).
+    A CSV is read from its converted Parquet copy when one exists, and converted otherwise.
+    The read and clean stages are timed into timer when one is given.
+    """
+    timer = timer or StageTimer()
+    with timer.span('load.read'):
+        cached_path = columnar_cache.get(upload_hash)
+        if cached_path:
+            raw_df = columnar_cache.read(cached_path)
+        else:
+            uploaded_file.seek(0)
+            # Only the six required columns are parsed, however wide the export is
+            raw_df = read_table(uploaded_file, uploaded_file.name, columns=REQUIRED_COLUMNS)
+    if not cached_path and detect_format(uploaded_file.name) == 'csv' and all(col in raw_df.columns for col in REQUIRED_COLUMNS):
+        with timer.span('load.convert'):
+            raw_df = to_typed_columns(raw_df)
+            columnar_cache.store(upload_hash, raw_df)
+    # raw_df is not kept anywhere else, so it can be cleaned without a defensive copy
+    with timer.span('load.clean'):
+        return clean_data(raw_df)
+
+# Most points drawn for the engagement trend; longer series are downsampled with LTTB
+TREND_MAX_POINTS = 1000
+
+# --- 2. Aggregation Stage ---
+@st.cache_resource(max_entries=UPLOAD_CACHE_MAX_ENTRIES, show_spinner="Parsing, cleaning and aggregating data...")
+def load_cube(upload_hash, _uploaded_file, _timer=None):
+    """
+    Parses and cleans an upload (see load_cleaned_data), then rolls its rows up into an
+    AggregateCube (day x platform x sentiment x media_type x location, with engagement sums
+    and counts), cached under the hash of its content and shared across sessions.
+    Only the cube is kept: the cleaned rows are dropped once rolled up, and cube.rows counts them.
+    Returns None when clean_data has reported missing columns.
+    Every chart aggregate, filtered or not, is derived from the cube, with the same results
+    (and daily trend buckets) as the analytics engine used by the other frontends; the chart
+    and prompt builders only read from cube.aggregates() (see StreamingAggregator.result for the keys).
+    On a cache miss, the stages are timed into _timer when one is given.
+    """
+    timer = _timer or StageTimer()
+    cleaned_df = load_cleaned_data(upload_hash, _uploaded_file, timer)
+    if cleaned_df is None:
+        return None
+    with timer.span('load.aggregate'):
+        return AggregateCube.from_frame(cleaned_df)
 
-def create_sentiment_chart(df):
+@st.cache_resource(max_entries=UPLOAD_CACHE_MAX_ENTRIES, show_spinner="Parsing and merging the files in parallel...")
+def load_merged_cube(upload_hashes, _uploaded_files):
+    """
+    Builds one AggregateCube from several uploaded files (e.g. one export per platform or per day),
+    cached under the tuple of their hashes. Each file is parsed, cleaned and rolled up into its own
+    cube in a separate worker process (using the converted-upload cache as load_cube does),
+    and the per-file cubes are merged, so the rows of all files are never concatenated.
+    Returns (cube, dropped_rows); raises AnalysisError naming a file with a missing column.
+    """
+    uploads = [(uploaded_file.getvalue(), uploaded_file.name, upload_hash) for uploaded_file, upload_hash in zip(_uploaded_files, upload_hashes)]
+    return build_merged_cube(uploads, cache=columnar_cache)
+
+def build_insight_prompts(aggregates):
+    """
+    Builds the Gemini prompt for each chart from the precomputed aggregates.
+    Returns a dict keyed by chart: 'sentiment', 'engagement_trend', 'platform', 'media_type', 'location'.
+    """
+    prompts = {}
+
+    sentiment_counts = aggregates['sentiment_counts'].to_dict()
+    prompts['sentiment'] = f"Based on the following sentiment counts from media data: {json.dumps(sentiment_counts)}. Provide top 3 concise insights."
+
+    # Prepare data for prompt: start, end date engagements
+    engagement_by_date = aggregates['engagement_trend']
+    if not engagement_by_date.empty:
+        first_date = engagement_by_date.index[0].strftime('%Y-%m-%d')
+        last_date = engagement_by_date.index[-1].strftime('%Y-%m-%d')
+        initial_engagements = engagement_by_date.iloc[0]
+        final_engagements = engagement_by_date.iloc[-1]
+        prompts['engagement_trend'] = (f"Based on engagement data from {first_date} to {last_date}, "
+                                       f"with initial engagements of {initial_engagements} and final engagements of {final_engagements}. "
+                                       "Provide top 3 concise insights about the engagement trend.")
+    else:
+        prompts['engagement_trend'] = "No engagement data available. Provide top 3 general insights about engagement trends in media analysis."
+
+    # Get top 5 platforms by engagement for insight generation
+    platform_engagements = aggregates['platform_engagements'].head(5).to_dict()
+    prompts['platform'] = f"Based on platform engagements: {json.dumps(platform_engagements)}. Provide top 3 concise insights."
+
+    media_type_counts = aggregates['media_type_counts'].to_dict()
+    prompts['media_type'] = f"Based on media type counts: {json.dumps(media_type_counts)}. Provide top 3 concise insights."
+
+    # Get top 5 locations by engagement for insight generation
+    top_locations = aggregates['location_engagements'].head(5).to_dict()
+    prompts['location'] = f"Based on top 5 locations by engagement: {json.dumps(top_locations)}. Provide top 3 concise insights."
+
+    return prompts
+
+# --- 3. Chart Generation Functions ---
+
+def create_sentiment_chart(aggregates):
     """Creates a Plotly pie chart for Sentiment Breakdown."""
-    sentiment_counts = df['sentiment'].value_counts().reset_index()
+    sentiment_counts = aggregates['sentiment_counts'].reset_index()
     sentiment_counts.columns = ['Sentiment', 'Count'] # Rename for clarity in chart
     fig = px.pie(
         sentiment_counts,
@@ -278,10 +270,11 @@ def create_sentiment_chart(df):
     fig.update_traces(textinfo="percent+label", hoverinfo="label+percent+value", showlegend=True)
     return fig
 
-def create_engagement_trend_chart(df):
+def create_engagement_trend_chart(aggregates):
     """Creates a Plotly line chart for Engagement Trend over time."""
-    # Group by date (extracting only the date part) and sum engagements
-    engagement_by_date = df.groupby(df['date'].dt.date)['engagements'].sum().reset_index()
+    # Engagements are already summed per trend bucket (see render_charts_and_insights);
+    # a fixed bucket over a long range is downsampled so the browser only draws TREND_MAX_POINTS
+    engagement_by_date = downsample_lttb(aggregates['engagement_trend'], TREND_MAX_POINTS).reset_index()
     engagement_by_date.columns = ['Date', 'Total Engagements']
     fig = px.line(
         engagement_by_date,
@@ -305,10 +298,10 @@ def create_engagement_trend_chart(df):
     )
     return fig
 
-def create_platform_engagements_chart(df):
+def create_platform_engagements_chart(aggregates):
     """Creates a Plotly bar chart for Platform Engagements."""
-    # Group by platform, sum engagements, and sort in descending order
-    platform_engagements = df.groupby('platform')['engagements'].sum().sort_values(ascending=False).reset_index()
+    # Platform totals are already sorted in descending order
+    platform_engagements = aggregates['platform_engagements'].reset_index()
     platform_engagements.columns = ['Platform', 'Total Engagements']
     fig = px.bar(
         platform_engagements,
@@ -331,9 +324,9 @@ def create_platform_engagements_chart(df):
     )
     return fig
 
-def create_media_type_mix_chart(df):
+def create_media_type_mix_chart(aggregates):
     """Creates a Plotly pie chart for Media Type Mix."""
-    media_type_counts = df['media_type'].value_counts().reset_index()
+    media_type_counts = aggregates['media_type_counts'].reset_index()
     media_type_counts.columns = ['Media Type', 'Count']
     fig = px.pie(
         media_type_counts,
@@ -359,10 +352,10 @@ def create_media_type_mix_chart(df):
     fig.update_traces(textinfo="percent+label", hoverinfo="label+percent+value", showlegend=True)
     return fig
 
-def create_top_locations_chart(df):
+def create_top_locations_chart(aggregates):
     """Creates a Plotly bar chart for Top 5 Locations by Engagements."""
-    # Group by location, sum engagements, sort, and get top 5
-    location_engagements = df.groupby('location')['engagements'].sum().sort_values(ascending=False).head(5).reset_index()
+    # Location totals are already sorted; keep the top 5
+    location_engagements = aggregates['location_engagements'].head(5).reset_index()
     location_engagements.columns = ['Location', 'Total Engagements']
     fig = px.bar(
         location_engagements,
@@ -385,6 +378,132 @@ def create_top_locations_chart(df):
     )
     return fig
 
+# Chart sections in display order: (insight prompt key, title, chart builder)
+CHART_SECTIONS = [
+    ('sentiment', "Sentiment Breakdown", create_sentiment_chart),
+    ('engagement_trend', "Engagement Trend Over Time", create_engagement_trend_chart),
+    ('platform', "Platform Engagements", create_platform_engagements_chart),
+    ('media_type', "Media Type Mix", create_media_type_mix_chart),
+    ('location', "Top 5 Locations by Engagements", create_top_locations_chart),
+]
+
+@st.fragment
+def render_charts_and_insights(cube, timer, show_timings=False):
+    """
+    Renders the filters, then the five charts and their insights for the filtered data.
+    As a fragment, a filter change reruns only this function: the upload is not read or
+    cleaned again, and the aggregates are re-derived from the cube instead of the rows.
+    - A full run of the app times its stages into timer, requests the insights and waits up
+      to the insight latency budget for Gemini.
+    - A filter change (fragment rerun) times into a fresh timer, shown below the charts with
+      show_timings (the sidebar belongs to the full run), and requests nothing: it shows the
+      insights already cached and the rule-based ones for the rest, plus a "Generate AI
+      insights" button that requests them for the current filters.
+    Insights outliving the budget keep their rule-based stand-ins until rerun_when_insights_arrive
+    finds them done.
+    """
+    # Set by the main script just before it calls this function, so absent on fragment reruns
+    full_run = st.session_state.pop('charts_full_run', False)
+    if not full_run:
+        timer = StageTimer()
+
+    first_day, last_day = cube.date_range()
+    filter_columns = st.columns(4)
+    date_range = filter_columns[0].date_input(
+        "Date range", value=(first_day.date(), last_day.date()), min_value=first_day.date(), max_value=last_day.date()
+    )
+    platforms = filter_columns[1].multiselect("Platforms", cube.values('platform'), placeholder="All platforms")
+    sentiments = filter_columns[2].multiselect("Sentiments", cube.values('sentiment'), placeholder="All sentiments")
+    # The cube keys the trend by day, so days are the finest bucket here
+    trend_bucket = filter_columns[3].selectbox(
+        "Trend buckets", ['auto', *list(TREND_BUCKETS)[1:]],
+        format_func=lambda bucket: "Automatic" if bucket == 'auto' else bucket.capitalize(),
+        help=f"Automatic picks days, weeks or months so the trend has at most {TREND_MAX_POINTS} points.",
+    )
+
+    # While a range is being picked, the date input holds only its start
+    started = time.perf_counter()
+    filtered = cube.filter(
+        start=date_range[0] if len(date_range) > 0 else None,
+        end=date_range[1] if len(date_range) > 1 else None,
+        platform=platforms or None,
+        sentiment=sentiments or None,
+    )
+    aggregates = filtered.aggregates()
+    # aggregates() is shared by every rerun with these filters, so the bucketed trend goes into a copy
+    engagement_trend, trend_bucket_used = bucket_trend(aggregates['engagement_trend'], trend_bucket, TREND_MAX_POINTS, finest='day')
+    aggregates = {**aggregates, 'engagement_trend': engagement_trend}
+    filter_seconds = time.perf_counter() - started
+    timer.add('filter', filter_seconds)
+
+    if filtered.rows == 0:
+        st.warning("No rows match the selected filters.")
+        return
+    st.caption(f"{filtered.rows} of {cube.rows} rows match the filters (aggregated in {filter_seconds * 1000:.0f} ms).")
+    # Filter changes don't call Gemini by themselves; this asks for the current filters
+    request_now = full_run or st.button("Generate AI insights", help="Ask Gemini for insights on the filtered data.")
+
+    with timer.span('prompts'):
+        prompts = build_insight_prompts(aggregates)
+
+    # Rule-based insights are ready at once and stand in for Gemini's until they arrive
+    with timer.span('insights.rules'):
+        fallback_insights = rule_based_insights(aggregates, engagement_trend, trend_bucket_used)
+
+    # Render every chart first, each with a placeholder showing the rule-based insights
+    insight_placeholders = {}
+    for key, title, create_chart in CHART_SECTIONS:
+        st.subheader(title)
+        # Create a dedicated container for the chart and its insights
+        with st.container():
+            with timer.span('charts.figures'):
+                fig = create_chart(aggregates)
+            # Serializes the figure and sends it to the browser
+            with timer.span('charts.send'):
+                st.plotly_chart(fig, width='stretch')
+            insight_placeholders[key] = st.empty()
+            with insight_placeholders[key].container():
+                st.markdown(f"**Top 3 Insights:**\n{format_insights(fallback_insights[key])}")
+                if request_now:
+                    st.caption(f"Generating AI insights for {title}...")
+        st.markdown("---") # Visual separator
+
+    if request_now:
+        # Request all five insights in the background (batched or per chart, see INSIGHT_REQUEST_MODE)
+        # and wait at most the latency budget; each section is replaced as its answer arrives
+        futures = request_insights(prompts, api_key=GEMINI_API_KEY)
+        # Numbered so rerun_when_insights_arrive can tell this request from later ones
+        request_id = st.session_state['insight_request'] = st.session_state.get('insight_request_count', 0) + 1
+        st.session_state['insight_request_count'] = request_id
+        with st.spinner("Generating insights..."), timer.span('insights'):
+            for key, insight, error in collect_within_budget(futures, INSIGHT_LATENCY_BUDGET_SECONDS):
+                fallback = fallback_insights.pop(key)
+                if error is None:
+                    insight_placeholders[key].markdown(f"**Top 3 Insights:**\n{insight}")
+                    continue
+                reason = str(error) if isinstance(error, InsightError) else f"an unexpected error occurred during API call: {error}"
+                with insight_placeholders[key].container():
+                    st.markdown(f"**Top 3 Insights:**\n{format_insights(fallback)}")
+                    st.caption(f"AI insights unavailable: {reason}")
+
+        # Sections still waiting keep their rule-based insights until the answers are cached
+        if fallback_insights:
+            for key, insights in fallback_insights.items():
+                with insight_placeholders[key].container():
+                    st.markdown(f"**Top 3 Insights:**\n{format_insights(insights)}")
+                    st.caption("AI insights are still being generated; they will replace these when ready.")
+            rerun_when_insights_arrive([futures[key] for key in fallback_insights], request_id)
+    else:
+        # Only insights already answered for these filters; earlier requests are no longer watched
+        st.session_state['insight_request'] = None
+        with timer.span('insights'):
+            for key, insight in get_cached_insights(prompts).items():
+                insight_placeholders[key].markdown(f"**Top 3 Insights:**\n{insight}")
+
+    if show_timings and not full_run:
+        st.caption("Stage timings of this filter update")
+        st.dataframe(timer.to_frame(), hide_index=True, width='stretch')
+
 # --- Main Streamlit App Logic ---
 
 # Main application title
@@ -393,25 +512,40 @@ st.title("Interactive Media Intelligence Dashboard")
 # --- Step 1: Upload CSV File ---
 st.markdown("---")
 st.header("1. Upload Your CSV File")
-uploaded_file = st.file_uploader(
-    "Choose a CSV file",
-    type="csv",
-    help="Expected columns: Date, Platform, Sentiment, Location, Engagements, Media Type"
+uploaded_files = st.file_uploader(
+    "Choose one or more CSV files (Parquet and Feather also work)",
+    type=["csv", "parquet", "pq", "feather", "arrow"],
+    accept_multiple_files=True,
+    help="Expected columns: Date, Platform, Sentiment, Location, Engagements, Media Type. "
+         "Several files (e.g. one export per platform or per day) are analyzed together."
 )
 
-# Process the file if uploaded
-if uploaded_file is not None:
-    st.success("File uploaded successfully! Processing data...")
-    try:
-        # Read the CSV into a pandas DataFrame
-        data_io = io.BytesIO(uploaded_file.getvalue())
-        raw_df = pd.read_csv(data_io)
+# Optional sidebar panel with the duration of each processing stage of this run
+show_timings = st.sidebar.toggle("Show stage timings", value=False)
+timer = StageTimer()
 
+# Process the files if uploaded
+if uploaded_files:
+    st.success(f"{len(uploaded_files)} file(s) uploaded successfully! Processing data...")
+    try:
         # --- Step 2: Data Cleaning & Normalization ---
-        # Call the cleaning function
-        cleaned_df = clean_data(raw_df.copy()) # Pass a copy to avoid modifying raw_df
-
-        if cleaned_df is not None and not cleaned_df.empty:
+        # Parse and clean the CSV, reusing the cached result when this content was seen before
+        with timer.span('hash'):
+            upload_hashes = tuple(get_upload_hash(uploaded_file) for uploaded_file in uploaded_files)
+        # 'load' is near zero when the cleaned data is already cached (no load.* stages then)
+        with timer.span('load'):
+            if len(uploaded_files) == 1:
+                cube = load_cube(upload_hashes[0], uploaded_files[0], _timer=timer)
+                # None when clean_data has already reported missing columns
+                rows = None if cube is None else cube.rows
+            else:
+                # Several files are cleaned and aggregated in parallel, straight into one merged cube
+                cube, dropped_rows = load_merged_cube(upload_hashes, uploaded_files)
+                if dropped_rows:
+                    st.warning(f"Removed {dropped_rows} rows due to invalid 'Date' values.")
+                rows = cube.rows
+
+        if rows:
             st.markdown("---")
             st.header("2. Data Cleaning & Normalization")
             st.markdown("""
@@ -420,89 +554,33 @@ if uploaded_file is not None:
                 * Missing 'Engagements' values filled with 0.
                 * Column names normalized (e.g., `'Media Type'` to `'media_type'`).
             """)
-            st.info(f"Successfully processed {len(cleaned_df)} rows of data.")
+            st.info(f"Successfully processed {rows} rows of data from {len(uploaded_files)} file(s).")
 
             # --- Step 3 & 4: Interactive Charts and Top Insights ---
             st.markdown("---")
             st.header("3. Interactive Charts & 4. Top Insights")
 
-            # --- Chart 1: Sentiment Breakdown ---
-            st.subheader("Sentiment Breakdown")
-            # Create a dedicated container for the chart and its insights
-            with st.container():
-                st.plotly_chart(create_sentiment_chart(cleaned_df), use_container_width=True)
-                sentiment_counts = cleaned_df['sentiment'].value_counts().to_dict()
-                sentiment_prompt = f"Based on the following sentiment counts from media data: {json.dumps(sentiment_counts)}. Provide top 3 concise insights."
-                with st.spinner("Generating insights for Sentiment Breakdown..."):
-                    sentiment_insights = call_gemini_api(sentiment_prompt)
-                st.markdown(f"**Top 3 Insights:**\n{sentiment_insights}")
-            st.markdown("---") # Visual separator
-
-            # --- Chart 2: Engagement Trend over time ---
-            st.subheader("Engagement Trend Over Time")
-            with st.container():
-                st.plotly_chart(create_engagement_trend_chart(cleaned_df), use_container_width=True)
-                # Prepare data for prompt: start, end date engagements
-                engagement_by_date = cleaned_df.groupby(cleaned_df['date'].dt.date)['engagements'].sum().reset_index()
-                if not engagement_by_date.empty:
-                    first_date = engagement_by_date.iloc[0]['date'].strftime('%Y-%m-%d')
-                    last_date = engagement_by_date.iloc[-1]['date'].strftime('%Y-%m-%d')
-                    initial_engagements = engagement_by_date.iloc[0]['Total Engagements']
-                    final_engagements = engagement_by_date.iloc[-1]['Total Engagements']
-                    trend_prompt = (f"Based on engagement data from {first_date} to {last_date}, "
-                                    f"with initial engagements of {initial_engagements} and final engagements of {final_engagements}. "
-                                    "Provide top 3 concise insights about the engagement trend.")
-                else:
-                    trend_prompt = "No engagement data available. Provide top 3 general insights about engagement trends in media analysis."
-
-                with st.spinner("Generating insights for Engagement Trend..."):
-                    engagement_insights = call_gemini_api(trend_prompt)
-                st.markdown(f"**Top 3 Insights:**\n{engagement_insights}")
-            st.markdown("---")
-
-            # --- Chart 3: Platform Engagements ---
-            st.subheader("Platform Engagements")
-            with st.container():
-                st.plotly_chart(create_platform_engagements_chart(cleaned_df), use_container_width=True)
-                # Get top 5 platforms by engagement for insight generation
-                platform_engagements_for_prompt = cleaned_df.groupby('platform')['engagements'].sum().sort_values(ascending=False).head(5).to_dict()
-                platform_prompt = f"Based on platform engagements: {json.dumps(platform_engagements_for_prompt)}. Provide top 3 concise insights."
-                with st.spinner("Generating insights for Platform Engagements..."):
-                    platform_insights = call_gemini_api(platform_prompt)
-                st.markdown(f"**Top 3 Insights:**\n{platform_insights}")
-            st.markdown("---")
-
-            # --- Chart 4: Media Type Mix ---
-            st.subheader("Media Type Mix")
-            with st.container():
-                st.plotly_chart(create_media_type_mix_chart(cleaned_df), use_container_width=True)
-                media_type_counts = cleaned_df['media_type'].value_counts().to_dict()
-                media_type_prompt = f"Based on media type counts: {json.dumps(media_type_counts)}. Provide top 3 concise insights."
-                with st.spinner("Generating insights for Media Type Mix..."):
-                    media_type_insights = call_gemini_api(media_type_prompt)
-                st.markdown(f"**Top 3 Insights:**\n{media_type_insights}")
-            st.markdown("---")
+            # Every chart and prompt reads from aggregates derived from the cube
+            st.session_state['charts_full_run'] = True
+            render_charts_and_insights(cube, timer, show_timings)
 
-            # --- Chart 5: Top 5 Locations ---
-            st.subheader("Top 5 Locations by Engagements")
-            with st.container():
-                st.plotly_chart(create_top_locations_chart(cleaned_df), use_container_width=True)
-                # Get top 5 locations by engagement for insight generation
-                top_locations_for_prompt = cleaned_df.groupby('location')['engagements'].sum().sort_values(ascending=False).head(5).to_dict()
-                location_prompt = f"Based on top 5 locations by engagement: {json.dumps(top_locations_for_prompt)}. Provide top 3 concise insights."
-                with st.spinner("Generating insights for Top 5 Locations..."):
-                    location_insights = call_gemini_api(location_prompt)
-                st.markdown(f"**Top 3 Insights:**\n{location_insights}")
-
-        elif cleaned_df is not None and cleaned_df.empty:
+        elif rows == 0:
             st.warning("The uploaded CSV file is empty or all rows were removed after cleaning due to invalid data.")
         else:
             # Error message already displayed by clean_data if columns are missing
             pass # No additional message needed here.
 
+    except AnalysisError as e:
+        st.error(f"Error: {e}")
     except pd.errors.EmptyDataError:
         st.error("The uploaded file is empty. Please upload a CSV with data.")
     except Exception as e:
         st.error(f"An unexpected error occurred while processing the file: {e}")
         st.info("Please ensure your CSV file is correctly formatted and contains the expected columns: 'Date', 'Platform', 'Sentiment', 'Location', 'Engagements', 'Media Type'.")
 
+if show_timings:
+    st.sidebar.subheader("Stage timings")
+    if timer.durations:
+        st.sidebar.dataframe(timer.to_frame(), hide_index=True, width='stretch')
+    else:
+        st.sidebar.caption("Upload a file to time its processing stages.")
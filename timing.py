@@ -0,0 +1,114 @@
+# timing.py - Per-stage timing spans and Prometheus histograms shared by the dashboards
+
+import threading
+import time
+from contextlib import contextmanager
+
+from startup import deferred_import
+
+# Only to_frame needs pandas
+pd = deferred_import('pandas')
+
+# Histogram bucket upper bounds in seconds, from quick cache hits to multi-minute uploads
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class StageTimer:
+    """
+    Collects wall-clock durations of named pipeline stages for one request or script run.
+    A stage timed more than once (e.g. per chunk) accumulates; stages keep the order in
+    which they were first recorded.
+    """
+
+    def __init__(self):
+        self.durations = {}
+
+    def add(self, stage, seconds):
+        """Adds seconds to the stage's total."""
+        self.durations[stage] = self.durations.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def span(self, stage):
+        """Times the body of a with-block as the given stage, even if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def iterate(self, stage, iterable):
+        """
+        Yields from iterable, timing only the time spent producing each item as the stage.
+        Used for chunk readers, whose parsing happens lazily inside next().
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(stage, time.perf_counter() - start)
+                return
+            self.add(stage, time.perf_counter() - start)
+            yield item
+
+    def server_timing(self):
+        """Formats the stages as a Server-Timing header value (durations in milliseconds)."""
+        return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.durations.items())
+
+    def to_frame(self):
+        """Returns the stages as a DataFrame with 'stage' and 'milliseconds' columns."""
+        return pd.DataFrame({
+            'stage': list(self.durations),
+            'milliseconds': [round(seconds * 1000, 1) for seconds in self.durations.values()],
+        })
+
+
+def _format_le(bound):
+    return "+Inf" if bound == float('inf') else repr(float(bound))
+
+
+class StageHistograms:
+    """
+    Cumulative per-stage duration histograms, rendered in the Prometheus text format.
+    Counts live in this process only; with several worker processes each one reports its own.
+    """
+
+    def __init__(self, name='dashboard_stage_duration_seconds', documentation="Duration of dashboard pipeline stages.",
+                 buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._lock = threading.Lock()
+        # stage -> (per-bucket counts (non-cumulative), sum, count)
+        self._stages = {}
+
+    def observe(self, stage, seconds):
+        """Records one duration for the stage."""
+        with self._lock:
+            counts, total, count = self._stages.get(stage) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counts[i] += 1
+                    break
+            self._stages[stage] = (counts, total + seconds, count + 1)
+
+    def observe_timer(self, timer):
+        """Records every stage of a StageTimer."""
+        for stage, seconds in timer.durations.items():
+            self.observe(stage, seconds)
+
+    def render(self):
+        """Returns all histograms in the Prometheus text exposition format."""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            stages = {stage: (list(counts), total, count) for stage, (counts, total, count) in self._stages.items()}
+        for stage, (counts, total, count) in sorted(stages.items()):
+            label = stage.replace('\\', '\\\\').replace('"', '\\"')
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{stage="{label}",le="{_format_le(bound)}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{stage="{label}"}} {total!r}')
+            lines.append(f'{self.name}_count{{stage="{label}"}} {count}')
+        return "\n".join(lines) + "\n"